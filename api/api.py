@@ -2,13 +2,51 @@
 Business logic cho API endpoints
 """
 
-from flask import jsonify
-from datetime import datetime
-from typing import Optional
-from database.mongodb import get_sensor_collection, get_client
+import tempfile
+from flask import Response, jsonify, send_file
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from config.settings import settings
+from database.mongodb import (
+    get_sensor_collection,
+    get_client,
+    timeseries_write_supported,
+    get_alerts_collection
+)
 from utils.logger import setup_logger
-from bson import json_util
-import json
+from utils.metrics import ingest_latency
+from utils.serialization import json_response
+from services.write_buffer import write_buffer
+from services.async_ingest import async_ingest
+from services.latest_cache import latest_cache
+from services.event_bus import EVENT_TYPES, event_bus
+from services.change_stream import change_stream
+from services.response_cache import cached, response_cache
+from services.alert_engine import ALERT_FIELDS, alert_engine
+from services.notification_dispatcher import notification_dispatcher
+from services.device_latest import device_latest_store
+from services.stats_counters import stats_counters
+from services.rollup import rollup_history, rollup_job, select_resolution
+from services.config_manager import config_manager
+from services.downsampling import (
+    DEFAULT_FIELDS,
+    DOWNSAMPLE_METHODS,
+    bucket_milliseconds,
+    bucket_pipeline,
+    format_buckets,
+    lttb_documents,
+    parse_duration,
+    parse_fields,
+    projection
+)
+from services.exporter import EXPORT_FORMATS, stream_export
+from services.columnar_export import (
+    COLUMNAR_FORMATS,
+    available as columnar_available,
+    build_query,
+    write_columnar
+)
+from services.pagination import SORT as PAGE_SORT, apply_cursor, next_cursor, page_size
 
 logger = setup_logger(__name__)
 
@@ -16,8 +54,15 @@ logger = setup_logger(__name__)
 class APIController:
     """Controller xử lý logic cho các API endpoints"""
     
-    def __init__(self):
-        self.collection = get_sensor_collection()
+    @property
+    def collection(self):
+        """
+        Collection sensor_data của client hiện tại
+        
+        Lấy lại mỗi lần (không giữ từ lúc import) để worker fork từ process khác
+        dùng client của chính nó.
+        """
+        return get_sensor_collection()
     
     def health_check(self):
         """
@@ -39,11 +84,25 @@ class APIController:
             "status": "ok" if mongodb_status == "connected" else "error",
             "mongodb": mongodb_status,
             "coap": "running",
+            "ingest": {
+                "mode": settings.COAP_INGEST_MODE,
+                "latency": ingest_latency.snapshot(),
+                "buffer": write_buffer.get_stats(),
+                "pipeline": async_ingest.get_stats()
+            },
+            "latestCache": latest_cache.get_stats(),
+            "rollup": rollup_job.get_status(),
+            "alerts": alert_engine.get_stats(),
+            "notifications": notification_dispatcher.get_stats(),
+            "stream": event_bus.get_stats(),
+            "changeStream": change_stream.get_stats(),
+            "responseCache": response_cache.get_stats(),
             "timestamp": datetime.utcnow().isoformat()
         }
         
         return jsonify(response)
     
+    @cached("records")
     def get_latest_devices(self):
         """
         Lấy dữ liệu mới nhất từ tất cả thiết bị
@@ -52,23 +111,18 @@ class APIController:
             JSON array của latest data từ mỗi device
         """
         try:
-            # Aggregate để lấy record mới nhất của mỗi device
-            pipeline = [
-                {"$sort": {"timestamp": -1}},
-                {"$group": {
-                    "_id": "$deviceId",
-                    "latestData": {"$first": "$$ROOT"}
-                }},
-                {"$replaceRoot": {"newRoot": "$latestData"}}
-            ]
-            
-            results = list(self.collection.aggregate(pipeline))
+            if device_latest_store.enabled:
+                # Collection device_latest (1 document / thiết bị)
+                results = device_latest_store.get_all()
+            elif latest_cache.authoritative:
+                # CoAP server chạy trong process này: đọc thẳng từ cache
+                results = latest_cache.get_all()
+            else:
+                # Ingest ở process khác: mỗi device một query theo index (deviceId, timestamp)
+                results = latest_cache.query_latest(self.collection)
             
-            # Convert ObjectId sang string
-            results_json = json.loads(json_util.dumps(results))
-            
-            logger.info(f"Retrieved latest data for {len(results_json)} devices")
-            return jsonify(results_json)
+            logger.info(f"Retrieved latest data for {len(results)} devices")
+            return json_response(results)
             
         except Exception as e:
             logger.error(f"Error getting latest devices: {e}")
@@ -77,7 +131,12 @@ class APIController:
     def get_device_history(self, device_id: str, 
                           from_time: Optional[str] = None,
                           to_time: Optional[str] = None,
-                          limit: int = 100):
+                          limit: int = 100,
+                          resolution: Optional[str] = None,
+                          max_points: Optional[int] = None,
+                          fields: Optional[str] = None,
+                          method: Optional[str] = None,
+                          after: Optional[str] = None):
         """
         Lấy lịch sử dữ liệu của một thiết bị
         
@@ -86,75 +145,328 @@ class APIController:
             from_time: Timestamp bắt đầu (ISO 8601 string)
             to_time: Timestamp kết thúc (ISO 8601 string)
             limit: Số lượng records tối đa
+            resolution: "raw" (mặc định), "1m", "1h", số giây mỗi điểm hoặc "auto";
+                        khác raw thì trả bucket rollup (có field "resolution") thay cho record
+            max_points: Downsample về tối đa max_points điểm (bỏ qua limit/resolution)
+            fields: Field trong data cần trả về, phân cách bằng dấu phẩy
+            method: Cách downsample: "avg" (mặc định) hoặc "lttb"
+            after: Cursor trang trước (header X-Next-Cursor), chỉ dùng với record thô
             
         Returns:
-            JSON array của historical data
+            JSON array của historical data (header X-Resolution cho biết nguồn dữ liệu,
+            X-Next-Cursor nếu còn trang kế tiếp)
         """
         try:
-            # Build query
-            query = {"deviceId": device_id}
-            
-            # Add time range nếu có
-            if from_time or to_time:
-                query["timestamp"] = {}
+            start = end = None
+            try:
                 if from_time:
-                    query["timestamp"]["$gte"] = datetime.fromisoformat(
-                        from_time.replace('Z', '+00:00'))
+                    start = datetime.fromisoformat(from_time.replace('Z', '+00:00'))
                 if to_time:
-                    query["timestamp"]["$lte"] = datetime.fromisoformat(
-                        to_time.replace('Z', '+00:00'))
+                    end = datetime.fromisoformat(to_time.replace('Z', '+00:00'))
+            except ValueError as e:
+                logger.error(f"Invalid datetime format: {e}")
+                return jsonify({"error": "Invalid datetime format. Use ISO 8601"}), 400
             
-            # Query database
-            results = list(
+            try:
+                selected_fields = parse_fields(fields)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            
+            if max_points:
+                return self._get_downsampled_history(
+                    device_id, start, end, max_points, selected_fields, method or "avg"
+                )
+            
+            limit = page_size(limit)
+            
+            try:
+                # Cursor chỉ áp dụng cho record thô
+                source = "raw" if after else select_resolution(resolution, start, end, limit)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            
+            if source == "raw":
+                query = {"deviceId": device_id}
+                if start or end:
+                    query["timestamp"] = {}
+                    if start:
+                        query["timestamp"]["$gte"] = start
+                    if end:
+                        query["timestamp"]["$lte"] = end
+                try:
+                    query = apply_cursor(query, after)
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
+                
+                # Query database (index deviceId + timestamp + _id)
+                results = list(
+                    self.collection
+                    .find(query, projection(selected_fields))
+                    .sort(PAGE_SORT)
+                    .limit(limit)
+                )
+            else:
+                # Bucket rollup (min/max/mean, field "resolution") thay cho record thô;
+                # phần rollup job chưa tính được group trực tiếp từ record thô
+                results = rollup_history(device_id, source, start, end, limit)
+            
+            logger.info(f"Retrieved {len(results)} {source} records for device {device_id}")
+            response = json_response(results)
+            response.headers["X-Resolution"] = source
+            cursor = next_cursor(results, limit) if source == "raw" else None
+            if cursor:
+                response.headers["X-Next-Cursor"] = cursor
+            return response
+            
+        except Exception as e:
+            logger.error(f"Error getting device history: {e}")
+            return jsonify({"error": str(e)}), 500
+    
+    def _get_downsampled_history(self, device_id: str,
+                                 start: Optional[datetime],
+                                 end: Optional[datetime],
+                                 max_points: int,
+                                 fields: Optional[List[str]],
+                                 method: str):
+        """
+        History đã downsample về tối đa max_points điểm
+        
+        Args:
+            device_id: ID của thiết bị
+            start, end: Khoảng thời gian (mặc định: display_settings.default_chart_range tới hiện tại)
+            max_points: Số điểm tối đa (giới hạn bởi MAX_HISTORY_POINTS)
+            fields: Field trong data (None = DEFAULT_FIELDS)
+            method: "avg" ($group theo bucket trong MongoDB) hoặc "lttb" (NumPy)
+            
+        Returns:
+            JSON array tăng dần theo thời gian (header X-Downsample cho biết cách downsample)
+        """
+        if method not in DOWNSAMPLE_METHODS:
+            return jsonify({"error": f"method must be one of {', '.join(DOWNSAMPLE_METHODS)}"}), 400
+        if max_points < 3:
+            return jsonify({"error": "max_points must be >= 3"}), 400
+        
+        max_points = min(max_points, settings.MAX_HISTORY_POINTS)
+        fields = fields or list(DEFAULT_FIELDS)
+        
+        if end is None:
+            end = datetime.now(timezone.utc) if start is not None and start.tzinfo else datetime.utcnow()
+        if start is None:
+            chart_range = config_manager.get("display_settings.default_chart_range", "24h")
+            try:
+                start = end - parse_duration(chart_range)
+            except ValueError:
+                start = end - timedelta(hours=24)
+        
+        query = {"deviceId": device_id, "timestamp": {"$gte": start, "$lte": end}}
+        
+        if method == "lttb":
+            documents = list(
                 self.collection
-                .find(query)
-                .sort("timestamp", -1)
-                .limit(limit)
+                .find(query, projection(fields))
+                .sort("timestamp", 1)
+                .limit(settings.LTTB_MAX_INPUT + 1)
             )
+            if len(documents) <= settings.LTTB_MAX_INPUT:
+                points = lttb_documents(documents, max_points, fields[0])
+                response = json_response(points)
+                response.headers["X-Downsample"] = f"lttb:{len(documents)}"
+                return response
             
-            # Convert ObjectId sang string
-            results_json = json.loads(json_util.dumps(results))
-            
-            logger.info(f"Retrieved {len(results_json)} records for device {device_id}")
-            return jsonify(results_json)
+            logger.warning(f"LTTB input over {settings.LTTB_MAX_INPUT} records, using avg buckets")
+        
+        bucket_ms = bucket_milliseconds(start, end, max_points)
+        buckets = list(self.collection.aggregate(
+            bucket_pipeline(query, start, bucket_ms, fields), allowDiskUse=True
+        ))
+        points = format_buckets(buckets, fields)
+        
+        logger.info(f"Downsampled history for {device_id}: {len(points)} buckets of {bucket_ms}ms")
+        response = json_response(points)
+        response.headers["X-Downsample"] = f"avg:{bucket_ms}ms"
+        return response
+    
+    def export_device_history(self, device_id: Optional[str],
+                              from_time: Optional[str] = None,
+                              to_time: Optional[str] = None,
+                              export_format: str = "ndjson",
+                              fields: Optional[str] = None,
+                              compress: bool = False):
+        """
+        Export toàn bộ lịch sử của thiết bị (hoặc tất cả thiết bị)
+        
+        Args:
+            device_id: ID của thiết bị (None = tất cả thiết bị)
+            from_time: Timestamp bắt đầu (ISO format)
+            to_time: Timestamp kết thúc (ISO format)
+            export_format: "ndjson" (mặc định), "csv" (streaming),
+                           "arrow" hoặc "parquet" (dạng cột, cần pyarrow)
+            fields: Field trong data cần export, phân cách bằng dấu phẩy
+            compress: Trả về file .gz (application/gzip), chỉ với ndjson/csv
             
+        Returns:
+            File download, record tăng dần theo thời gian
+        """
+        if export_format not in EXPORT_FORMATS and export_format not in COLUMNAR_FORMATS:
+            formats = list(EXPORT_FORMATS) + list(COLUMNAR_FORMATS)
+            return jsonify({"error": f"format must be one of {', '.join(formats)}"}), 400
+        
+        try:
+            start = datetime.fromisoformat(from_time.replace('Z', '+00:00')) if from_time else None
+            end = datetime.fromisoformat(to_time.replace('Z', '+00:00')) if to_time else None
         except ValueError as e:
             logger.error(f"Invalid datetime format: {e}")
             return jsonify({"error": "Invalid datetime format. Use ISO 8601"}), 400
+        
+        try:
+            selected_fields = parse_fields(fields)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        query = build_query(device_id, start, end)
+        name = device_id or "sensor_data"
+        
+        if export_format in COLUMNAR_FORMATS:
+            return self._export_columnar(query, name, export_format, selected_fields)
+        
+        filename = f"{name}.{export_format}" + (".gz" if compress else "")
+        
+        logger.info(f"Exporting history as {filename}")
+        return Response(
+            stream_export(self.collection, query, export_format, selected_fields, compress),
+            mimetype="application/gzip" if compress else EXPORT_FORMATS[export_format],
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+    
+    def _export_columnar(self, query: dict, name: str, export_format: str,
+                         fields: Optional[List[str]]):
+        """
+        Export Arrow IPC / Parquet
+        
+        File được ghi theo batch vào file tạm (footer Arrow/Parquet nằm cuối file
+        nên không stream trực tiếp được) rồi gửi đi.
+        """
+        if not columnar_available():
+            return jsonify({"error": "Columnar export requires pyarrow"}), 501
+        
+        mimetype, extension = COLUMNAR_FORMATS[export_format]
+        spool = tempfile.TemporaryFile()
+        try:
+            write_columnar(self.collection, query, export_format, spool, fields)
+            spool.seek(0)
         except Exception as e:
-            logger.error(f"Error getting device history: {e}")
+            spool.close()
+            logger.error(f"Error exporting {export_format}: {e}")
             return jsonify({"error": str(e)}), 500
+        
+        return send_file(spool, mimetype=mimetype, as_attachment=True,
+                         download_name=f"{name}.{extension}")
     
-    def get_alerts(self, limit: int = 50):
+    def stream_events(self, devices: Optional[str] = None, events: Optional[str] = None):
         """
-        Lấy danh sách cảnh báo (severity = danger hoặc critical)
+        Push record/cảnh báo mới qua Server-Sent Events thay cho polling
         
         Args:
-            limit: Số lượng alerts tối đa
+            devices: deviceId phân cách bằng dấu phẩy (None = tất cả thiết bị)
+            events: "reading", "alert" phân cách bằng dấu phẩy (None = cả hai)
             
         Returns:
-            JSON array của alerts
+            Response text/event-stream; event "dropped" khi client đọc chậm bị ngắt
+        """
+        device_ids = [d.strip() for d in devices.split(",") if d.strip()] if devices else None
+        event_types = [e.strip() for e in events.split(",") if e.strip()] if events else None
+        
+        unknown = [e for e in event_types or () if e not in EVENT_TYPES]
+        if unknown:
+            return jsonify({"error": f"events must be in {', '.join(EVENT_TYPES)}"}), 400
+        
+        subscription = event_bus.subscribe(device_ids, event_types)
+        if subscription is None:
+            return jsonify({"error": "Too many stream clients"}), 503
+        
+        def generate():
+            try:
+                # EventSource tự kết nối lại sau 3 giây
+                yield b"retry: 3000\n\n"
+                while True:
+                    message = subscription.get(settings.SSE_HEARTBEAT)
+                    if subscription.dropped:
+                        yield b"event: dropped\ndata: {}\n\n"
+                        return
+                    # Comment giữ kết nối và phát hiện client đã ngắt
+                    yield message or b": keepalive\n\n"
+            finally:
+                event_bus.unsubscribe(subscription)
+        
+        logger.info(f"Stream client connected (devices={device_ids or 'all'})")
+        return Response(generate(), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        })
+    
+    @cached("alerts")
+    def get_alerts(self, limit: int = 50,
+                   fields: Optional[str] = None,
+                   after: Optional[str] = None,
+                   status: Optional[str] = None):
+        """
+        Lấy danh sách cảnh báo
+        
+        Với alert engine (mặc định): đọc collection alerts, mỗi đợt danger/critical của
+        một thiết bị là một alert. Tắt alert engine hoặc chưa backfill xong: mỗi record
+        danger/critical là một alert.
+        
+        Args:
+            limit: Số lượng alerts tối đa (giới hạn bởi MAX_PAGE_SIZE)
+            fields: Field trong data cần trả về, phân cách bằng dấu phẩy
+            after: Cursor trang trước (header X-Next-Cursor)
+            status: "open" hoặc "closed" (None = tất cả), chỉ dùng với alert engine
+            
+        Returns:
+            JSON array của alerts (header X-Next-Cursor nếu còn trang kế tiếp)
         """
         try:
-            # Query alerts
-            query = {"severity": {"$in": ["danger", "critical"]}}
+            limit = page_size(limit)
+            
+            if status not in (None, "open", "closed"):
+                return jsonify({"error": "status must be 'open' or 'closed'"}), 400
+            
+            try:
+                selected_fields = parse_fields(fields)
+                fields_projection = projection(selected_fields)
+                
+                # Tới khi backfill xong, collection alerts chưa có alert cũ: đọc theo cách cũ
+                if alert_engine.enabled and alert_engine.backfilled():
+                    collection = get_alerts_collection()
+                    query = apply_cursor({"status": status} if status else {}, after)
+                    if fields_projection is not None:
+                        fields_projection.update({field: 1 for field in ALERT_FIELDS})
+                else:
+                    # Query alerts
+                    collection = self.collection
+                    query = apply_cursor({"severity": {"$in": ["danger", "critical"]}}, after)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            
             results = list(
-                self.collection
-                .find(query)
-                .sort("timestamp", -1)
+                collection
+                .find(query, fields_projection)
+                .sort(PAGE_SORT)
                 .limit(limit)
             )
             
-            # Convert ObjectId sang string
-            results_json = json.loads(json_util.dumps(results))
-            
-            logger.info(f"Retrieved {len(results_json)} alerts")
-            return jsonify(results_json)
+            logger.info(f"Retrieved {len(results)} alerts")
+            response = json_response(results)
+            cursor = next_cursor(results, limit)
+            if cursor:
+                response.headers["X-Next-Cursor"] = cursor
+            return response
             
         except Exception as e:
             logger.error(f"Error getting alerts: {e}")
             return jsonify({"error": str(e)}), 500
     
+    @cached("records", "stats")
     def get_statistics(self):
         """
         Lấy thống kê tổng quan
@@ -163,19 +475,16 @@ class APIController:
             JSON object với các thống kê
         """
         try:
-            # Count total devices
-            total_devices = len(self.collection.distinct("deviceId"))
+            # Thiết bị có data trong 5 phút gần nhất được tính là active
+            five_minutes_ago = datetime.utcnow() - timedelta(minutes=5)
             
-            # Count active devices (có data trong 5 phút gần nhất)
-            five_minutes_ago = datetime.utcnow()
-            five_minutes_ago = five_minutes_ago.replace(
-                minute=five_minutes_ago.minute - 5
-            )
-            active_devices = len(
-                self.collection.distinct("deviceId", {
-                    "timestamp": {"$gte": five_minutes_ago}
-                })
-            )
+            if stats_counters.enabled:
+                # Bộ đếm tăng dần: thời gian hằng số, không quét sensor_data
+                stats = stats_counters.get_summary(five_minutes_ago)
+                stats["lastUpdated"] = datetime.utcnow().isoformat()
+                return jsonify(stats)
+            
+            total_devices, active_devices = self._count_devices(five_minutes_ago)
             
             # Count alerts by severity
             critical_alerts = self.collection.count_documents({
@@ -203,6 +512,84 @@ class APIController:
             logger.error(f"Error getting statistics: {e}")
             return jsonify({"error": str(e)}), 500
     
+    @cached("records", "stats")
+    def get_statistics_timeline(self, resolution: str = "minute", hours: int = 1):
+        """
+        Số record theo severity trong từng phút/giờ (từ bộ đếm, không quét sensor_data)
+        
+        Args:
+            resolution: "minute" hoặc "hour"
+            hours: Khoảng thời gian tính từ hiện tại (giờ), tối đa
+                   STATS_MINUTE_RETENTION_DAYS * 24 (minute) hoặc STATS_TIMELINE_MAX_HOURS (hour)
+            
+        Returns:
+            JSON array các bucket tăng dần theo thời gian
+        """
+        if resolution not in ("minute", "hour"):
+            return jsonify({"error": "resolution must be 'minute' or 'hour'"}), 400
+        
+        # Bucket phút cũ hơn retention đã bị TTL xóa; hours quá lớn làm timedelta tràn
+        max_hours = (settings.STATS_MINUTE_RETENTION_DAYS * 24 if resolution == "minute"
+                     else settings.STATS_TIMELINE_MAX_HOURS)
+        if not 1 <= hours <= max_hours:
+            return jsonify({"error": f"hours must be between 1 and {max_hours}"}), 400
+        
+        try:
+            since = datetime.utcnow() - timedelta(hours=hours)
+            buckets = stats_counters.get_timeline(since, resolution)
+            for bucket in buckets:
+                bucket["start"] = bucket["start"].isoformat()
+            return jsonify(buckets)
+            
+        except Exception as e:
+            logger.error(f"Error getting statistics timeline: {e}")
+            return jsonify({"error": str(e)}), 500
+    
+    def rebuild_statistics(self):
+        """
+        Tính lại bộ đếm thống kê từ sensor_data (khi bộ đếm bị lệch)
+        
+        Returns:
+            JSON response
+        """
+        try:
+            total = stats_counters.rebuild()
+            response_cache.invalidate()
+            return jsonify({
+                "status": "success",
+                "records": total
+            })
+        except Exception as e:
+            logger.error(f"Error rebuilding statistics: {e}")
+            return jsonify({"error": str(e)}), 500
+    
+    def _count_devices(self, active_since: datetime):
+        """
+        Đếm tổng số thiết bị và số thiết bị active
+        
+        Args:
+            active_since: Thiết bị có data từ mốc này trở đi được tính là active
+            
+        Returns:
+            (total_devices, active_devices)
+        """
+        if device_latest_store.enabled:
+            return (device_latest_store.count_devices(),
+                    device_latest_store.count_devices(since=active_since))
+        
+        if latest_cache.authoritative:
+            latest = latest_cache.get_all()
+            return (len(latest),
+                    sum(1 for document in latest if document["timestamp"] >= active_since))
+        
+        total_devices = len(self.collection.distinct("deviceId"))
+        active_devices = len(
+            self.collection.distinct("deviceId", {
+                "timestamp": {"$gte": active_since}
+            })
+        )
+        return total_devices, active_devices
+    
     def delete_records(self, params: dict):
         """
         Xóa dữ liệu cảm biến
@@ -232,8 +619,27 @@ class APIController:
                     query["timestamp"]["$lte"] = datetime.fromisoformat(
                         to_time.replace('Z', '+00:00'))
             
+            if set(query) - {"deviceId"} and not timeseries_write_supported():
+                return jsonify({"error": "Time-series storage on this MongoDB version only "
+                                         "supports deleting by device_id"}), 400
+            
+            # Trừ bộ đếm thống kê trước khi xóa
+            if stats_counters.enabled:
+                counted_devices = stats_counters.adjust_deleted(query)
+            
             # Delete documents
             result = self.collection.delete_many(query)
+            if stats_counters.enabled:
+                # Thiết bị bị xóa record gần đây không còn được tính là active
+                stats_counters.refresh_last_seen(counted_devices)
+            if alert_engine.enabled:
+                # Alert đang mở vẫn được alert engine cập nhật nên giữ lại
+                get_alerts_collection().delete_many({**query, "status": "closed"})
+            if result.deleted_count:
+                latest_cache.refresh(device_id)
+                response_cache.invalidate()
+                if device_latest_store.enabled:
+                    device_latest_store.rebuild(device_id)
             
             logger.info(f"Deleted {result.deleted_count} records")
             return jsonify({
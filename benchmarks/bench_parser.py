@@ -0,0 +1,87 @@
+"""
+Micro-benchmark cho DataParser
+So sánh packets/s giữa strict mode (Pydantic) và fast path
+
+Usage:
+    python benchmarks/bench_parser.py --packets 50000
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import logging
+import random
+import time
+from services import data_parser
+from services.data_parser import parser
+from services.severity_analyzer import analyzer
+
+
+def make_payloads(count: int) -> list:
+    """Tạo payload JSON compact giống ESP32"""
+    payloads = []
+    for i in range(count):
+        payloads.append(json.dumps({
+            "id": f"ESP{i % 100:03d}",
+            "ts": 1735123456789 + i,
+            "ax": random.uniform(-1, 1),
+            "ay": random.uniform(-1, 1),
+            "az": random.uniform(9.5, 10.1),
+            "gx": random.uniform(-0.1, 0.1),
+            "gy": random.uniform(-0.1, 0.1),
+            "gz": random.uniform(-0.1, 0.1),
+            "mx": 25.5,
+            "my": -12.3,
+            "mz": 48.7,
+            "tilt": random.uniform(0, 35),
+            "lat": 21.0285,
+            "lon": 105.8542
+        }).encode())
+    return payloads
+
+
+def bench(name: str, payloads: list, strict: bool) -> float:
+    """Parse + tính severity cho toàn bộ payload, trả về packets/s"""
+    started = time.perf_counter()
+    for payload in payloads:
+        document = parser.parse_document(payload, strict=strict)
+        analyzer.analyze_document(document)
+    elapsed = time.perf_counter() - started
+
+    rate = len(payloads) / elapsed
+    print(f"  {name:<24} {rate:>12,.0f} packets/s  ({elapsed * 1e6 / len(payloads):.2f} µs/packet)")
+    return rate
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="DataParser micro-benchmark")
+    arg_parser.add_argument("--packets", type=int, default=50000)
+    args = arg_parser.parse_args()
+
+    logging.disable(logging.ERROR)
+    payloads = make_payloads(args.packets)
+
+    # Hai mode phải cho cùng document (trừ timestamp khi thiếu ts)
+    for payload in payloads[:100]:
+        assert parser.parse_document(payload, strict=True) == parser.parse_document(payload, strict=False)
+
+    print(f"Parsing {args.packets} packets")
+    strict_rate = bench("strict (Pydantic)", payloads, strict=True)
+
+    fast_rate = bench(f"fast ({'orjson' if data_parser.orjson else 'json'})", payloads, strict=False)
+
+    if data_parser.orjson is not None:
+        # So sánh thêm fast path với json chuẩn
+        loads, data_parser._json_loads = data_parser._json_loads, json.loads
+        bench("fast (json)", payloads, strict=False)
+        data_parser._json_loads = loads
+
+    print(f"  speedup: {fast_rate / strict_rate:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Micro-benchmark cho serialize response API
+So sánh jsonify(json.loads(json_util.dumps(...))) với utils.serialization.json_response
+
+Usage:
+    python benchmarks/bench_serialization.py --documents 10000
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId, json_util
+from flask import Flask, jsonify
+from utils import serialization
+from utils.serialization import json_response
+
+
+def make_documents(count: int) -> list:
+    """Document giống record trong sensor_data"""
+    started = datetime(2025, 1, 1)
+    documents = []
+    for i in range(count):
+        documents.append({
+            "_id": ObjectId(),
+            "deviceId": f"ESP{i % 100:03d}",
+            "timestamp": started + timedelta(milliseconds=100 * i),
+            "data": {
+                "accel_x": random.uniform(-1, 1),
+                "accel_y": random.uniform(-1, 1),
+                "accel_z": random.uniform(9.5, 10.1),
+                "gyro_x": random.uniform(-0.1, 0.1),
+                "gyro_y": random.uniform(-0.1, 0.1),
+                "gyro_z": random.uniform(-0.1, 0.1),
+                "tilt_angle": random.uniform(0, 35)
+            },
+            "location": {"lat": 21.0285, "lon": 105.8542},
+            "severity": "normal",
+            "thresholdVersion": 1735123456789,
+            "createdAt": started + timedelta(milliseconds=100 * i + 7)
+        })
+    return documents
+
+
+def legacy_response(documents: list):
+    """Cách cũ: dumps -> loads -> jsonify"""
+    return jsonify(json.loads(json_util.dumps(documents)))
+
+
+def bench(name: str, build, documents: list, repeat: int) -> float:
+    """Thời gian trung bình (ms) để tạo response body"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        build(documents).get_data()
+    elapsed = (time.perf_counter() - started) / repeat * 1000
+
+    print(f"  {name:<28} {elapsed:>9.2f} ms/response")
+    return elapsed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="API serialization micro-benchmark")
+    arg_parser.add_argument("--documents", type=int, default=10000)
+    arg_parser.add_argument("--repeat", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    documents = make_documents(args.documents)
+
+    with Flask(__name__).app_context():
+        # Hai cách phải cho cùng JSON
+        assert json.loads(legacy_response(documents).get_data()) == json.loads(json_response(documents).get_data())
+
+        print(f"Serializing {args.documents} documents")
+        legacy = bench("json_util + loads + jsonify", legacy_response, documents, args.repeat)
+        single = bench(f"json_response ({'orjson' if serialization.orjson else 'json'})",
+                       json_response, documents, args.repeat)
+
+        if serialization.orjson is not None:
+            # So sánh thêm encoder một lượt với json chuẩn
+            orjson, serialization.orjson = serialization.orjson, None
+            bench("json_response (json)", json_response, documents, args.repeat)
+            serialization.orjson = orjson
+
+    print(f"  speedup: {legacy / single:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark severity analysis: từng object vs vectorized
+
+Usage:
+    python benchmarks/bench_severity.py --rows 1000000
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import logging
+import time
+import numpy as np
+from services.severity_analyzer import analyzer, SEVERITY_LEVELS
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Severity analysis benchmark")
+    arg_parser.add_argument("--rows", type=int, default=1000000)
+    args = arg_parser.parse_args()
+
+    logging.disable(logging.ERROR)
+    rng = np.random.default_rng(42)
+    tilt = rng.uniform(-40, 40, args.rows)
+    ax = rng.normal(0, 3, args.rows)
+    ay = rng.normal(0, 3, args.rows)
+    az = rng.normal(9.8, 3, args.rows)
+
+    # Per-object: giới hạn số dòng để benchmark không quá lâu
+    sample = min(args.rows, 200000)
+    started = time.perf_counter()
+    scalar = [
+        analyzer.classify(abs(t), (x * x + y * y + z * z) ** 0.5)
+        for t, x, y, z in zip(tilt[:sample].tolist(), ax[:sample].tolist(),
+                              ay[:sample].tolist(), az[:sample].tolist())
+    ]
+    scalar_rate = sample / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    codes, _ = analyzer.calculate_severity_batch(tilt, ax, ay, az)
+    vector_rate = args.rows / (time.perf_counter() - started)
+
+    assert [SEVERITY_LEVELS[c] for c in codes[:sample].tolist()] == scalar
+
+    print(f"Rows: {args.rows}")
+    print(f"  per-object   {scalar_rate:>14,.0f} rows/s")
+    print(f"  vectorized   {vector_rate:>14,.0f} rows/s")
+    print(f"  speedup: {vector_rate / scalar_rate:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Load test cho CoAP ingest
+Gửi nhiều POST đồng thời tới /api/records/upload và đo throughput + latency
+
+Usage:
+    python benchmarks/coap_load.py --requests 5000 --concurrency 200
+    COAP_INGEST_MODE=async python main.py   # so sánh với mode mặc định "buffered"
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from aiocoap import Context, Message, POST
+from utils.metrics import LatencyTracker
+
+
+def make_payload(device_index: int) -> bytes:
+    """Tạo payload JSON giống ESP32"""
+    return json.dumps({
+        "id": f"ESP{device_index:03d}",
+        "ts": int(time.time() * 1000),
+        "ax": random.uniform(-1, 1),
+        "ay": random.uniform(-1, 1),
+        "az": random.uniform(9.5, 10.1),
+        "gx": random.uniform(-0.1, 0.1),
+        "gy": random.uniform(-0.1, 0.1),
+        "gz": random.uniform(-0.1, 0.1),
+        "mx": 25.5,
+        "my": -12.3,
+        "mz": 48.7,
+        "tilt": random.uniform(0, 25),
+        "lat": 21.0285,
+        "lon": 105.8542
+    }).encode()
+
+
+async def run(uri: str, total: int, concurrency: int, devices: int):
+    context = await Context.create_client_context()
+    latency = LatencyTracker("client", window=total)
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                request = Message(code=POST, uri=uri, payload=make_payload(i % devices))
+                response = await context.request(request).response
+                if json.loads(response.payload).get("status") != "success":
+                    errors += 1
+            except Exception:
+                errors += 1
+            latency.observe(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+
+    stats = latency.snapshot()
+    print(f"Requests:    {total} (concurrency {concurrency}, {devices} devices)")
+    print(f"Errors:      {errors}")
+    print(f"Elapsed:     {elapsed:.2f}s")
+    print(f"Throughput:  {total / elapsed:.1f} req/s")
+    print(f"Latency:     p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms max={stats['max_ms']}ms")
+
+    await context.shutdown()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="CoAP ingest load test")
+    arg_parser.add_argument("--uri", default="coap://127.0.0.1:5683/api/records/upload")
+    arg_parser.add_argument("--requests", type=int, default=2000)
+    arg_parser.add_argument("--concurrency", type=int, default=100)
+    arg_parser.add_argument("--devices", type=int, default=50)
+    args = arg_parser.parse_args()
+
+    asyncio.run(run(args.uri, args.requests, args.concurrency, args.devices))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Load test cho HTTP API
+Gửi nhiều GET đồng thời và đo throughput + latency, dùng để so sánh
+server dev của Flask (python main.py) với gunicorn (gunicorn -c gunicorn.conf.py wsgi:app)
+
+Usage:
+    python benchmarks/http_load.py --path /api/devices/latest --requests 5000 --concurrency 50
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from utils.metrics import LatencyTracker
+
+
+def login(base_url: str, username: str, password: str) -> Optional[str]:
+    """Lấy token (None nếu login thất bại)"""
+    request = urllib.request.Request(
+        f"{base_url}/api/auth/login",
+        data=json.dumps({"username": username, "password": password}).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.loads(response.read()).get("token")
+    except urllib.error.URLError as e:
+        print(f"Login failed: {e}")
+        return None
+
+
+def run(base_url: str, path: str, total: int, concurrency: int, token: Optional[str]):
+    latency = LatencyTracker("client", window=total)
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    errors = 0
+
+    def one(_: int):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            request = urllib.request.Request(f"{base_url}{path}", headers=headers)
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+        except (urllib.error.URLError, OSError):
+            errors += 1
+        latency.observe(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+
+    stats = latency.snapshot()
+    print(f"Requests:    {total} GET {path} (concurrency {concurrency})")
+    print(f"Errors:      {errors}")
+    print(f"Elapsed:     {elapsed:.2f}s")
+    print(f"Throughput:  {total / elapsed:.1f} req/s")
+    print(f"Latency:     p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms max={stats['max_ms']}ms")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="HTTP API load test")
+    arg_parser.add_argument("--url", default="http://127.0.0.1:3000")
+    arg_parser.add_argument("--path", default="/api/devices/latest")
+    arg_parser.add_argument("--requests", type=int, default=2000)
+    arg_parser.add_argument("--concurrency", type=int, default=50)
+    arg_parser.add_argument("--username", default="user")
+    arg_parser.add_argument("--password", default="user123")
+    arg_parser.add_argument("--no-auth", action="store_true", help="Không login (vd: /health)")
+    args = arg_parser.parse_args()
+
+    token = None if args.no_auth else login(args.url, args.username, args.password)
+    run(args.url, args.path, args.requests, args.concurrency, token)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Notification storm: nhiều thiết bị cùng vào/ra trạng thái danger
+Đo thời gian alert_engine.process() (ingest path) khi dispatcher đang gửi tới
+HTTP stand-in local (webhook + SMS gateway) chậm/lỗi, rồi in thống kê gửi
+
+Usage:
+    python benchmarks/notify_storm.py --devices 200 --cycles 20 --delay 0.2
+    python benchmarks/notify_storm.py --no-notify      # so sánh khi không gửi thông báo
+
+Email: chạy SMTP debug server local (pip install aiosmtpd) rồi thêm --smtp:
+    python -m aiosmtpd -n -l 127.0.0.1:1025
+    python benchmarks/notify_storm.py --smtp 127.0.0.1:1025
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter
+from config.settings import settings
+from services.alert_engine import alert_engine
+from services.config_manager import config_manager
+from services.notification_dispatcher import notification_dispatcher
+from services.notification_senders import EmailSender, SmsGatewaySender, WebhookSender
+from utils.metrics import LatencyTracker
+
+
+def start_http_mock(delay: float, fail_rate: float) -> tuple:
+    """HTTP server nhận POST, chờ delay giây, trả 500 với xác suất fail_rate"""
+    received = Counter()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(delay)
+            if random.random() < fail_rate:
+                self.send_response(500)
+            else:
+                received[self.path] += 1
+                self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, received
+
+
+def make_document(device_id: str, timestamp: datetime, alerting: bool) -> dict:
+    """Reading danger (tilt 25°) hoặc normal (tilt 2°)"""
+    return {
+        "deviceId": device_id,
+        "timestamp": timestamp,
+        "severity": "danger" if alerting else "normal",
+        "thresholdVersion": config_manager.snapshot.version,
+        "data": {"tilt_angle": 25.0 if alerting else 2.0,
+                 "accel_x": 0.0, "accel_y": 0.0, "accel_z": 9.8}
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Notification storm benchmark")
+    arg_parser.add_argument("--devices", type=int, default=200)
+    arg_parser.add_argument("--cycles", type=int, default=20, help="Số lần vào/ra danger mỗi thiết bị")
+    arg_parser.add_argument("--delay", type=float, default=0.2, help="Độ trễ của HTTP stand-in (giây)")
+    arg_parser.add_argument("--fail-rate", type=float, default=0.0,
+                            help="Tỉ lệ lỗi 500 (dead letter cần MongoDB)")
+    arg_parser.add_argument("--smtp", help="host:port của SMTP debug server")
+    arg_parser.add_argument("--no-notify", action="store_true", help="Không chạy dispatcher")
+    args = arg_parser.parse_args()
+
+    server, received = start_http_mock(args.delay, args.fail_rate)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    # Webhook chỉ gửi tới host trong allow-list
+    settings.NOTIFY_WEBHOOK_ALLOWED_HOSTS = "127.0.0.1"
+
+    alert_settings = {
+        "min_duration_seconds": 0,
+        "clear_duration_seconds": 0,
+        "enable_webhook": True,
+        "webhook_urls": [f"{base_url}/webhook"],
+        "enable_sms": True,
+        "sms_recipients": ["+84900000001", "+84900000002"],
+        "enable_email": bool(args.smtp),
+        "email_recipients": ["oncall@example.com"]
+    }
+    config_manager.update({"alert_settings": alert_settings})
+
+    if not args.no_notify:
+        notification_dispatcher.register(WebhookSender())
+        notification_dispatcher.register(SmsGatewaySender(url=f"{base_url}/sms"))
+        if args.smtp:
+            host, port = args.smtp.split(":")
+            notification_dispatcher.register(EmailSender(host, int(port)))
+        notification_dispatcher.start()
+
+    latency = LatencyTracker("process", window=args.cycles * 2)
+    devices = [f"ESP{index:03d}" for index in range(args.devices)]
+    timestamp = datetime.utcnow()
+
+    started = time.perf_counter()
+    for cycle in range(args.cycles * 2):
+        timestamp += timedelta(seconds=5)
+        batch = [make_document(device_id, timestamp, cycle % 2 == 0) for device_id in devices]
+        begin = time.perf_counter()
+        alert_engine.process(batch)
+        latency.observe(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+
+    stats = latency.snapshot()
+    engine = alert_engine.get_stats()
+    print(f"Readings:    {args.devices * args.cycles * 2} ({args.devices} devices)")
+    print(f"Transitions: opened={engine['opened']} closed={engine['closed']}")
+    print(f"Ingest path: {elapsed:.2f}s, process() per batch of {args.devices}: "
+          f"p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms max={stats['max_ms']}ms")
+
+    if args.no_notify:
+        return
+
+    # Chờ gửi hết (batch window + rate limit + retry)
+    while True:
+        current = notification_dispatcher.get_stats()
+        if not any(current["pending"].values()) and current["inFlight"] == 0:
+            break
+        time.sleep(0.5)
+    notification_dispatcher.stop()
+
+    print(f"Dispatcher:  {notification_dispatcher.get_stats()}")
+    print(f"HTTP mock:   {dict(received)}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -19,11 +19,132 @@ class Settings:
     HOST: str = os.getenv("HOST", "0.0.0.0")  # For Linux or deployment
     COAP_PORT: int = int(os.getenv("COAP_PORT", "5683"))
     HTTP_PORT: int = int(os.getenv("HTTP_PORT", "3000"))
+    HTTP_WORKERS: int = int(os.getenv("HTTP_WORKERS", "1"))  # gunicorn worker process
+    HTTP_THREADS: int = int(os.getenv("HTTP_THREADS", "8"))  # thread mỗi worker (gthread), chưa tính SSE
+    CONFIG_SYNC_INTERVAL: float = float(os.getenv("CONFIG_SYNC_INTERVAL", "5"))  # seconds, đọc lại cấu hình đã lưu
+
+    # Authentication: JWT ngắn hạn + danh sách thu hồi (revoked_tokens) dùng chung giữa các process
+    TOKEN_EXPIRE_MINUTES: int = int(os.getenv("TOKEN_EXPIRE_MINUTES", "60"))
+    AUTH_REVOCATION_REFRESH: float = float(os.getenv("AUTH_REVOCATION_REFRESH", "5"))  # seconds
+    AUTH_BLOOM_CAPACITY: int = int(os.getenv("AUTH_BLOOM_CAPACITY", "10000"))
+    AUTH_CLAIMS_CACHE_SIZE: int = int(os.getenv("AUTH_CLAIMS_CACHE_SIZE", "1024"))
+    AUTH_CLAIMS_CACHE_TTL: float = float(os.getenv("AUTH_CLAIMS_CACHE_TTL", "60"))  # seconds
+    STREAM_TICKET_SECONDS: int = int(os.getenv("STREAM_TICKET_SECONDS", "30"))  # hạn ticket mở SSE, dùng một lần
 
     # Application Settings
     ENVIRONMENT: str = os.getenv("ENVIRONMENT", "development")
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
 
+    # Ingest Write Buffer (CoAP -> MongoDB)
+    INGEST_BATCH_SIZE: int = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+    INGEST_FLUSH_INTERVAL: float = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.5"))  # seconds
+    INGEST_QUEUE_SIZE: int = int(os.getenv("INGEST_QUEUE_SIZE", "20000"))
+    INGEST_PUT_TIMEOUT: float = float(os.getenv("INGEST_PUT_TIMEOUT", "2.0"))  # seconds
+    INGEST_RETRY_ATTEMPTS: int = int(os.getenv("INGEST_RETRY_ATTEMPTS", "3"))  # lỗi mạng/failover
+    INGEST_RETRY_BACKOFF: float = float(os.getenv("INGEST_RETRY_BACKOFF", "0.5"))  # seconds, x2 mỗi lần
+
+    # Ingest Mode: "buffered" (write buffer) hoặc "async" (async driver + executor)
+    COAP_INGEST_MODE: str = os.getenv("COAP_INGEST_MODE", "buffered")
+    INGEST_CONCURRENCY: int = int(os.getenv("INGEST_CONCURRENCY", "256"))
+    INGEST_EXECUTOR_WORKERS: int = int(os.getenv("INGEST_EXECUTOR_WORKERS", "4"))
+
+    # Parser: "fast" (validate 1 lượt, tạo document trực tiếp) hoặc "strict" (Pydantic)
+    PARSER_MODE: str = os.getenv("PARSER_MODE", "fast")
+
+    # Số sample tối đa trong một request upload-batch
+    MAX_BATCH_SAMPLES: int = int(os.getenv("MAX_BATCH_SAMPLES", "1000"))
+
+    # Re-classification job (tính lại severity cho dữ liệu cũ)
+    RECLASSIFY_CHUNK_SIZE: int = int(os.getenv("RECLASSIFY_CHUNK_SIZE", "5000"))
+    RECLASSIFY_MAX_RATE: float = float(os.getenv("RECLASSIFY_MAX_RATE", "50000"))  # docs/s, 0 = không giới hạn
+    RECLASSIFY_LEASE: float = float(os.getenv("RECLASSIFY_LEASE", "60"))  # seconds không heartbeat => nhận lại được
+
+    # DeviceId cho payload struct nhị phân (device index -> id)
+    BINARY_DEVICE_ID_FORMAT: str = os.getenv("BINARY_DEVICE_ID_FORMAT", "ESP{:03d}")
+
+    # Số process CoAP ingest (>1: các process dùng chung port qua SO_REUSEPORT)
+    COAP_WORKERS: int = int(os.getenv("COAP_WORKERS", "1"))
+
+    # Cache trạng thái mới nhất của thiết bị cho /api/devices/latest
+    LATEST_CACHE_ENABLED: bool = os.getenv("LATEST_CACHE_ENABLED", "true").lower() == "true"
+
+    # Nguồn latest state cho dashboard: "memory" (cache in-process) hoặc
+    # "collection" (collection device_latest cập nhật khi ingest, dùng chung mọi process)
+    LATEST_STATE_BACKEND: str = os.getenv("LATEST_STATE_BACKEND", "memory")
+
+    # Bộ đếm thống kê tăng dần cho /api/statistics
+    STATS_COUNTERS_ENABLED: bool = os.getenv("STATS_COUNTERS_ENABLED", "true").lower() == "true"
+    STATS_FLUSH_INTERVAL: float = float(os.getenv("STATS_FLUSH_INTERVAL", "1.0"))  # seconds
+    STATS_MINUTE_RETENTION_DAYS: int = int(os.getenv("STATS_MINUTE_RETENTION_DAYS", "7"))
+    STATS_TIMELINE_MAX_HOURS: int = int(os.getenv("STATS_TIMELINE_MAX_HOURS", "8760"))  # hours tối đa với resolution=hour
+
+    # Lưu trữ sensor_data: "standard" hoặc "timeseries" (MongoDB 5.0+)
+    STORAGE_MODE: str = os.getenv("STORAGE_MODE", "standard")
+    TIMESERIES_GRANULARITY: str = os.getenv("TIMESERIES_GRANULARITY", "")  # rỗng = theo sample_rate
+
+    # Rollup 1 phút / 1 giờ (min/max/mean của tilt và accel magnitude)
+    ROLLUP_ENABLED: bool = os.getenv("ROLLUP_ENABLED", "true").lower() == "true"
+    ROLLUP_INTERVAL: float = float(os.getenv("ROLLUP_INTERVAL", "60"))  # seconds
+    ROLLUP_LOOKBACK: float = float(os.getenv("ROLLUP_LOOKBACK", "300"))  # seconds, tính lại cho packet đến trễ
+    ROLLUP_1M_RETENTION_DAYS: int = int(os.getenv("ROLLUP_1M_RETENTION_DAYS", "90"))  # 0 = giữ mãi
+    ROLLUP_1H_RETENTION_DAYS: int = int(os.getenv("ROLLUP_1H_RETENTION_DAYS", "730"))  # 0 = giữ mãi
+
+    # Downsampling cho history (max_points)
+    MAX_HISTORY_POINTS: int = int(os.getenv("MAX_HISTORY_POINTS", "5000"))
+    LTTB_MAX_INPUT: int = int(os.getenv("LTTB_MAX_INPUT", "200000"))  # vượt => dùng "avg"
+
+    # Số record tối đa mỗi trang (records/history/alerts), trang sau lấy bằng cursor "after"
+    MAX_PAGE_SIZE: int = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+    # Export streaming: số document mỗi batch đọc từ cursor
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+
+    # Push real-time qua Server-Sent Events (/api/devices/stream)
+    SSE_QUEUE_SIZE: int = int(os.getenv("SSE_QUEUE_SIZE", "1000"))  # event chờ mỗi client, đầy => ngắt client
+    SSE_MAX_CLIENTS: int = int(os.getenv("SSE_MAX_CLIENTS", "100"))
+    SSE_HEARTBEAT: float = float(os.getenv("SSE_HEARTBEAT", "15"))  # seconds
+
+    # Change stream trên sensor_data (cần replica set): process API không chạy ingest
+    # (--coap-workers > 1) dùng để cập nhật latest cache và SSE
+    CHANGE_STREAM_ENABLED: bool = os.getenv("CHANGE_STREAM_ENABLED", "true").lower() == "true"
+    CHANGE_STREAM_BATCH: int = int(os.getenv("CHANGE_STREAM_BATCH", "500"))
+
+    # Cache response cho endpoint đọc (latest/alerts/statistics), vô hiệu khi có ingest mới
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+    RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "5"))  # seconds
+
+    # Alert engine: mỗi đợt cảnh báo là một document trong collection alerts
+    ALERT_ENGINE_ENABLED: bool = os.getenv("ALERT_ENGINE_ENABLED", "true").lower() == "true"
+    ALERT_FLUSH_INTERVAL: float = float(os.getenv("ALERT_FLUSH_INTERVAL", "1.0"))  # seconds
+    ALERT_BACKFILL_DAYS: int = int(os.getenv("ALERT_BACKFILL_DAYS", "30"))  # dựng alert từ dữ liệu cũ, 0 = bỏ qua
+
+    # Gửi thông báo khi alert mở/nâng mức/đóng (bật từng channel trong alert_settings)
+    NOTIFY_ENABLED: bool = os.getenv("NOTIFY_ENABLED", "true").lower() == "true"
+    NOTIFY_QUEUE_SIZE: int = int(os.getenv("NOTIFY_QUEUE_SIZE", "10000"))  # mỗi channel, đầy => bỏ
+    NOTIFY_BATCH_SIZE: int = int(os.getenv("NOTIFY_BATCH_SIZE", "50"))
+    NOTIFY_BATCH_WINDOW: float = float(os.getenv("NOTIFY_BATCH_WINDOW", "5"))  # seconds
+    NOTIFY_RATE_LIMIT: float = float(os.getenv("NOTIFY_RATE_LIMIT", "1"))  # lần gửi/s mỗi channel, 0 = không giới hạn
+    NOTIFY_RATE_BURST: int = int(os.getenv("NOTIFY_RATE_BURST", "5"))
+    NOTIFY_MAX_ATTEMPTS: int = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))  # hết => notification_dlq
+    NOTIFY_RETRY_BASE: float = float(os.getenv("NOTIFY_RETRY_BASE", "1"))  # seconds, x2 mỗi lần
+    NOTIFY_RETRY_MAX: float = float(os.getenv("NOTIFY_RETRY_MAX", "60"))  # seconds
+    NOTIFY_WORKERS: int = int(os.getenv("NOTIFY_WORKERS", "4"))  # thread cho sender blocking
+    NOTIFY_TIMEOUT: float = float(os.getenv("NOTIFY_TIMEOUT", "10"))  # seconds mỗi lần gửi
+    NOTIFY_INBOX_SIZE: int = int(os.getenv("NOTIFY_INBOX_SIZE", "10000"))  # chờ event loop lấy, đầy => bỏ
+    # Host (hoặc host:port) được nhận webhook, phân cách bằng dấu phẩy; để trống = tắt webhook
+    NOTIFY_WEBHOOK_ALLOWED_HOSTS: str = os.getenv("NOTIFY_WEBHOOK_ALLOWED_HOSTS", "")
+
+    # Channel: SMTP (email) và HTTP SMS gateway; để trống host/url = không dùng channel đó
+    SMTP_HOST: str = os.getenv("SMTP_HOST", "")
+    SMTP_PORT: int = int(os.getenv("SMTP_PORT", "25"))
+    SMTP_USERNAME: str = os.getenv("SMTP_USERNAME", "")
+    SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD", "")
+    SMTP_FROM: str = os.getenv("SMTP_FROM", "landslide-monitor@localhost")
+    SMTP_STARTTLS: bool = os.getenv("SMTP_STARTTLS", "false").lower() == "true"
+    SMS_GATEWAY_URL: str = os.getenv("SMS_GATEWAY_URL", "")
+    SMS_GATEWAY_TOKEN: str = os.getenv("SMS_GATEWAY_TOKEN", "")
+
     # Severity Thresholds (tilt angle in degree)
     THRESHOLD_WARNING: float = 10.0
     THRESHOLD_DANGER: float = 20.0
@@ -59,6 +180,13 @@ def print_settings():
     print(f"  HTTP Port: {settings.HTTP_PORT}")
     print(f"  Environment: {settings.ENVIRONMENT}")
     print(f"  Log Level: {settings.LOG_LEVEL}")
+    print(f"  Ingest Batch: {settings.INGEST_BATCH_SIZE} docs / {settings.INGEST_FLUSH_INTERVAL}s "
+          f"(queue {settings.INGEST_QUEUE_SIZE})")
+    print(f"  Ingest Mode: {settings.COAP_INGEST_MODE} (concurrency {settings.INGEST_CONCURRENCY})")
+    print(f"  CoAP Workers: {settings.COAP_WORKERS}")
+    print(f"  Parser Mode: {settings.PARSER_MODE}")
+    print(f"  Latest State: {settings.LATEST_STATE_BACKEND}")
+    print(f"  Storage Mode: {settings.STORAGE_MODE}")
     print()
 
 
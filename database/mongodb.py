@@ -1,16 +1,24 @@
 """
 MongoDB connection và management
 """
-from pymongo import MongoClient, DESCENDING
-from pymongo.errors import ConnectionFailure
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import ConnectionFailure, OperationFailure
+from typing import Optional
 from config.settings import settings
 from utils.logger import setup_logger
 
+# Async driver (optional) cho ingest mode "async"
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    AsyncIOMotorClient = None
+
 logger = setup_logger(__name__)
 
 # Global MongoDB client
 _client = None
 _db = None
+_async_client = None
 
 
 def get_client():
@@ -30,10 +38,71 @@ def get_database():
     return _db
 
 
-def init_database():
+def get_async_client():
+    """
+    Lấy Motor client (singleton, gắn với event loop của CoAP thread)
+
+    Returns:
+        AsyncIOMotorClient hoặc None nếu chưa cài motor
+    """
+    global _async_client
+    if AsyncIOMotorClient is None:
+        return None
+    if _async_client is None:
+        _async_client = AsyncIOMotorClient(settings.MONGODB_URI)
+    return _async_client
+
+
+# Phiên bản MongoDB cho phép delete / update lọc theo field bất kỳ trên time-series collection
+# (bản cũ hơn chỉ cho lọc theo metaField deviceId)
+TIMESERIES_WRITE_VERSION = (7, 0)
+
+
+def timeseries_write_supported() -> bool:
+    """
+    Kiểm tra sensor_data có cho phép delete/update lọc theo timestamp, _id... không
+
+    Returns:
+        True nếu STORAGE_MODE="standard" hoặc server từ TIMESERIES_WRITE_VERSION
+    """
+    if settings.STORAGE_MODE != "timeseries":
+        return True
+    version = get_client().server_info().get("versionArray", [0, 0])
+    return tuple(version[:2]) >= TIMESERIES_WRITE_VERSION
+
+
+def timeseries_granularity(sample_rate: Optional[float]) -> str:
+    """
+    Chọn granularity của time-series collection theo chu kỳ gửi dữ liệu
+    
+    Args:
+        sample_rate: Số giây giữa 2 lần gửi của một thiết bị
+        
+    Returns:
+        "seconds", "minutes" hoặc "hours"
+    """
+    if settings.TIMESERIES_GRANULARITY:
+        return settings.TIMESERIES_GRANULARITY
+    if sample_rate is None or sample_rate < 60:
+        return "seconds"
+    if sample_rate < 3600:
+        return "minutes"
+    return "hours"
+
+
+def init_database(sample_rate: Optional[float] = None):
     """
     Khởi tạo database và tạo indexes
+    
+    Args:
+        sample_rate: Chu kỳ gửi dữ liệu (giây), dùng chọn granularity khi STORAGE_MODE="timeseries"
+    
+    Raises:
+        ValueError: STATS_MINUTE_RETENTION_DAYS < 1 (TTL 0 xóa bucket phút ngay khi ghi)
     """
+    if settings.STATS_MINUTE_RETENTION_DAYS < 1:
+        raise ValueError("STATS_MINUTE_RETENTION_DAYS must be at least 1")
+    
     try:
         # Test connection
         client = get_client()
@@ -42,14 +111,58 @@ def init_database():
         db = get_database()
         collection = db.sensor_data
         
-        # Tạo indexes để query nhanh hơn
-        collection.create_index([("deviceId", DESCENDING)])
-        collection.create_index([("timestamp", DESCENDING)])
-        collection.create_index([("severity", DESCENDING)])
-        collection.create_index([
-            ("deviceId", DESCENDING),
-            ("timestamp", DESCENDING)
+        if settings.STORAGE_MODE == "timeseries":
+            _init_timeseries_collection(db, timeseries_granularity(sample_rate))
+        else:
+            # Tạo indexes để query nhanh hơn
+            collection.create_index([("deviceId", DESCENDING)])
+            collection.create_index([("timestamp", DESCENDING)])
+            collection.create_index([("severity", DESCENDING)])
+            collection.create_index([
+                ("deviceId", DESCENDING),
+                ("timestamp", DESCENDING)
+            ])
+            
+            # Keyset pagination: sort (timestamp, _id) đi thẳng trên index, không sort trong bộ nhớ
+            collection.create_index([
+                ("deviceId", DESCENDING),
+                ("timestamp", DESCENDING),
+                ("_id", DESCENDING)
+            ])
+            collection.create_index([
+                ("severity", DESCENDING),
+                ("timestamp", DESCENDING),
+                ("_id", DESCENDING)
+            ])
+        
+        # Rollup 1 phút / 1 giờ: history theo device và khoảng thời gian, bucket cũ tự xóa
+        for rollup, retention_days in ((db.sensor_rollup_1m, settings.ROLLUP_1M_RETENTION_DAYS),
+                                       (db.sensor_rollup_1h, settings.ROLLUP_1H_RETENTION_DAYS)):
+            rollup.create_index([("deviceId", ASCENDING), ("start", DESCENDING)])
+            if retention_days > 0:
+                _ensure_ttl_index(db, rollup, "start", retention_days * 86400)
+        
+        # device_latest: _id = deviceId, index timestamp cho đếm active devices
+        db.device_latest.create_index([("timestamp", DESCENDING)])
+        
+        # Bộ đếm thống kê: active devices theo lastSeen, bucket phút tự xóa sau retention
+        db.device_counters.create_index([("lastSeen", DESCENDING)])
+        _ensure_ttl_index(db, db.stats_minute, "start", settings.STATS_MINUTE_RETENTION_DAYS * 86400)
+        
+        # Alerts: mới nhất trước (keyset pagination), lọc theo status / thiết bị
+        db.alerts.create_index([("timestamp", DESCENDING), ("_id", DESCENDING)])
+        db.alerts.create_index([
+            ("status", ASCENDING),
+            ("timestamp", DESCENDING),
+            ("_id", DESCENDING)
         ])
+        db.alerts.create_index([("deviceId", ASCENDING), ("timestamp", DESCENDING)])
+        
+        # Thông báo gửi thất bại (dead letter), xem theo thời gian
+        db.notification_dlq.create_index([("failedAt", DESCENDING)])
+        
+        # Token đã thu hồi tự xóa khi hết hạn
+        db.revoked_tokens.create_index([("expiresAt", ASCENDING)], expireAfterSeconds=0)
         
         logger.info(f"Database '{settings.MONGODB_DB}' initialized with indexes")
         
@@ -58,17 +171,168 @@ def init_database():
         raise
 
 
+def _init_timeseries_collection(db, granularity: str):
+    """
+    Tạo sensor_data dạng time-series (timeField=timestamp, metaField=deviceId)
+    
+    Collection đã tồn tại ở dạng thường thì giữ nguyên (MongoDB không chuyển đổi được),
+    cần migrate dữ liệu sang collection mới.
+    
+    Giới hạn so với STORAGE_MODE="standard":
+    - Không có index keyset (timestamp, _id): cursor pagination sort phần trùng timestamp
+      trong bộ nhớ
+    - Xóa theo khoảng thời gian và reclassify (update theo _id) cần MongoDB 7.0+
+      (xem timeseries_write_supported)
+    """
+    existing = db.list_collections(filter={"name": "sensor_data"})
+    info = next(iter(existing), None)
+    
+    if info is None:
+        db.create_collection("sensor_data", timeseries={
+            "timeField": "timestamp",
+            "metaField": "deviceId",
+            "granularity": granularity
+        })
+        logger.info(f"Created time-series collection sensor_data (granularity={granularity})")
+    elif info.get("type") != "timeseries":
+        logger.warning("sensor_data already exists as a regular collection, "
+                       "STORAGE_MODE=timeseries needs a migration to take effect")
+    
+    collection = db.sensor_data
+    collection.create_index([("deviceId", DESCENDING), ("timestamp", DESCENDING)])
+    try:
+        # Index trên measurement field cần MongoDB 6.0+
+        collection.create_index([("severity", DESCENDING)])
+    except OperationFailure as e:
+        logger.warning(f"Cannot index severity on time-series collection: {e}")
+
+
+def _ensure_ttl_index(db, collection, field: str, seconds: int):
+    """
+    Tạo TTL index trên field; index đã có với thời hạn khác (đổi retention sau lần
+    deploy đầu) thì cập nhật bằng collMod thay vì để create_index lỗi IndexOptionsConflict
+    """
+    try:
+        collection.create_index([(field, ASCENDING)], expireAfterSeconds=seconds)
+        return
+    except OperationFailure as e:
+        logger.info(f"Updating {collection.name} TTL to {seconds}s ({e})")
+
+    try:
+        db.command({"collMod": collection.name,
+                    "index": {"keyPattern": {field: 1}, "expireAfterSeconds": seconds}})
+    except OperationFailure as e:
+        logger.warning(f"Cannot set {collection.name} retention: {e}")
+
+
 def close_database():
     """Đóng kết nối database"""
-    global _client
+    global _client, _db, _async_client
     if _client:
         _client.close()
         _client = None
+        _db = None
         logger.info("Database connection closed")
+    if _async_client:
+        _async_client.close()
+        _async_client = None
+
+
+def reset_after_fork():
+    """
+    Bỏ client kế thừa từ process cha sau khi fork (vd: gunicorn worker)
+    
+    MongoClient không fork-safe: socket và thread monitor của process cha không dùng được
+    trong process con. Không close() vì socket vẫn thuộc process cha;
+    lần gọi get_client() kế tiếp tạo client mới cho process này.
+    """
+    global _client, _db, _async_client
+    _client = None
+    _db = None
+    _async_client = None
 
 
 # Collection helpers
 def get_sensor_collection():
     """Lấy collection sensor_data"""
     db = get_database()
-    return db.sensor_data
\ No newline at end of file
+    return db.sensor_data
+
+
+def get_async_sensor_collection():
+    """Lấy collection sensor_data qua Motor (None nếu chưa cài motor)"""
+    client = get_async_client()
+    if client is None:
+        return None
+    return client[settings.MONGODB_DB].sensor_data
+
+
+def get_device_latest_collection():
+    """Lấy collection device_latest (record mới nhất của mỗi thiết bị)"""
+    db = get_database()
+    return db.device_latest
+
+
+def get_stats_counters_collection():
+    """Lấy collection stats_counters (tổng số record theo severity)"""
+    db = get_database()
+    return db.stats_counters
+
+
+def get_device_counters_collection():
+    """Lấy collection device_counters (số record + lastSeen của mỗi thiết bị)"""
+    db = get_database()
+    return db.device_counters
+
+
+def get_stats_minute_collection():
+    """Lấy collection stats_minute (số record theo severity trong từng phút)"""
+    db = get_database()
+    return db.stats_minute
+
+
+def get_stats_hour_collection():
+    """Lấy collection stats_hour (số record theo severity trong từng giờ)"""
+    db = get_database()
+    return db.stats_hour
+
+
+def get_rollup_collection(resolution: str):
+    """
+    Lấy collection rollup
+    
+    Args:
+        resolution: "1m" hoặc "1h"
+    """
+    db = get_database()
+    return db[f"sensor_rollup_{resolution}"]
+
+
+def get_jobs_collection():
+    """Lấy collection jobs (checkpoint của các background job)"""
+    db = get_database()
+    return db.jobs
+
+
+def get_configs_collection():
+    """Lấy collection configs (cấu hình hệ thống dùng chung giữa các process)"""
+    db = get_database()
+    return db.configs
+
+
+def get_revoked_tokens_collection():
+    """Lấy collection revoked_tokens (jti của token đã logout, TTL theo expiresAt)"""
+    db = get_database()
+    return db.revoked_tokens
+
+
+def get_alerts_collection():
+    """Lấy collection alerts (một document cho mỗi đợt cảnh báo của thiết bị)"""
+    db = get_database()
+    return db.alerts
+
+
+def get_notification_dlq_collection():
+    """Lấy collection notification_dlq (thông báo gửi thất bại sau khi hết lượt retry)"""
+    db = get_database()
+    return db.notification_dlq
@@ -0,0 +1,74 @@
+"""
+Cấu hình gunicorn cho HTTP API (gunicorn -c gunicorn.conf.py wsgi:app)
+
+Worker gthread: mỗi worker là một process với HTTP_THREADS + SSE_MAX_CLIENTS thread,
+phù hợp với pymongo (blocking I/O). Mỗi stream SSE giữ một thread suốt kết nối nên
+phần SSE được cộng thêm, HTTP_THREADS luôn còn cho request thường.
+
+Cấu hình (/api/configs/update) được lưu trong collection configs và mọi process
+(các worker, CoAP ingest) đọc lại mỗi CONFIG_SYNC_INTERVAL giây. Job reclassify được
+nhận qua collection jobs nên chỉ chạy ở một worker, status/stop gọi ở worker nào cũng được.
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config.settings import settings  # noqa: E402
+
+bind = f"{settings.HOST}:{settings.HTTP_PORT}"
+workers = settings.HTTP_WORKERS
+worker_class = "gthread"
+# SSE_MAX_CLIENTS là giới hạn stream của mỗi worker (event bus của process)
+threads = settings.HTTP_THREADS + settings.SSE_MAX_CLIENTS
+
+# Load app trong master rồi fork: worker khởi động nhanh, dùng chung bộ nhớ code
+preload_app = True
+
+# SSE gửi keepalive mỗi SSE_HEARTBEAT giây, request thường không nên lâu hơn thế này
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+# Không log query string (chứa ticket của stream SSE)
+accesslog = "-"
+access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s "%(f)s" "%(a)s"'
+loglevel = settings.LOG_LEVEL.lower()
+
+
+def on_starting(server):
+    """Master: tạo index/collection và bộ đếm một lần trước khi fork worker"""
+    from database.mongodb import init_database
+    from services.config_manager import config_manager
+    from services.device_latest import device_latest_store
+    from services.stats_counters import stats_counters
+
+    init_database(sample_rate=config_manager.get("sensor_settings.sample_rate"))
+    if device_latest_store.enabled:
+        device_latest_store.initialize()
+    if stats_counters.enabled:
+        stats_counters.initialize()
+
+
+def post_fork(server, worker):
+    """Worker: bỏ MongoClient kế thừa từ master, theo dõi ingest qua change stream"""
+    from database.mongodb import reset_after_fork
+    from services.change_stream import change_stream
+    from services.config_manager import config_manager
+
+    reset_after_fork()
+    config_manager.attach()
+
+    # CoAP ingest chạy ở process khác (main.py --no-http)
+    if settings.CHANGE_STREAM_ENABLED:
+        change_stream.start()
+
+
+def worker_exit(server, worker):
+    """Worker: dừng change stream và đồng bộ cấu hình trước khi thoát"""
+    from services.change_stream import change_stream
+    from services.config_manager import config_manager
+
+    change_stream.stop()
+    config_manager.detach()
@@ -8,19 +8,42 @@ import os
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+import argparse
 import asyncio
 import threading
 from config.settings import settings
 from database.mongodb import init_database
-from servers.coap_server import start_coap_server
+from services.device_latest import device_latest_store
+from services.stats_counters import stats_counters
+from services.config_manager import config_manager
+from services.rollup import rollup_job
+from services.change_stream import change_stream
+from servers.coap_server import start_coap_server, stop_coap_server
+from servers.coap_workers import CoapWorkerPool, reuse_port_supported
 from servers.http_server_swagger import start_http_server  
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
 
+def parse_args():
+    """Đọc tham số dòng lệnh"""
+    arg_parser = argparse.ArgumentParser(description="Landslide monitoring backend")
+    arg_parser.add_argument(
+        "--coap-workers", type=int, default=settings.COAP_WORKERS,
+        help="Số process CoAP ingest (mặc định: 1, chạy trong thread của process chính)"
+    )
+    arg_parser.add_argument(
+        "--no-http", action="store_true",
+        help="Chỉ chạy CoAP ingest và rollup; HTTP API chạy riêng bằng gunicorn (gunicorn.conf.py)"
+    )
+    return arg_parser.parse_args()
+
+
 def main():
     """Main function để khởi động backend"""
+    args = parse_args()
+
     logger.info("=" * 60)
     logger.info("LANDSLIDE MONITORING SYSTEM - BACKEND")
     logger.info("=" * 60)
@@ -28,31 +51,71 @@ def main():
     # 1. Khởi tạo database
     logger.info("Initializing database...")
     try:
-        init_database()
+        init_database(sample_rate=config_manager.get("sensor_settings.sample_rate"))
+        # Cấu hình dùng chung với CoAP worker process / gunicorn worker
+        config_manager.attach()
+        if device_latest_store.enabled:
+            device_latest_store.initialize()
+        if stats_counters.enabled:
+            stats_counters.initialize()
         logger.info("✓ Database connected successfully")
     except Exception as e:
         logger.error(f"✗ Database connection failed: {e}")
         return
     
-    # 2. Khởi động CoAP server trong thread riêng
+    # Rollup 1 phút / 1 giờ chạy nền (một instance, trong process chính)
+    if settings.ROLLUP_ENABLED:
+        rollup_job.start()
+    
+    # 2. Khởi động CoAP server: thread riêng hoặc nhiều worker process
+    coap_workers = args.coap_workers
+    if coap_workers > 1 and not reuse_port_supported():
+        logger.warning("SO_REUSEPORT not available, falling back to a single CoAP worker")
+        coap_workers = 1
+
     logger.info(f"Starting CoAP server on port {settings.COAP_PORT}...")
-    coap_thread = threading.Thread(target=start_coap_server, daemon=True)
-    coap_thread.start()
-    logger.info("✓ CoAP server started")
+    worker_pool = None
+    coap_thread = None
+    if coap_workers > 1:
+        worker_pool = CoapWorkerPool(coap_workers)
+        worker_pool.start()
+        
+        # Ingest ở process khác: latest cache và SSE của HTTP server theo change stream
+        if settings.CHANGE_STREAM_ENABLED and not args.no_http:
+            change_stream.start()
+    else:
+        coap_thread = threading.Thread(target=start_coap_server, daemon=True)
+        coap_thread.start()
+        logger.info("✓ CoAP server started")
     
     # 3. Khởi động HTTP API server (blocking)
-    logger.info(f"Starting HTTP API server on port {settings.HTTP_PORT}...")
-    logger.info(f"Swagger UI: http://localhost:{settings.HTTP_PORT}/docs")
-    logger.info(f"API Base: http://{settings.HOST}:{settings.HTTP_PORT}")
-    logger.info("=" * 60)
-    
     try:
-        start_http_server()
+        if args.no_http:
+            logger.info("HTTP API disabled (serve it with: gunicorn -c gunicorn.conf.py wsgi:app)")
+            logger.info("=" * 60)
+            threading.Event().wait()
+        else:
+            logger.info(f"Starting HTTP API server on port {settings.HTTP_PORT}...")
+            logger.info(f"Swagger UI: http://localhost:{settings.HTTP_PORT}/docs")
+            logger.info(f"API Base: http://{settings.HOST}:{settings.HTTP_PORT}")
+            logger.info("=" * 60)
+            start_http_server()
     except KeyboardInterrupt:
         logger.info("\nShutting down gracefully...")
     except Exception as e:
         logger.error(f"Server error: {e}")
+    finally:
+        rollup_job.stop()
+        change_stream.stop()
+        config_manager.detach()
+        
+        # Flush dữ liệu còn trong write buffer trước khi thoát
+        if worker_pool is not None:
+            worker_pool.stop()
+        else:
+            stop_coap_server()
+            coap_thread.join(timeout=10)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
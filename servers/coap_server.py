@@ -4,15 +4,32 @@ CoAP server để nhận dữ liệu từ ESP32
 
 import asyncio
 import json
-from aiocoap import Context, Message, resource, POST
+import signal
+import sys
+import threading
+import time
+from aiocoap import Context, Message, resource, CHANGED, UNSUPPORTED_CONTENT_FORMAT
+from bson import ObjectId
 from config.settings import settings
 from services.data_parser import parser
+from services.binary_codec import CONTENT_FORMAT_JSON, CONTENT_FORMAT_CBOR
+from services.config_manager import config_manager
 from services.severity_analyzer import analyzer
-from database.mongodb import get_sensor_collection
+from services.write_buffer import write_buffer
+from services.async_ingest import async_ingest
+from services.latest_cache import latest_cache
+from services.stats_counters import stats_counters
+from services.alert_engine import alert_engine
+from services.notification_dispatcher import notification_dispatcher
 from utils.logger import setup_logger
+from utils.metrics import ingest_latency
 
 logger = setup_logger(__name__)
 
+# Event loop và stop event của CoAP thread (dùng cho stop_coap_server)
+_loop = None
+_stop_event = None
+
 
 class SensorDataResource(resource.Resource):
     """CoAP resource để nhận dữ liệu sensor"""
@@ -21,85 +38,228 @@ class SensorDataResource(resource.Resource):
         """
         Xử lý POST request từ ESP32
         """
+        started = time.perf_counter()
 
         try:
             client_addr = f"{request.remote.hostinfo}"
             logger.info(f"[CoAP] POST from {client_addr}")
 
-            # Parse payload
-            sensor_data = parser.parse_coap_payload(request.payload)
+            # JSON (mặc định), CBOR hoặc struct nhị phân theo option Content-Format
+            content_format = request.opt.content_format
+            if content_format is not None:
+                content_format = int(content_format)
 
-            if sensor_data is None:
-                logger.error("[CoAP] Payload parse error")
+            if not self._supports_content_format(content_format):
+                logger.error(f"[CoAP] Unsupported Content-Format {content_format}")
                 return Message(
-                    code=POST,
+                    code=UNSUPPORTED_CONTENT_FORMAT,
                     payload=json.dumps({
                         "status": "error",
-                        "message": "Invalid payload"
+                        "message": f"Unsupported Content-Format {content_format}"
                     }).encode()
                 )
 
-            # Analyze severity
-            severity = analyzer.calculate_severity(sensor_data)
-            sensor_data.severity = severity
-
-            logger.info(
-                f"[CoAP] Device={sensor_data.deviceId}, "
-                f"Severity={severity}, "
-                f"Tilt={sensor_data.data.tilt_angle:.2f}°"
-            )
-
-            # Save to MongoDB
-            result = get_sensor_collection().insert_one(sensor_data.to_dict())
-            logger.info(f"[MongoDB] Saved, ID={result.inserted_id}")
-
-            # Response
-            response_data = {
-                "status": "success",
-                "severity": severity,
-                "message": analyzer.get_severity_description(severity)
-            }
+            response_data = await self._ingest(request.payload, content_format)
 
             return Message(
-                code=POST,
+                code=CHANGED,
                 payload=json.dumps(response_data).encode()
             )
 
         except Exception as e:
             logger.error(f"[CoAP] Error: {e}", exc_info=True)
             return Message(
-                code=POST,
+                code=CHANGED,
                 payload=json.dumps({
                     "status": "error",
                     "message": str(e)
                 }).encode()
             )
 
+        finally:
+            ingest_latency.observe(time.perf_counter() - started)
+
+    @staticmethod
+    def _supports_content_format(content_format) -> bool:
+        """JSON, CBOR và struct nhị phân"""
+        return parser.supports_content_format(content_format)
+
+    async def _ingest(self, payload: bytes, content_format=None) -> dict:
+        """Chọn pipeline theo COAP_INGEST_MODE"""
+        if settings.COAP_INGEST_MODE == "async":
+            return await async_ingest.handle(payload, content_format)
+        return await self._handle_buffered(payload, content_format)
+
+    @staticmethod
+    async def _handle_buffered(payload: bytes, content_format=None) -> dict:
+        """
+        Parse + phân tích trên event loop, ghi qua write buffer
+        """
+        # Parse payload
+        document = parser.parse_document(payload, content_format=content_format)
+
+        if document is None:
+            logger.error("[CoAP] Payload parse error")
+            return {
+                "status": "error",
+                "message": "Invalid payload"
+            }
+
+        # Analyze severity
+        severity = analyzer.analyze_document(document)
+
+        logger.info(
+            f"[CoAP] Device={document['deviceId']}, "
+            f"Severity={severity}, "
+            f"Tilt={document['data']['tilt_angle']:.2f}°"
+        )
+
+        # Gán _id trước: gửi lại batch khi lỗi mạng không tạo bản trùng
+        document["_id"] = ObjectId()
+
+        # Save to MongoDB (write-behind, ghi theo batch)
+        if not await write_buffer.put(document):
+            return {
+                "status": "error",
+                "message": "Server busy, retry later"
+            }
+
+        # Response
+        return {
+            "status": "success",
+            "severity": severity,
+            "message": analyzer.get_severity_description(severity)
+        }
+
+
+class SensorBatchResource(SensorDataResource):
+    """CoAP resource nhận nhiều sample của một thiết bị trong một request"""
+
+    @staticmethod
+    def _supports_content_format(content_format) -> bool:
+        """Batch chỉ nhận JSON và CBOR"""
+        return content_format in (None, CONTENT_FORMAT_JSON, CONTENT_FORMAT_CBOR)
+
+    async def _ingest(self, payload: bytes, content_format=None) -> dict:
+        """Chọn pipeline theo COAP_INGEST_MODE"""
+        if settings.COAP_INGEST_MODE == "async":
+            return await async_ingest.handle_batch(payload, content_format)
+        return await self._handle_batch_buffered(payload, content_format)
+
+    @staticmethod
+    async def _handle_batch_buffered(payload: bytes, content_format=None) -> dict:
+        """
+        Parse batch, tính severity từng sample, ghi cả batch qua write buffer
+        """
+        documents = parser.parse_batch_documents(payload, content_format=content_format)
+
+        if documents is None:
+            logger.error("[CoAP] Batch payload parse error")
+            return {
+                "status": "error",
+                "message": "Invalid batch payload"
+            }
+
+        worst = analyzer.analyze_documents(documents)
+
+        logger.info(
+            f"[CoAP] Device={documents[0]['deviceId']}, "
+            f"Batch={len(documents)}, Worst={worst}"
+        )
+
+        for document in documents:
+            document["_id"] = ObjectId()
+
+        if not await write_buffer.put_many(documents):
+            return {
+                "status": "error",
+                "message": "Server busy, retry later"
+            }
+
+        return {
+            "status": "success",
+            "count": len(documents),
+            "severity": worst,
+            "message": analyzer.get_severity_description(worst)
+        }
+
 
 def start_coap_server():
     """
-    Khởi động CoAP server (chạy trong thread riêng)
+    Khởi động CoAP server (chạy trong thread riêng hoặc trong worker process)
     """
 
     async def main():
+        global _loop, _stop_event
+
+        _loop = asyncio.get_running_loop()
+        _stop_event = asyncio.Event()
+
+        # Chạy như worker process (main thread): SIGTERM => dừng và flush buffer
+        if threading.current_thread() is threading.main_thread() and sys.platform != "win32":
+            _loop.add_signal_handler(signal.SIGTERM, _stop_event.set)
+
         root = resource.Site()
 
         # Register resource
         root.add_resource(['api', 'records', 'upload'], SensorDataResource())
+        root.add_resource(['api', 'records', 'upload-batch'], SensorBatchResource())
 
         # Fix Windows: 0.0.0.0 → 127.0.0.1
         host = settings.get_coap_host()
         port = settings.COAP_PORT
 
+        # Thresholds / alert settings đổi qua HTTP API (có thể ở process khác)
+        config_manager.attach()
+        await write_buffer.start()
+        if settings.COAP_INGEST_MODE == "async":
+            await async_ingest.start()
+
+        # Process này nhận toàn bộ ingest => latest cache dùng được cho API
+        latest_cache.attach()
+        if stats_counters.enabled:
+            stats_counters.start()
+        if alert_engine.enabled:
+            alert_engine.start()
+            if notification_dispatcher.enabled:
+                notification_dispatcher.start()
+
         try:
-            await Context.create_server_context(root, bind=(host, port))
-            logger.info(f"[CoAP] Server started at coap://{host}:{port}/api/records/upload")
+            context = await Context.create_server_context(root, bind=(host, port))
+            logger.info(
+                f"[CoAP] Server started at coap://{host}:{port}/api/records/upload "
+                f"(mode={settings.COAP_INGEST_MODE})"
+            )
 
         except Exception as e:
             logger.error(f"[CoAP] Failed to start: {e}", exc_info=True)
+            latest_cache.detach()
+            await write_buffer.stop()
+            stats_counters.stop()
+            alert_engine.stop()
+            notification_dispatcher.stop()
             return
 
-        # Keep the server alive
-        await asyncio.get_running_loop().create_future()
+        # Keep the server alive cho tới khi stop_coap_server() được gọi
+        await _stop_event.wait()
+
+        await context.shutdown()
+        latest_cache.detach()
+        if settings.COAP_INGEST_MODE == "async":
+            await async_ingest.stop()
+        await write_buffer.stop()
+        # Ghi nốt bộ đếm và alert của các batch vừa flush
+        stats_counters.stop()
+        alert_engine.stop()
+        notification_dispatcher.stop()
+        logger.info("[CoAP] Server stopped")
 
     asyncio.run(main())
+
+
+def stop_coap_server():
+    """
+    Dừng CoAP server từ thread khác và flush buffer ghi còn lại
+    """
+    if _loop is not None and _stop_event is not None and not _loop.is_closed():
+        _loop.call_soon_threadsafe(_stop_event.set)
@@ -0,0 +1,90 @@
+"""
+Chạy CoAP ingest trên nhiều process
+Mỗi process bind cùng port qua SO_REUSEPORT, kernel chia datagram theo 4-tuple
+"""
+
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+from typing import List
+from config.settings import settings
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def reuse_port_supported() -> bool:
+    """
+    Kiểm tra có thể chạy nhiều process trên cùng port CoAP không
+
+    aiocoap chỉ dùng transport udp6 (có SO_REUSEPORT) trên Linux;
+    AIOCOAP_REUSE_PORT=0 tắt tính năng này.
+    """
+    if sys.platform != "linux" or not hasattr(socket, "SO_REUSEPORT"):
+        return False
+    return os.environ.get("AIOCOAP_REUSE_PORT", "1") != "0"
+
+
+def _worker_main(index: int):
+    """
+    Entry point của một worker process
+
+    Process được tạo bằng "spawn" nên import lại toàn bộ module:
+    MongoClient trong database/mongodb.py được tạo mới trong process này.
+    """
+    from servers.coap_server import start_coap_server
+
+    logger.info(f"[Worker {index}] CoAP ingest started (pid={os.getpid()})")
+
+    # Ctrl+C được xử lý bởi process chính, worker chỉ dừng khi nhận SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    start_coap_server()
+
+
+class CoapWorkerPool:
+    """Quản lý các CoAP ingest process"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._processes: List[multiprocessing.Process] = []
+
+    def start(self):
+        """Khởi động các worker process"""
+        context = multiprocessing.get_context("spawn")
+
+        for index in range(self.workers):
+            process = context.Process(
+                target=_worker_main,
+                args=(index,),
+                name=f"coap-worker-{index}",
+                daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+
+        logger.info(f"✓ {self.workers} CoAP workers started on port {settings.COAP_PORT}")
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Dừng các worker: SIGTERM để flush write buffer, kill nếu quá timeout
+        """
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop in {timeout}s, killing")
+                process.kill()
+                process.join()
+
+        self._processes = []
+        logger.info("CoAP workers stopped")
+
+    def alive_count(self) -> int:
+        """Số worker đang chạy"""
+        return sum(1 for process in self._processes if process.is_alive())
@@ -6,28 +6,38 @@ from flask import Flask, jsonify, request
 from flask_cors import CORS
 from datetime import datetime
 from config.settings import settings
+from database.mongodb import timeseries_write_supported
 from api.api import APIController
-from services.auth import auth_service
+from services.auth import auth_service, TOKEN_EXPIRE_MINUTES
 from services.config_manager import config_manager
+from services.reclassifier import reclassification_job
 from utils.logger import setup_logger
 from functools import wraps
 
 logger = setup_logger(__name__)
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS cho tất cả routes
+CORS(app, expose_headers=["X-Resolution", "X-Downsample", "X-Next-Cursor", "ETag"])  # Enable CORS cho tất cả routes
 
 # Initialize controller
 api_controller = APIController()
 
 
 # Decorator để require authentication
-def require_auth(required_role=None):
-    """Decorator để check authentication"""
+def require_auth(required_role=None, query_ticket=False):
+    """
+    Decorator để check authentication
+    query_ticket: cho phép ticket dùng một lần trong query param ?ticket=
+    (EventSource không gửi được header, JWT không được đặt trong URL)
+    """
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             token = request.headers.get('Authorization')
+            if not token and query_ticket and request.args.get('ticket'):
+                if not auth_service.redeem_stream_ticket(request.args['ticket'], required_role):
+                    return jsonify({"error": "Unauthorized"}), 403
+                return f(*args, **kwargs)
             if not token:
                 return jsonify({"error": "No token provided"}), 401
             
@@ -64,6 +74,7 @@ def login():
         return jsonify({
             "status": "success",
             "token": token,
+            "expiresIn": TOKEN_EXPIRE_MINUTES * 60,
             "message": "Login successful"
         })
     else:
@@ -87,6 +98,26 @@ def logout():
         return jsonify({"error": "Logout failed"}), 400
 
 
+@app.route('/api/auth/refresh', methods=['POST'])
+@require_auth()
+def refresh_token():
+    """Đổi token còn hạn lấy token mới (token cũ bị thu hồi)"""
+    token = request.headers.get('Authorization')
+    if token.startswith('Bearer '):
+        token = token[7:]
+    
+    new_token = auth_service.refresh(token)
+    if not new_token:
+        return jsonify({"error": "Refresh failed"}), 400
+    
+    return jsonify({
+        "status": "success",
+        "token": new_token,
+        "expiresIn": TOKEN_EXPIRE_MINUTES * 60,
+        "message": "Token refreshed"
+    })
+
+
 # GỬI VÀ LẤY DỮ LIỆU CẢM BIẾN
 
 @app.route('/api/records/get', methods=['GET'])
@@ -99,11 +130,21 @@ def get_records():
     - from: timestamp bắt đầu
     - to: timestamp kết thúc
     - limit: số lượng records
+    - resolution: raw (mặc định) | 1m | 1h | auto | số giây mỗi điểm (khác raw: trả bucket rollup)
+    - max_points: downsample về tối đa N điểm
+    - fields: field trong data, phân cách bằng dấu phẩy
+    - method: avg | lttb (mặc định avg)
+    - after: cursor từ header X-Next-Cursor của trang trước
     """
     device_id = request.args.get('device_id')
     from_time = request.args.get('from')
     to_time = request.args.get('to')
     limit = request.args.get('limit', 100, type=int)
+    resolution = request.args.get('resolution')
+    max_points = request.args.get('max_points', type=int)
+    fields = request.args.get('fields')
+    method = request.args.get('method')
+    after = request.args.get('after')
     
     if device_id:
         # Lấy history của 1 device
@@ -111,13 +152,40 @@ def get_records():
             device_id=device_id,
             from_time=from_time,
             to_time=to_time,
-            limit=limit
+            limit=limit,
+            resolution=resolution,
+            max_points=max_points,
+            fields=fields,
+            method=method,
+            after=after
         )
     else:
         # Lấy latest của tất cả devices
         return api_controller.get_latest_devices()
 
 
+@app.route('/api/records/export', methods=['GET'])
+@require_auth()
+def export_records():
+    """
+    Export dữ liệu cảm biến cho phân tích offline
+    Query params:
+    - device_id: ID thiết bị (optional, mặc định tất cả)
+    - from, to: khoảng thời gian
+    - format: ndjson | csv | arrow | parquet (mặc định ndjson)
+    - fields: field trong data, phân cách bằng dấu phẩy
+    - gzip: 1 để nén gzip (ndjson/csv)
+    """
+    return api_controller.export_device_history(
+        device_id=request.args.get('device_id'),
+        from_time=request.args.get('from'),
+        to_time=request.args.get('to'),
+        export_format=request.args.get('format', 'ndjson'),
+        fields=request.args.get('fields'),
+        compress=request.args.get('gzip', '').lower() in ('1', 'true')
+    )
+
+
 @app.route('/api/records/delete', methods=['DELETE'])
 @require_auth(required_role='admin')
 def delete_records():
@@ -174,6 +242,53 @@ def update_configs():
         return jsonify({"error": "Failed to update configuration"}), 500
 
 
+@app.route('/api/configs/reclassify', methods=['POST'])
+@require_auth(required_role='admin')
+def reclassify():
+    """
+    Tính lại severity cho dữ liệu cũ theo thresholds hiện tại (Admin only)
+    Body: {"resume": true, "chunk_size": 5000, "max_rate": 50000}
+    """
+    if not timeseries_write_supported():
+        return jsonify({"error": "Reclassification needs standard storage or MongoDB 7.0+ for time-series"}), 400
+    
+    params = request.get_json(silent=True) or {}
+    
+    started = reclassification_job.start(
+        resume=params.get('resume', True),
+        chunk_size=params.get('chunk_size'),
+        max_rate=params.get('max_rate')
+    )
+    
+    if not started:
+        return jsonify({"error": "Reclassification job already running"}), 409
+    
+    return jsonify({
+        "status": "success",
+        "message": "Reclassification job started"
+    }), 202
+
+
+@app.route('/api/configs/reclassify/status', methods=['GET'])
+@require_auth()
+def reclassify_status():
+    """Tiến độ job tính lại severity"""
+    return jsonify(reclassification_job.get_status())
+
+
+@app.route('/api/configs/reclassify/stop', methods=['POST'])
+@require_auth(required_role='admin')
+def reclassify_stop():
+    """Dừng job sau chunk hiện tại, giữ checkpoint để resume (Admin only)"""
+    if not reclassification_job.stop():
+        return jsonify({"error": "Reclassification job is not running"}), 400
+    
+    return jsonify({
+        "status": "success",
+        "message": "Reclassification job stopping"
+    })
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -187,6 +302,41 @@ def get_latest_devices():
     return api_controller.get_latest_devices()
 
 
+@app.route('/api/devices/stream/ticket', methods=['POST'])
+@require_auth()
+def stream_ticket():
+    """Cấp ticket dùng một lần để mở /api/devices/stream bằng EventSource"""
+    token = request.headers.get('Authorization')
+    if token.startswith('Bearer '):
+        token = token[7:]
+    
+    ticket = auth_service.issue_stream_ticket(token)
+    if not ticket:
+        return jsonify({"error": "Unauthorized"}), 403
+    
+    return jsonify({
+        "status": "success",
+        "ticket": ticket,
+        "expiresIn": settings.STREAM_TICKET_SECONDS
+    })
+
+
+@app.route('/api/devices/stream', methods=['GET'])
+@require_auth(query_ticket=True)
+def stream_events():
+    """
+    Push record/cảnh báo mới (Server-Sent Events)
+    Query params:
+    - devices: deviceId phân cách bằng dấu phẩy (mặc định tất cả)
+    - events: reading,alert (mặc định cả hai)
+    - ticket: từ POST /api/devices/stream/ticket nếu không gửi được header Authorization
+    """
+    return api_controller.stream_events(
+        devices=request.args.get('devices'),
+        events=request.args.get('events')
+    )
+
+
 @app.route('/api/devices/<device_id>/history', methods=['GET'])
 @require_auth()
 def get_device_history(device_id):
@@ -194,12 +344,43 @@ def get_device_history(device_id):
     from_time = request.args.get('from')
     to_time = request.args.get('to')
     limit = request.args.get('limit', 100, type=int)
+    resolution = request.args.get('resolution')
+    max_points = request.args.get('max_points', type=int)
+    fields = request.args.get('fields')
+    method = request.args.get('method')
+    after = request.args.get('after')
     
     return api_controller.get_device_history(
         device_id=device_id,
         from_time=from_time,
         to_time=to_time,
-        limit=limit
+        limit=limit,
+        resolution=resolution,
+        max_points=max_points,
+        fields=fields,
+        method=method,
+        after=after
+    )
+
+
+@app.route('/api/devices/<device_id>/export', methods=['GET'])
+@require_auth()
+def export_device_history(device_id):
+    """
+    Export lịch sử của thiết bị (streaming)
+    Query params:
+    - from, to: khoảng thời gian
+    - format: ndjson | csv | arrow | parquet (mặc định ndjson)
+    - fields: field trong data, phân cách bằng dấu phẩy
+    - gzip: 1 để nén gzip (ndjson/csv)
+    """
+    return api_controller.export_device_history(
+        device_id=device_id,
+        from_time=request.args.get('from'),
+        to_time=request.args.get('to'),
+        export_format=request.args.get('format', 'ndjson'),
+        fields=request.args.get('fields'),
+        compress=request.args.get('gzip', '').lower() in ('1', 'true')
     )
 
 
@@ -208,7 +389,10 @@ def get_device_history(device_id):
 def get_alerts():
     """Lấy danh sách cảnh báo"""
     limit = request.args.get('limit', 50, type=int)
-    return api_controller.get_alerts(limit=limit)
+    fields = request.args.get('fields')
+    after = request.args.get('after')
+    status = request.args.get('status')
+    return api_controller.get_alerts(limit=limit, fields=fields, after=after, status=status)
 
 
 @app.route('/api/statistics', methods=['GET'])
@@ -218,6 +402,27 @@ def get_statistics():
     return api_controller.get_statistics()
 
 
+@app.route('/api/statistics/timeline', methods=['GET'])
+@require_auth()
+def get_statistics_timeline():
+    """
+    Số record theo severity trong từng phút/giờ
+    Query params:
+    - resolution: minute | hour (mặc định minute)
+    - hours: khoảng thời gian (mặc định 1)
+    """
+    resolution = request.args.get('resolution', 'minute')
+    hours = request.args.get('hours', 1, type=int)
+    return api_controller.get_statistics_timeline(resolution=resolution, hours=hours)
+
+
+@app.route('/api/statistics/rebuild', methods=['POST'])
+@require_auth(required_role='admin')
+def rebuild_statistics():
+    """Tính lại bộ đếm thống kê từ sensor_data (Admin only)"""
+    return api_controller.rebuild_statistics()
+
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
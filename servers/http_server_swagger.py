@@ -3,16 +3,18 @@ from flask_restx import Api, Resource, fields, Namespace
 from flask_cors import CORS
 from datetime import datetime
 from config.settings import settings
+from database.mongodb import timeseries_write_supported
 from api.api import APIController
-from services.auth import auth_service
+from services.auth import auth_service, TOKEN_EXPIRE_MINUTES
 from services.config_manager import config_manager
+from services.reclassifier import reclassification_job
 from utils.logger import setup_logger
 from functools import wraps
 
 logger = setup_logger(__name__)
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Resolution", "X-Downsample", "X-Next-Cursor", "ETag"])
 
 # Swagger UI Configuration
 authorizations = {
@@ -64,9 +66,16 @@ login_model = api.model('Login', {
 token_response = api.model('TokenResponse', {
     'status': fields.String(description='Status'),
     'token': fields.String(description='JWT Token'),
+    'expiresIn': fields.Integer(description='Token lifetime (seconds)'),
     'message': fields.String(description='Message')
 })
 
+stream_ticket_response = api.model('StreamTicketResponse', {
+    'status': fields.String(description='Status'),
+    'ticket': fields.String(description='Single-use ticket for /api/devices/stream'),
+    'expiresIn': fields.Integer(description='Ticket lifetime (seconds)')
+})
+
 # Config models
 config_update_model = api.model('ConfigUpdate', {
     'thresholds': fields.Raw(description='Threshold settings'),
@@ -74,6 +83,12 @@ config_update_model = api.model('ConfigUpdate', {
     'sensor_settings': fields.Raw(description='Sensor settings')
 })
 
+reclassify_model = api.model('Reclassify', {
+    'resume': fields.Boolean(description='Resume from checkpoint if thresholds unchanged', default=True),
+    'chunk_size': fields.Integer(description='Documents per chunk'),
+    'max_rate': fields.Float(description='Max documents per second (0 = unlimited)')
+})
+
 # Record models
 delete_records_model = api.model('DeleteRecords', {
     'device_id': fields.String(description='Device ID'),
@@ -86,12 +101,19 @@ delete_records_model = api.model('DeleteRecords', {
 # DECORATOR
 # ============================================================
 
-def require_auth(required_role=None):
-    """Decorator to require authentication"""
+def require_auth(required_role=None, query_ticket=False):
+    """
+    Decorator to require authentication
+    query_ticket: also accept a single-use ?ticket= (EventSource cannot send headers)
+    """
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             auth_header = request.headers.get('Authorization')
+            if not auth_header and query_ticket and request.args.get('ticket'):
+                if not auth_service.redeem_stream_ticket(request.args['ticket'], required_role):
+                    api.abort(403, 'Unauthorized')
+                return f(*args, **kwargs)
             if not auth_header:
                 api.abort(401, 'No token provided')
             
@@ -131,6 +153,7 @@ class Login(Resource):
             return {
                 "status": "success",
                 "token": token,
+                "expiresIn": TOKEN_EXPIRE_MINUTES * 60,
                 "message": "Login successful"
             }
         else:
@@ -157,6 +180,29 @@ class Logout(Resource):
             api.abort(400, 'Logout failed')
 
 
+@auth_ns.route('/refresh')
+class RefreshToken(Resource):
+    @auth_ns.doc('refresh_token', security='Bearer')
+    @auth_ns.response(200, 'Success', token_response)
+    @auth_ns.response(401, 'Unauthorized')
+    @require_auth()
+    def post(self):
+        """Đổi token còn hạn lấy token mới (token cũ bị thu hồi)"""
+        auth_header = request.headers.get('Authorization')
+        token = auth_header.replace('Bearer ', '')
+        
+        new_token = auth_service.refresh(token)
+        if not new_token:
+            api.abort(400, 'Refresh failed')
+        
+        return {
+            "status": "success",
+            "token": new_token,
+            "expiresIn": TOKEN_EXPIRE_MINUTES * 60,
+            "message": "Token refreshed"
+        }
+
+
 # ============================================================
 # RECORDS ENDPOINTS
 # ============================================================
@@ -168,6 +214,11 @@ class GetRecords(Resource):
     @records_ns.param('from', 'Start timestamp (ISO 8601)')
     @records_ns.param('to', 'End timestamp (ISO 8601)')
     @records_ns.param('limit', 'Max number of records', type=int)
+    @records_ns.param('resolution', 'raw (default) | 1m | 1h | auto | seconds per point; non-raw returns rollup buckets')
+    @records_ns.param('max_points', 'Downsample to at most N points', type=int)
+    @records_ns.param('fields', 'Comma-separated data fields, e.g. tilt_angle,accel_x')
+    @records_ns.param('method', 'Downsampling method: avg | lttb (default: avg)')
+    @records_ns.param('after', 'Cursor from X-Next-Cursor of the previous page (raw records)')
     @records_ns.response(200, 'Success')
     @require_auth()
     def get(self):
@@ -176,18 +227,52 @@ class GetRecords(Resource):
         from_time = request.args.get('from')
         to_time = request.args.get('to')
         limit = request.args.get('limit', 100, type=int)
+        resolution = request.args.get('resolution')
+        max_points = request.args.get('max_points', type=int)
+        data_fields = request.args.get('fields')
+        method = request.args.get('method')
+        after = request.args.get('after')
         
         if device_id:
             return api_controller.get_device_history(
                 device_id=device_id,
                 from_time=from_time,
                 to_time=to_time,
-                limit=limit
+                limit=limit,
+                resolution=resolution,
+                max_points=max_points,
+                fields=data_fields,
+                method=method,
+                after=after
             )
         else:
             return api_controller.get_latest_devices()
 
 
+@records_ns.route('/export')
+class ExportRecords(Resource):
+    @records_ns.doc('export_records', security='Bearer')
+    @records_ns.param('device_id', 'Device ID (optional, default: all devices)')
+    @records_ns.param('from', 'Start timestamp (ISO 8601)')
+    @records_ns.param('to', 'End timestamp (ISO 8601)')
+    @records_ns.param('format', 'ndjson | csv | arrow | parquet (default: ndjson)')
+    @records_ns.param('fields', 'Comma-separated data fields, e.g. tilt_angle,accel_x')
+    @records_ns.param('gzip', 'Set to 1 to download a gzip file (ndjson/csv)', type=bool)
+    @records_ns.response(200, 'File download')
+    @records_ns.response(501, 'pyarrow not installed')
+    @require_auth()
+    def get(self):
+        """Export dữ liệu cảm biến cho phân tích offline (Arrow/Parquet/NDJSON/CSV)"""
+        return api_controller.export_device_history(
+            device_id=request.args.get('device_id'),
+            from_time=request.args.get('from'),
+            to_time=request.args.get('to'),
+            export_format=request.args.get('format', 'ndjson'),
+            fields=request.args.get('fields'),
+            compress=request.args.get('gzip', '').lower() in ('1', 'true')
+        )
+
+
 @records_ns.route('/delete')
 class DeleteRecords(Resource):
     @records_ns.doc('delete_records', security='Bearer')
@@ -257,6 +342,64 @@ class UpdateConfigs(Resource):
             api.abort(500, 'Failed to update configuration')
 
 
+@configs_ns.route('/reclassify')
+class Reclassify(Resource):
+    @configs_ns.doc('reclassify', security='Bearer')
+    @configs_ns.expect(reclassify_model)
+    @configs_ns.response(202, 'Job started')
+    @configs_ns.response(400, 'Not supported by time-series storage')
+    @configs_ns.response(409, 'Job already running')
+    @configs_ns.response(403, 'Admin only')
+    @require_auth(required_role='admin')
+    def post(self):
+        """Tính lại severity cho dữ liệu cũ theo thresholds hiện tại (Admin only)"""
+        if not timeseries_write_supported():
+            api.abort(400, 'Reclassification needs standard storage or MongoDB 7.0+ for time-series')
+        
+        params = request.get_json(silent=True) or {}
+        
+        started = reclassification_job.start(
+            resume=params.get('resume', True),
+            chunk_size=params.get('chunk_size'),
+            max_rate=params.get('max_rate')
+        )
+        
+        if not started:
+            api.abort(409, 'Reclassification job already running')
+        
+        return {
+            "status": "success",
+            "message": "Reclassification job started"
+        }, 202
+
+
+@configs_ns.route('/reclassify/status')
+class ReclassifyStatus(Resource):
+    @configs_ns.doc('reclassify_status', security='Bearer')
+    @configs_ns.response(200, 'Success')
+    @require_auth()
+    def get(self):
+        """Tiến độ job tính lại severity"""
+        return reclassification_job.get_status()
+
+
+@configs_ns.route('/reclassify/stop')
+class ReclassifyStop(Resource):
+    @configs_ns.doc('reclassify_stop', security='Bearer')
+    @configs_ns.response(200, 'Success')
+    @configs_ns.response(403, 'Admin only')
+    @require_auth(required_role='admin')
+    def post(self):
+        """Dừng job sau chunk hiện tại, giữ checkpoint để resume (Admin only)"""
+        if not reclassification_job.stop():
+            api.abort(400, 'Reclassification job is not running')
+        
+        return {
+            "status": "success",
+            "message": "Reclassification job stopping"
+        }
+
+
 # ============================================================
 # DEVICES ENDPOINTS
 # ============================================================
@@ -271,12 +414,56 @@ class LatestDevices(Resource):
         return api_controller.get_latest_devices()
 
 
+@devices_ns.route('/stream/ticket')
+class DeviceStreamTicket(Resource):
+    @devices_ns.doc('stream_ticket', security='Bearer')
+    @devices_ns.response(200, 'Success', stream_ticket_response)
+    @require_auth()
+    def post(self):
+        """Cấp ticket dùng một lần để mở /api/devices/stream bằng EventSource"""
+        auth_header = request.headers.get('Authorization')
+        token = auth_header.replace('Bearer ', '')
+        
+        ticket = auth_service.issue_stream_ticket(token)
+        if not ticket:
+            api.abort(403, 'Unauthorized')
+        
+        return {
+            "status": "success",
+            "ticket": ticket,
+            "expiresIn": settings.STREAM_TICKET_SECONDS
+        }
+
+
+@devices_ns.route('/stream')
+class DeviceStream(Resource):
+    @devices_ns.doc('stream_events', security='Bearer')
+    @devices_ns.param('devices', 'Comma-separated device IDs (default: all)')
+    @devices_ns.param('events', 'reading | alert, comma-separated (default: both)')
+    @devices_ns.param('ticket', 'Single-use ticket from POST /api/devices/stream/ticket '
+                                '(clients that cannot send the Authorization header)')
+    @devices_ns.response(200, 'text/event-stream')
+    @devices_ns.response(503, 'Too many stream clients')
+    @require_auth(query_ticket=True)
+    def get(self):
+        """Push record/cảnh báo mới qua Server-Sent Events"""
+        return api_controller.stream_events(
+            devices=request.args.get('devices'),
+            events=request.args.get('events')
+        )
+
+
 @devices_ns.route('/<string:device_id>/history')
 class DeviceHistory(Resource):
     @devices_ns.doc('get_device_history', security='Bearer')
     @devices_ns.param('from', 'Start timestamp (ISO 8601)')
     @devices_ns.param('to', 'End timestamp (ISO 8601)')
     @devices_ns.param('limit', 'Max number of records', type=int)
+    @devices_ns.param('resolution', 'raw (default) | 1m | 1h | auto | seconds per point; non-raw returns rollup buckets')
+    @devices_ns.param('max_points', 'Downsample to at most N points', type=int)
+    @devices_ns.param('fields', 'Comma-separated data fields, e.g. tilt_angle,accel_x')
+    @devices_ns.param('method', 'Downsampling method: avg | lttb (default: avg)')
+    @devices_ns.param('after', 'Cursor from X-Next-Cursor of the previous page (raw records)')
     @devices_ns.response(200, 'Success')
     @require_auth()
     def get(self, device_id):
@@ -284,12 +471,44 @@ class DeviceHistory(Resource):
         from_time = request.args.get('from')
         to_time = request.args.get('to')
         limit = request.args.get('limit', 100, type=int)
+        resolution = request.args.get('resolution')
+        max_points = request.args.get('max_points', type=int)
+        data_fields = request.args.get('fields')
+        method = request.args.get('method')
+        after = request.args.get('after')
         
         return api_controller.get_device_history(
             device_id=device_id,
             from_time=from_time,
             to_time=to_time,
-            limit=limit
+            limit=limit,
+            resolution=resolution,
+            max_points=max_points,
+            fields=data_fields,
+            method=method,
+            after=after
+        )
+
+
+@devices_ns.route('/<string:device_id>/export')
+class DeviceExport(Resource):
+    @devices_ns.doc('export_device_history', security='Bearer')
+    @devices_ns.param('from', 'Start timestamp (ISO 8601)')
+    @devices_ns.param('to', 'End timestamp (ISO 8601)')
+    @devices_ns.param('format', 'ndjson | csv | arrow | parquet (default: ndjson)')
+    @devices_ns.param('fields', 'Comma-separated data fields, e.g. tilt_angle,accel_x')
+    @devices_ns.param('gzip', 'Set to 1 to download a gzip file (ndjson/csv)', type=bool)
+    @devices_ns.response(200, 'Streaming NDJSON/CSV')
+    @require_auth()
+    def get(self, device_id):
+        """Export lịch sử của thiết bị (streaming NDJSON/CSV)"""
+        return api_controller.export_device_history(
+            device_id=device_id,
+            from_time=request.args.get('from'),
+            to_time=request.args.get('to'),
+            export_format=request.args.get('format', 'ndjson'),
+            fields=request.args.get('fields'),
+            compress=request.args.get('gzip', '').lower() in ('1', 'true')
         )
 
 
@@ -301,12 +520,20 @@ class DeviceHistory(Resource):
 class Alerts(Resource):
     @alerts_ns.doc('get_alerts', security='Bearer')
     @alerts_ns.param('limit', 'Max number of alerts', type=int)
+    @alerts_ns.param('fields', 'Comma-separated data fields, e.g. tilt_angle,accel_x')
+    @alerts_ns.param('after', 'Cursor from X-Next-Cursor of the previous page')
+    @alerts_ns.param('status', 'Alert status: open | closed (default: all)')
     @alerts_ns.response(200, 'Success')
+    @alerts_ns.response(400, 'Invalid parameters')
     @require_auth()
     def get(self):
-        """Lấy danh sách cảnh báo (danger + critical)"""
+        """Lấy danh sách cảnh báo (mỗi đợt danger/critical của thiết bị)"""
         limit = request.args.get('limit', 50, type=int)
-        return api_controller.get_alerts(limit=limit)
+        data_fields = request.args.get('fields')
+        after = request.args.get('after')
+        status = request.args.get('status')
+        return api_controller.get_alerts(limit=limit, fields=data_fields, after=after,
+                                         status=status)
 
 
 @alerts_ns.route('/statistics')
@@ -319,6 +546,31 @@ class Statistics(Resource):
         return api_controller.get_statistics()
 
 
+@alerts_ns.route('/statistics/timeline')
+class StatisticsTimeline(Resource):
+    @alerts_ns.doc('get_statistics_timeline', security='Bearer')
+    @alerts_ns.param('resolution', 'Bucket size: minute | hour', default='minute')
+    @alerts_ns.param('hours', 'Time range in hours', type=int, default=1)
+    @alerts_ns.response(200, 'Success')
+    @require_auth()
+    def get(self):
+        """Số record theo severity trong từng phút/giờ"""
+        resolution = request.args.get('resolution', 'minute')
+        hours = request.args.get('hours', 1, type=int)
+        return api_controller.get_statistics_timeline(resolution=resolution, hours=hours)
+
+
+@alerts_ns.route('/statistics/rebuild')
+class StatisticsRebuild(Resource):
+    @alerts_ns.doc('rebuild_statistics', security='Bearer')
+    @alerts_ns.response(200, 'Success')
+    @alerts_ns.response(403, 'Admin only')
+    @require_auth(required_role='admin')
+    def post(self):
+        """Tính lại bộ đếm thống kê từ sensor_data (Admin only)"""
+        return api_controller.rebuild_statistics()
+
+
 # ============================================================
 # HEALTH CHECK (No auth required)
 # ============================================================
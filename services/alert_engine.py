@@ -0,0 +1,538 @@
+"""
+Alert engine trên ingest path
+Theo dõi chuyển trạng thái của từng thiết bị và ghi mỗi đợt cảnh báo thành một document
+(mở -> đóng) trong collection alerts, thay vì coi mỗi record danger/critical là một alert
+"""
+
+import math
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from config.settings import settings
+from database.mongodb import get_alerts_collection, get_jobs_collection, get_sensor_collection
+from services.config_manager import DEFAULT_CONFIG, config_manager
+from services.response_cache import response_cache
+from services.severity_analyzer import SEVERITY_LEVELS
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Severity mở alert
+ALERT_SEVERITIES = ("danger", "critical")
+
+# Chuyển trạng thái gửi cho listener (vd: notification dispatcher)
+ALERT_EVENTS = ("opened", "escalated", "closed")
+
+# Field của alert luôn trả về khi API chỉ chọn một số field trong data
+ALERT_FIELDS = ("status", "closedAt", "lastSeen", "readings", "thresholdVersion")
+
+_RANK = {severity: rank for rank, severity in enumerate(SEVERITY_LEVELS)}
+
+# Document trạng thái backfill trong collection jobs
+BACKFILL_ID = "alert_backfill"
+
+# Backfill không cập nhật heartbeat quá bấy nhiêu giây thì process khác được chạy lại
+_BACKFILL_LEASE = 300
+
+# Số alert ghi mỗi lần khi backfill
+_BACKFILL_BATCH = 500
+
+
+class AlertRules(NamedTuple):
+    """
+    Quy tắc mở/đóng alert (từ alert_settings + thresholds của config_manager)
+
+    - min_duration: reading danger/critical phải kéo dài ít nhất bấy nhiêu giây mới mở alert
+    - clear_duration: phải xuống dưới ngưỡng đóng liên tục bấy nhiêu giây mới đóng alert
+    - tilt_clear / accel_clear: ngưỡng đóng = ngưỡng danger - hysteresis, reading còn
+      trên ngưỡng này thì alert đang mở vẫn tiếp tục
+    - max_gap: hai reading cách nhau hơn bấy nhiêu giây thì đợt pending/clear bắt đầu lại (0 = tắt)
+    - stale_timeout: alert đang mở không có reading mới trong bấy nhiêu giây thì đóng tại
+      reading cuối (thiết bị mất kết nối, 0 = tắt)
+    """
+    min_duration: float
+    clear_duration: float
+    tilt_clear: float
+    accel_clear: float
+    max_gap: float
+    stale_timeout: float
+
+
+def _setting(alert_settings: Dict[str, Any], key: str) -> float:
+    """Giá trị số trong alert_settings (không hợp lệ thì dùng mặc định)"""
+    try:
+        return max(0.0, float(alert_settings.get(key, DEFAULT_CONFIG["alert_settings"][key])))
+    except (TypeError, ValueError):
+        return float(DEFAULT_CONFIG["alert_settings"][key])
+
+
+def current_rules() -> AlertRules:
+    """Quy tắc theo cấu hình hiện tại"""
+    alert_settings = config_manager.get("alert_settings", {})
+    snapshot = config_manager.snapshot
+    return AlertRules(
+        min_duration=_setting(alert_settings, "min_duration_seconds"),
+        clear_duration=_setting(alert_settings, "clear_duration_seconds"),
+        tilt_clear=snapshot.tilt_danger - _setting(alert_settings, "tilt_hysteresis"),
+        accel_clear=snapshot.accel_danger - _setting(alert_settings, "accel_hysteresis"),
+        max_gap=_setting(alert_settings, "max_gap_seconds"),
+        stale_timeout=_setting(alert_settings, "stale_timeout_seconds")
+    )
+
+
+class _DeviceState:
+    """Trạng thái alert của một thiết bị"""
+
+    __slots__ = ("last_timestamp", "alert", "pending_since", "pending_peak",
+                 "pending_readings", "clear_since")
+
+    def __init__(self):
+        self.last_timestamp: Optional[datetime] = None
+        self.alert: Optional[Dict[str, Any]] = None
+        self.pending_since: Optional[datetime] = None
+        self.pending_peak: Optional[Dict[str, Any]] = None
+        self.pending_readings = 0
+        self.clear_since: Optional[datetime] = None
+
+
+class AlertEngine:
+    """
+    Máy trạng thái theo thiết bị: bình thường -> chờ (pending) -> mở -> đóng
+
+    - process() chạy sau khi batch đã ghi vào sensor_data, chỉ đổi state trong bộ nhớ
+    - Alert thay đổi được ghi bằng bulk upsert mỗi ALERT_FLUSH_INTERVAL giây
+      (một UpdateOne cho mỗi alert, dù có bao nhiêu reading)
+    - Alert document: deviceId, timestamp (lúc bắt đầu), severity cao nhất, data của
+      reading cao nhất, status open/closed, closedAt, lastSeen, readings
+    - Reading đến trễ (cũ hơn reading đã xử lý của thiết bị) không đổi state
+    - Thiết bị im lặng quá stale_timeout: alert đang mở được đóng khi flush (hoặc khi
+      thiết bị gửi lại)
+    - State nằm trong process ingest; khởi động lại thì nạp các alert đang mở từ MongoDB
+    - Lần đầu chạy: backfill() dựng các alert đã đóng từ ALERT_BACKFILL_DAYS ngày dữ liệu cũ;
+      tới khi xong, API đọc alert theo cách cũ (mỗi record danger/critical là một alert)
+    """
+
+    def __init__(self, flush_interval: Optional[float] = None):
+        self.flush_interval = flush_interval or settings.ALERT_FLUSH_INTERVAL
+
+        self._lock = threading.Lock()
+        self._devices: Dict[str, _DeviceState] = {}
+        self._dirty: Dict[ObjectId, Dict[str, Any]] = {}
+        self._events: List[Tuple[str, Dict[str, Any]]] = []
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._stats = {"opened": 0, "escalated": 0, "closed": 0, "stale": 0, "late": 0}
+        self._backfilled = False
+        self._backfill_thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        """True nếu ALERT_ENGINE_ENABLED"""
+        return settings.ALERT_ENGINE_ENABLED
+
+    def start(self):
+        """Nạp alert đang mở và khởi động thread flush (trong process chạy CoAP ingest)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self.load_open_alerts()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name="alert-flush", daemon=True)
+        self._thread.start()
+        logger.info(f"[Alerts] Flushing every {self.flush_interval}s")
+
+        if not self.backfilled():
+            self._backfill_thread = threading.Thread(
+                target=self.backfill, args=(datetime.utcnow(),), name="alert-backfill", daemon=True
+            )
+            self._backfill_thread.start()
+
+    def stop(self):
+        """Dừng thread flush và ghi nốt các alert đã thay đổi"""
+        if self._thread is None:
+            return
+
+        self._stop_event.set()
+        self._thread.join(timeout=10)
+        self._thread = None
+        if self._backfill_thread is not None:
+            self._backfill_thread.join(timeout=10)
+            self._backfill_thread = None
+        self.flush()
+
+    def add_listener(self, callback: Callable[[str, Dict[str, Any]], None]):
+        """
+        Đăng ký callback(event, alert) cho mỗi chuyển trạng thái (ALERT_EVENTS)
+
+        Callback chạy trên ingest path (ngoài lock), phải nhanh và không I/O;
+        alert là bản copy tại thời điểm chuyển trạng thái.
+        """
+        self._listeners.append(callback)
+
+    def load_open_alerts(self) -> int:
+        """
+        Khôi phục state từ các alert đang mở
+
+        Returns:
+            Số alert đang mở
+        """
+        try:
+            open_alerts = list(get_alerts_collection().find({"status": "open"}))
+        except PyMongoError as e:
+            logger.error(f"[Alerts] Cannot load open alerts: {e}")
+            return 0
+
+        with self._lock:
+            for alert in open_alerts:
+                state = self._devices.setdefault(alert["deviceId"], _DeviceState())
+                state.alert = alert
+                state.last_timestamp = alert.get("lastSeen")
+        return len(open_alerts)
+
+    def process(self, documents: Iterable[Dict[str, Any]]):
+        """
+        Cập nhật state với các document vừa ingest (không I/O)
+
+        Args:
+            documents: Document đã có severity, theo thứ tự thời gian của từng thiết bị
+        """
+        rules = current_rules()
+        with self._lock:
+            for document in documents:
+                state = self._devices.get(document["deviceId"])
+                if state is None:
+                    state = self._devices[document["deviceId"]] = _DeviceState()
+                self._observe(state, document, rules)
+            events, self._events = self._events, []
+
+        self._notify(events)
+
+    def close_stale(self, now: Optional[datetime] = None) -> int:
+        """
+        Đóng alert của các thiết bị không gửi reading trong stale_timeout giây
+
+        Args:
+            now: Thời điểm hiện tại (UTC)
+
+        Returns:
+            Số alert đã đóng
+        """
+        rules = current_rules()
+        if rules.stale_timeout <= 0:
+            return 0
+
+        deadline = (now or datetime.utcnow()) - timedelta(seconds=rules.stale_timeout)
+        closed = 0
+        with self._lock:
+            for state in self._devices.values():
+                if (state.alert is not None and state.last_timestamp is not None
+                        and state.last_timestamp < deadline):
+                    self._close(state, stale=True)
+                    closed += 1
+            events, self._events = self._events, []
+
+        self._notify(events)
+        return closed
+
+    def _notify(self, events: List[Tuple[str, Dict[str, Any]]]):
+        """Gọi listener cho các chuyển trạng thái (ngoài lock)"""
+        for event, alert in events:
+            for listener in self._listeners:
+                listener(event, alert)
+
+    def _observe(self, state: _DeviceState, document: Dict[str, Any], rules: AlertRules):
+        """Áp dụng một reading vào state của thiết bị"""
+        timestamp = document["timestamp"]
+        previous = state.last_timestamp
+        if previous is not None and timestamp < previous:
+            self._stats["late"] += 1
+            return
+        state.last_timestamp = timestamp
+
+        if previous is not None:
+            gap = (timestamp - previous).total_seconds()
+            if state.alert is not None and 0 < rules.stale_timeout < gap:
+                # Thiết bị mất kết nối: đợt cũ kết thúc ở reading cuối trước khoảng trống
+                self._close(state, stale=True)
+            if 0 < rules.max_gap < gap:
+                state.pending_since = state.pending_peak = state.clear_since = None
+                state.pending_readings = 0
+
+        severity = document.get("severity")
+        alert = state.alert
+
+        if alert is None:
+            if severity not in ALERT_SEVERITIES:
+                state.pending_since = state.pending_peak = None
+                state.pending_readings = 0
+                return
+
+            if state.pending_since is None:
+                state.pending_since = timestamp
+            if (state.pending_peak is None
+                    or _RANK[severity] > _RANK[state.pending_peak["severity"]]):
+                state.pending_peak = document
+            state.pending_readings += 1
+
+            if (timestamp - state.pending_since).total_seconds() >= rules.min_duration:
+                self._open(state, timestamp)
+            return
+
+        if severity in ALERT_SEVERITIES or self._above_clear(document, rules):
+            state.clear_since = None
+            alert["lastSeen"] = timestamp
+            alert["readings"] += 1
+            if _RANK.get(severity, 0) > _RANK[alert["severity"]]:
+                self._set_peak(alert, document)
+                self._emit("escalated", alert)
+            self._dirty[alert["_id"]] = alert
+            return
+
+        if state.clear_since is None:
+            state.clear_since = timestamp
+        if (timestamp - state.clear_since).total_seconds() >= rules.clear_duration:
+            self._close(state)
+
+    def _close(self, state: _DeviceState, stale: bool = False):
+        """
+        Đóng alert đang mở của thiết bị
+
+        Args:
+            state: State có alert đang mở
+            stale: Đóng do mất reading (closedAt = reading cuối thay vì lúc xuống dưới ngưỡng)
+        """
+        alert = state.alert
+        alert["status"] = "closed"
+        alert["closedAt"] = (state.clear_since or alert["lastSeen"]) if stale else state.clear_since
+        self._dirty[alert["_id"]] = alert
+        state.alert = state.clear_since = None
+        if stale:
+            self._stats["stale"] += 1
+        self._emit("closed", alert)
+
+    def _open(self, state: _DeviceState, timestamp: datetime):
+        """Mở alert từ đợt pending"""
+        peak = state.pending_peak
+        alert = {
+            "_id": ObjectId(),
+            "deviceId": peak["deviceId"],
+            "timestamp": state.pending_since,
+            "status": "open",
+            "closedAt": None,
+            "lastSeen": timestamp,
+            "readings": state.pending_readings
+        }
+        self._set_peak(alert, peak)
+
+        state.alert = alert
+        state.pending_since = state.pending_peak = state.clear_since = None
+        state.pending_readings = 0
+        self._dirty[alert["_id"]] = alert
+        self._emit("opened", alert)
+
+    def _emit(self, event: str, alert: Dict[str, Any]):
+        """Ghi nhận chuyển trạng thái (listener được gọi sau khi nhả lock)"""
+        self._stats[event] += 1
+        if self._listeners:
+            self._events.append((event, dict(alert)))
+
+    @staticmethod
+    def _set_peak(alert: Dict[str, Any], document: Dict[str, Any]):
+        """Ghi severity + data của reading nghiêm trọng nhất vào alert"""
+        alert["severity"] = document["severity"]
+        alert["data"] = document.get("data")
+        alert["thresholdVersion"] = document.get("thresholdVersion")
+
+    @staticmethod
+    def _above_clear(document: Dict[str, Any], rules: AlertRules) -> bool:
+        """True nếu reading còn trên ngưỡng đóng (vùng hysteresis)"""
+        data = document.get("data") or {}
+        tilt_angle = abs(data.get("tilt_angle", 0.0))
+        accel_magnitude = math.sqrt(
+            data.get("accel_x", 0.0) ** 2 + data.get("accel_y", 0.0) ** 2
+            + data.get("accel_z", 0.0) ** 2
+        )
+        return tilt_angle > rules.tilt_clear or accel_magnitude > rules.accel_clear
+
+    def flush(self) -> bool:
+        """
+        Ghi các alert đã thay đổi xuống MongoDB
+
+        Returns:
+            False nếu ghi lỗi (giữ lại cho lần sau)
+        """
+        with self._lock:
+            if not self._dirty:
+                return True
+            dirty = {alert_id: dict(alert) for alert_id, alert in self._dirty.items()}
+            self._dirty = {}
+
+        try:
+            get_alerts_collection().bulk_write([
+                UpdateOne(
+                    {"_id": alert_id},
+                    {"$set": {key: value for key, value in alert.items() if key != "_id"}},
+                    upsert=True
+                )
+                for alert_id, alert in dirty.items()
+            ], ordered=False)
+        except PyMongoError as e:
+            logger.error(f"[Alerts] Flush failed, will retry: {e}")
+            with self._lock:
+                # Bản mới hơn (nếu có) được giữ nguyên
+                for alert_id, alert in dirty.items():
+                    self._dirty.setdefault(alert_id, alert)
+            return False
+
+        response_cache.bump("alerts")
+        return True
+
+    def backfilled(self) -> bool:
+        """True nếu collection alerts đã được dựng từ dữ liệu cũ (hoặc không cần backfill)"""
+        if self._backfilled:
+            return True
+        try:
+            job = get_jobs_collection().find_one({"_id": BACKFILL_ID}, {"state": 1})
+        except PyMongoError as e:
+            logger.error(f"[Alerts] Cannot read backfill state: {e}")
+            return False
+        self._backfilled = job is not None and job.get("state") == "done"
+        return self._backfilled
+
+    def backfill(self, until: datetime) -> int:
+        """
+        Dựng alert đã đóng từ sensor_data trong ALERT_BACKFILL_DAYS ngày trước until
+
+        Replay record của từng thiết bị qua một AlertEngine riêng với quy tắc hiện tại.
+        Đợt còn mở tại until bị bỏ qua (engine đang chạy sẽ mở lại nếu thiết bị vẫn vượt
+        ngưỡng). Chỉ một process chạy (claim trong collection jobs, có heartbeat); process
+        chết giữa chừng thì process khác chạy lại sau _BACKFILL_LEASE giây.
+
+        Args:
+            until: Thời điểm alert engine bắt đầu nhận dữ liệu (lần chạy đầu tiên)
+
+        Returns:
+            Số alert đã ghi
+        """
+        jobs = get_jobs_collection()
+        alerts = get_alerts_collection()
+        try:
+            until = self._claim_backfill(jobs, until)
+            if until is None:
+                return 0
+
+            written = 0
+            if settings.ALERT_BACKFILL_DAYS > 0:
+                # Lần chạy trước bị dừng: xóa phần đã ghi (alert đóng trước until chỉ đến từ backfill)
+                alerts.delete_many({"status": "closed", "closedAt": {"$lt": until}})
+                written = self._replay(
+                    jobs, alerts, until - timedelta(days=settings.ALERT_BACKFILL_DAYS), until
+                )
+            if written is None:
+                self._release_backfill(jobs)
+                return 0
+
+            jobs.update_one({"_id": BACKFILL_ID},
+                            {"$set": {"state": "done", "alerts": written,
+                                      "finishedAt": datetime.utcnow()}})
+        except PyMongoError as e:
+            logger.error(f"[Alerts] Backfill failed, will retry on next start: {e}")
+            self._release_backfill(jobs)
+            return 0
+
+        self._backfilled = True
+        response_cache.bump("alerts")
+        logger.info(f"[Alerts] Backfilled {written} alerts before {until:%Y-%m-%d %H:%M:%S}")
+        return written
+
+    @staticmethod
+    def _claim_backfill(jobs, until: datetime) -> Optional[datetime]:
+        """Nhận job backfill; trả về mốc until của job (None nếu process khác đang chạy hoặc đã xong)"""
+        now = datetime.utcnow()
+        try:
+            jobs.insert_one({"_id": BACKFILL_ID, "state": "running", "until": until, "heartbeat": now})
+            return until
+        except DuplicateKeyError:
+            pass
+
+        job = jobs.find_one_and_update(
+            {"_id": BACKFILL_ID, "state": "running",
+             "heartbeat": {"$lt": now - timedelta(seconds=_BACKFILL_LEASE)}},
+            {"$set": {"heartbeat": now}},
+            return_document=ReturnDocument.AFTER
+        )
+        return job["until"] if job else None
+
+    @staticmethod
+    def _release_backfill(jobs):
+        """Bỏ claim để lần khởi động sau chạy lại ngay (không chờ hết lease)"""
+        try:
+            jobs.update_one({"_id": BACKFILL_ID, "state": "running"},
+                            {"$set": {"heartbeat": datetime.min}})
+        except PyMongoError as e:
+            logger.error(f"[Alerts] Cannot release backfill: {e}")
+
+    def _replay(self, jobs, alerts, since: datetime, until: datetime) -> Optional[int]:
+        """
+        Chạy record trong [since, until) qua engine riêng, ghi các alert đã đóng theo batch
+
+        Returns:
+            Số alert đã ghi, None nếu dừng giữa chừng (alert engine stop)
+        """
+        engine = AlertEngine()
+        rules = current_rules()
+        written = 0
+
+        cursor = get_sensor_collection().find(
+            {"timestamp": {"$gte": since, "$lt": until}},
+            {"deviceId": 1, "timestamp": 1, "severity": 1, "data": 1, "thresholdVersion": 1}
+        ).sort([("deviceId", ASCENDING), ("timestamp", ASCENDING)])
+
+        for document in cursor:
+            state = engine._devices.get(document["deviceId"])
+            if state is None:
+                # Thiết bị trước đã duyệt xong: bỏ state và đợt còn mở của nó
+                engine._devices = {}
+                engine._dirty = {alert_id: alert for alert_id, alert in engine._dirty.items()
+                                 if alert["status"] == "closed"}
+                state = engine._devices[document["deviceId"]] = _DeviceState()
+            engine._observe(state, document, rules)
+
+            if len(engine._dirty) >= _BACKFILL_BATCH:
+                written += self._write_closed(alerts, engine)
+                jobs.update_one({"_id": BACKFILL_ID}, {"$set": {"heartbeat": datetime.utcnow()}})
+            if self._stop_event.is_set():
+                return None
+
+        return written + self._write_closed(alerts, engine)
+
+    @staticmethod
+    def _write_closed(alerts, engine: "AlertEngine") -> int:
+        """Ghi các alert đã đóng của engine backfill (alert còn mở được giữ lại)"""
+        closed = [alert for alert in engine._dirty.values() if alert["status"] == "closed"]
+        engine._dirty = {alert["_id"]: alert for alert in engine._dirty.values()
+                         if alert["status"] != "closed"}
+        if closed:
+            alerts.insert_many(closed, ordered=False)
+        return len(closed)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Số alert đang mở và số lần chuyển trạng thái"""
+        with self._lock:
+            open_alerts = sum(1 for state in self._devices.values() if state.alert is not None)
+        return {"enabled": self.enabled, "open": open_alerts,
+                "backfilled": self._backfilled, **self._stats}
+
+    def _flush_loop(self):
+        """Thread nền: đóng alert của thiết bị mất kết nối rồi flush định kỳ"""
+        while not self._stop_event.wait(self.flush_interval):
+            self.close_stale()
+            self.flush()
+
+
+# Singleton instance
+alert_engine = AlertEngine()
@@ -0,0 +1,251 @@
+"""
+Async ingest pipeline cho CoAP server
+Parse/phân tích chạy trong executor, ghi MongoDB bằng async driver (Motor)
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from config.settings import settings
+from database.mongodb import get_async_sensor_collection
+from services.data_parser import parser
+from services.severity_analyzer import analyzer
+from services.write_buffer import run_saved_hooks, saved_documents, write_buffer
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class AsyncIngestPipeline:
+    """
+    Xử lý một datagram mà không chặn event loop
+
+    - Parse (fast hoặc Pydantic strict) + severity chạy trong thread pool
+    - insert_one qua Motor; nếu chưa cài motor thì ghi qua write buffer (pymongo theo batch)
+    - Sau khi ghi, các hook (device_latest, stats, alert, response cache) chạy trong executor
+      với đúng các document đã ghi, giống write buffer (run_saved_hooks)
+    - Semaphore giới hạn số request đang xử lý đồng thời (INGEST_CONCURRENCY)
+    """
+
+    def __init__(self,
+                 concurrency: Optional[int] = None,
+                 executor_workers: Optional[int] = None):
+        self.concurrency = concurrency or settings.INGEST_CONCURRENCY
+        self.executor_workers = executor_workers or settings.INGEST_EXECUTOR_WORKERS
+
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._async_collection = None
+        self._in_flight = 0
+        self._stats = {
+            "processed": 0,
+            "invalid": 0,
+            "errors": 0
+        }
+
+    async def start(self):
+        """Khởi tạo semaphore, executor và async collection (trong event loop)"""
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.executor_workers,
+            thread_name_prefix="ingest-cpu"
+        )
+        self._async_collection = get_async_sensor_collection()
+
+        if self._async_collection is not None:
+            driver = "motor"
+        else:
+            driver = "write buffer"
+            logger.warning("[AsyncIngest] motor not installed, falling back to write buffer")
+        logger.info(
+            f"[AsyncIngest] Started (concurrency={self.concurrency}, "
+            f"workers={self.executor_workers}, driver={driver})"
+        )
+
+    async def stop(self):
+        """Dừng executor"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        logger.info(f"[AsyncIngest] Stopped (processed={self._stats['processed']})")
+
+    async def handle(self, payload: bytes, content_format: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Xử lý payload từ ESP32
+
+        Args:
+            payload: Raw bytes từ CoAP request
+            content_format: CoAP Content-Format (None = JSON)
+
+        Returns:
+            Response dict trả về cho ESP32
+        """
+        async with self._semaphore:
+            self._in_flight += 1
+            loop = asyncio.get_running_loop()
+            try:
+                prepared = await loop.run_in_executor(
+                    self._executor, self._prepare, payload, content_format
+                )
+
+                if prepared is None:
+                    self._stats["invalid"] += 1
+                    logger.error("[CoAP] Payload parse error")
+                    return {
+                        "status": "error",
+                        "message": "Invalid payload"
+                    }
+
+                document, severity = prepared
+
+                if self._async_collection is not None:
+                    await self._async_collection.insert_one(document)
+                    await loop.run_in_executor(self._executor, run_saved_hooks, [document])
+                elif not await write_buffer.put(document):
+                    return {
+                        "status": "error",
+                        "message": "Server busy, retry later"
+                    }
+
+                self._stats["processed"] += 1
+                return {
+                    "status": "success",
+                    "severity": severity,
+                    "message": analyzer.get_severity_description(severity)
+                }
+
+            except Exception:
+                self._stats["errors"] += 1
+                raise
+
+            finally:
+                self._in_flight -= 1
+
+    async def handle_batch(self, payload: bytes,
+                           content_format: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Xử lý payload batch (nhiều sample của một thiết bị)
+
+        Args:
+            payload: Raw bytes từ CoAP request
+            content_format: CoAP Content-Format (None = JSON)
+
+        Returns:
+            Response dict tổng hợp (số sample + severity nghiêm trọng nhất)
+        """
+        async with self._semaphore:
+            self._in_flight += 1
+            loop = asyncio.get_running_loop()
+            try:
+                prepared = await loop.run_in_executor(
+                    self._executor, self._prepare_batch, payload, content_format
+                )
+
+                if prepared is None:
+                    self._stats["invalid"] += 1
+                    logger.error("[CoAP] Batch payload parse error")
+                    return {
+                        "status": "error",
+                        "message": "Invalid batch payload"
+                    }
+
+                documents, worst = prepared
+                failed = 0
+
+                if self._async_collection is not None:
+                    try:
+                        await self._async_collection.insert_many(documents, ordered=False)
+                    except BulkWriteError as e:
+                        saved = saved_documents(documents, e)
+                        logger.error(f"[AsyncIngest] Batch partially failed: "
+                                     f"{len(saved)}/{len(documents)} saved")
+                        if not saved:
+                            raise
+                        failed = len(documents) - len(saved)
+                        documents = saved
+                    await loop.run_in_executor(self._executor, run_saved_hooks, documents)
+                elif not await write_buffer.put_many(documents):
+                    return {
+                        "status": "error",
+                        "message": "Server busy, retry later"
+                    }
+
+                self._stats["processed"] += len(documents)
+                response = {
+                    "status": "success",
+                    "count": len(documents),
+                    "severity": worst,
+                    "message": analyzer.get_severity_description(worst)
+                }
+                if failed:
+                    # Sample đã ghi không được gửi lại (tránh bản trùng)
+                    response["failed"] = failed
+                return response
+
+            except Exception:
+                self._stats["errors"] += 1
+                raise
+
+            finally:
+                self._in_flight -= 1
+
+    @staticmethod
+    def _prepare_batch(payload: bytes,
+                       content_format: Optional[int] = None) -> Optional[Tuple[List[Dict[str, Any]], str]]:
+        """
+        Parse batch + tính severity từng sample (chạy trong executor)
+
+        Returns:
+            (list document, severity nghiêm trọng nhất) hoặc None nếu batch lỗi
+        """
+        documents = parser.parse_batch_documents(payload, content_format=content_format)
+        if documents is None:
+            return None
+
+        worst = analyzer.analyze_documents(documents)
+        for document in documents:
+            document["_id"] = ObjectId()
+
+        logger.info(
+            f"[CoAP] Device={documents[0]['deviceId']}, "
+            f"Batch={len(documents)}, Worst={worst}"
+        )
+
+        return documents, worst
+
+    @staticmethod
+    def _prepare(payload: bytes,
+                 content_format: Optional[int] = None) -> Optional[Tuple[Dict[str, Any], str]]:
+        """
+        Phần CPU-bound: parse + validate + tính severity (chạy trong executor)
+
+        Returns:
+            (document MongoDB, severity) hoặc None nếu payload lỗi
+        """
+        document = parser.parse_document(payload, content_format=content_format)
+        if document is None:
+            return None
+
+        severity = analyzer.analyze_document(document)
+        # Gán _id trước: gửi lại batch khi lỗi mạng không tạo bản trùng
+        document["_id"] = ObjectId()
+
+        logger.info(
+            f"[CoAP] Device={document['deviceId']}, "
+            f"Severity={severity}, "
+            f"Tilt={document['data']['tilt_angle']:.2f}°"
+        )
+
+        return document, severity
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê pipeline"""
+        stats = self._stats.copy()
+        stats["in_flight"] = self._in_flight
+        return stats
+
+
+# Singleton instance
+async_ingest = AsyncIngestPipeline()
@@ -5,19 +5,27 @@ Xử lý login, logout, token generation
 
 import jwt
 import hashlib
+import time
+import uuid
 from datetime import datetime, timedelta
 from typing import Optional, Dict
+from config.settings import settings
+from services.token_revocation import revocation_list
 from utils.logger import setup_logger
+from utils.ttl_cache import TTLCache
 
 logger = setup_logger(__name__)
 
 # Secret key cho JWT (trong production dùng env variable)
 SECRET_KEY = "secret-key-change-in-production"
 ALGORITHM = "HS256"
-TOKEN_EXPIRE_HOURS = 24
+TOKEN_EXPIRE_MINUTES = settings.TOKEN_EXPIRE_MINUTES
 
-# In-memory storage cho active tokens (trong production dùng Redis)
-active_tokens = set()
+# Claim "purpose" của ticket mở SSE (token đăng nhập không có claim này)
+STREAM_PURPOSE = "stream"
+
+# Claims đã verify (token -> payload): dashboard gọi lại với cùng token không phải verify HMAC
+claims_cache = TTLCache(settings.AUTH_CLAIMS_CACHE_SIZE, settings.AUTH_CLAIMS_CACHE_TTL)
 
 # Fake user database (trong production dùng MongoDB)
 USERS = {
@@ -76,27 +84,29 @@ class AuthService:
         if not user:
             return None
         
-        # Token payload
+        # Token payload (jti để thu hồi khi logout)
+        now = datetime.utcnow()
         payload = {
             "username": username,
             "role": user["role"],
-            "exp": datetime.utcnow() + timedelta(hours=TOKEN_EXPIRE_HOURS),
-            "iat": datetime.utcnow()
+            "jti": uuid.uuid4().hex,
+            "exp": now + timedelta(minutes=TOKEN_EXPIRE_MINUTES),
+            "iat": now
         }
         
         # Generate token
         token = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
         
-        # Add to active tokens
-        active_tokens.add(token)
-        
         logger.info(f"Token generated for user: {username}")
         return token
     
     @staticmethod
     def verify_token(token: str) -> Optional[Dict]:
         """
-        Verify JWT token
+        Verify JWT token (stateless, không cần lưu token đã cấp)
+        
+        Claims đã verify được cache tối đa AUTH_CLAIMS_CACHE_TTL giây (không quá exp);
+        danh sách thu hồi vẫn được kiểm tra ở mọi request.
         
         Args:
             token: JWT token string
@@ -104,23 +114,93 @@ class AuthService:
         Returns:
             Payload dict nếu valid, None nếu invalid
         """
-        try:
-            # Check if token is active
-            if token not in active_tokens:
-                logger.warning("Token not in active tokens")
+        payload = claims_cache.get(token)
+        if payload is None:
+            try:
+                # Decode and verify
+                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM],
+                                     options={"require": ["exp", "jti"]})
+            except jwt.ExpiredSignatureError:
+                logger.warning("Token expired")
+                return None
+            except jwt.InvalidTokenError as e:
+                logger.warning(f"Invalid token: {e}")
                 return None
             
-            # Decode and verify
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            return payload
+            remaining = payload["exp"] - time.time()
+            claims_cache.set(token, payload, min(settings.AUTH_CLAIMS_CACHE_TTL, remaining))
+        
+        if payload.get("purpose"):
+            # Ticket chỉ dùng cho đúng endpoint của nó
+            logger.warning("Single-purpose ticket used as access token")
+            return None
+        
+        if revocation_list.is_revoked(payload["jti"]):
+            logger.warning("Token revoked")
+            return None
+        
+        return payload
+    
+    @staticmethod
+    def issue_stream_ticket(token: str) -> Optional[str]:
+        """
+        Tạo ticket mở SSE cho client không gửi được header Authorization (EventSource)
+        
+        Ticket là JWT hạn STREAM_TICKET_SECONDS giây, chỉ dùng được cho /api/devices/stream
+        và chỉ một lần, nên lộ qua URL (access log, proxy, lịch sử trình duyệt) không dùng lại được.
+        
+        Args:
+            token: JWT token đăng nhập
             
-        except jwt.ExpiredSignatureError:
-            logger.warning("Token expired")
-            active_tokens.discard(token)
+        Returns:
+            Ticket hoặc None nếu token không hợp lệ
+        """
+        payload = AuthService.verify_token(token)
+        if not payload:
             return None
+        
+        now = datetime.utcnow()
+        return jwt.encode({
+            "username": payload["username"],
+            "role": payload["role"],
+            "purpose": STREAM_PURPOSE,
+            "jti": uuid.uuid4().hex,
+            "exp": now + timedelta(seconds=settings.STREAM_TICKET_SECONDS),
+            "iat": now
+        }, SECRET_KEY, algorithm=ALGORITHM)
+    
+    @staticmethod
+    def redeem_stream_ticket(ticket: str, required_role: Optional[str] = None) -> bool:
+        """
+        Kiểm tra ticket mở SSE và thu hồi ngay (một lần)
+        
+        Args:
+            ticket: Ticket từ issue_stream_ticket()
+            required_role: Role yêu cầu (None = any authenticated user)
+            
+        Returns:
+            True nếu ticket hợp lệ, chưa dùng và đủ quyền
+        """
+        try:
+            payload = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM],
+                                 options={"require": ["exp", "jti", "purpose"]})
         except jwt.InvalidTokenError as e:
-            logger.warning(f"Invalid token: {e}")
-            return None
+            logger.warning(f"Invalid stream ticket: {e}")
+            return False
+        
+        if payload["purpose"] != STREAM_PURPOSE:
+            logger.warning("Stream ticket rejected")
+            return False
+        
+        if required_role and payload.get("role") != required_role:
+            logger.warning(f"Insufficient permissions. Required: {required_role}, Has: {payload.get('role')}")
+            return False
+        
+        # Thu hồi là bước kiểm tra: chỉ request ghi được jti đầu tiên mở được stream
+        if not revocation_list.claim(payload["jti"], datetime.utcfromtimestamp(payload["exp"])):
+            logger.warning("Stream ticket already used")
+            return False
+        return True
     
     @staticmethod
     def login(username: str, password: str) -> Optional[str]:
@@ -145,7 +225,7 @@ class AuthService:
     @staticmethod
     def logout(token: str) -> bool:
         """
-        Logout user và vô hiệu hóa token
+        Logout user và vô hiệu hóa token (thu hồi jti tới khi token hết hạn)
         
         Args:
             token: JWT token
@@ -153,11 +233,34 @@ class AuthService:
         Returns:
             True nếu thành công
         """
-        if token in active_tokens:
-            active_tokens.discard(token)
-            logger.info("User logged out successfully")
-            return True
-        return False
+        payload = AuthService.verify_token(token)
+        if not payload:
+            return False
+        
+        revocation_list.revoke(payload["jti"], datetime.utcfromtimestamp(payload["exp"]))
+        claims_cache.pop(token)
+        logger.info("User logged out successfully")
+        return True
+    
+    @staticmethod
+    def refresh(token: str) -> Optional[str]:
+        """
+        Đổi token còn hạn lấy token mới (token cũ bị thu hồi)
+        
+        Args:
+            token: JWT token hiện tại
+            
+        Returns:
+            Token mới hoặc None nếu token hiện tại không hợp lệ
+        """
+        payload = AuthService.verify_token(token)
+        if not payload:
+            return None
+        
+        new_token = AuthService.generate_token(payload["username"])
+        if new_token:
+            AuthService.logout(token)
+        return new_token
     
     @staticmethod
     def require_auth(token: str, required_role: Optional[str] = None) -> bool:
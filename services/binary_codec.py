@@ -0,0 +1,225 @@
+"""
+Decode payload nhị phân từ ESP32
+- CBOR (Content-Format 60): decoder tối giản cho map/số/chuỗi, đọc thẳng trên memoryview
+- Struct cố định có version (Content-Format 42): float32 + device index
+"""
+
+import struct
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+from config.settings import settings
+
+# CoAP Content-Format (RFC 7252 / IANA registry)
+CONTENT_FORMAT_JSON = 50
+CONTENT_FORMAT_CBOR = 60
+CONTENT_FORMAT_OCTET_STREAM = 42
+
+# ------------------------------------------------------------
+# Fixed struct (little-endian như ESP32)
+#
+# v1 header (12 bytes): version u8 | flags u8 | device_index u16 | ts_ms u64
+# body (40 bytes):      ax ay az gx gy gz mx my mz tilt   (float32 x 10)
+# location (8 bytes):   lat lon (float32 x 2), chỉ có khi flags & FLAG_LOCATION
+# ------------------------------------------------------------
+STRUCT_VERSION = 1
+FLAG_LOCATION = 0x01
+
+# float32 -> float64 sinh đuôi nhiễu (0.12 -> 0.11999999731779099), làm tròn khi lưu
+FLOAT_DECIMALS = 6
+
+_HEADER = struct.Struct("<BBHQ")
+_BODY = struct.Struct("<10f")
+_LOCATION = struct.Struct("<2f")
+
+
+class BinaryDecodeError(ValueError):
+    """Payload nhị phân không hợp lệ"""
+
+
+def device_id_from_index(index: int) -> str:
+    """Đổi device index trong struct sang deviceId (vd: 1 -> "ESP001")"""
+    return settings.BINARY_DEVICE_ID_FORMAT.format(index)
+
+
+def decode_struct(payload: bytes) -> Dict[str, Any]:
+    """
+    Decode struct v1 thành document MongoDB (giống SensorData.to_dict())
+
+    Args:
+        payload: Raw bytes từ CoAP request
+
+    Returns:
+        Document MongoDB
+
+    Raises:
+        BinaryDecodeError: Sai version, sai độ dài hoặc device index 0 (firmware chưa cấu hình)
+    """
+    view = memoryview(payload)
+    if len(view) < _HEADER.size + _BODY.size:
+        raise BinaryDecodeError(f"Struct payload too short ({len(view)} bytes)")
+
+    version, flags, device_index, ts = _HEADER.unpack_from(view, 0)
+    if version != STRUCT_VERSION:
+        raise BinaryDecodeError(f"Unsupported struct version {version}")
+
+    expected = _HEADER.size + _BODY.size + (_LOCATION.size if flags & FLAG_LOCATION else 0)
+    if len(view) != expected:
+        raise BinaryDecodeError(f"Struct payload length {len(view)}, expected {expected}")
+    if device_index == 0:
+        # deviceId bắt đầu từ 1 (ESP001), 0 là giá trị mặc định của firmware chưa cấu hình
+        raise BinaryDecodeError("Device index 0 is not assigned")
+
+    ax, ay, az, gx, gy, gz, _mx, _my, _mz, tilt = _BODY.unpack_from(view, _HEADER.size)
+
+    location = None
+    if flags & FLAG_LOCATION:
+        lat, lon = _LOCATION.unpack_from(view, _HEADER.size + _BODY.size)
+        location = {"lat": round(lat, FLOAT_DECIMALS), "lon": round(lon, FLOAT_DECIMALS)}
+
+    try:
+        timestamp = datetime.utcfromtimestamp(ts / 1000.0) if ts else datetime.utcnow()
+    except (OverflowError, OSError, ValueError) as e:
+        raise BinaryDecodeError(f"Invalid timestamp {ts}: {e}") from e
+
+    return {
+        "deviceId": device_id_from_index(device_index),
+        "timestamp": timestamp,
+        "data": {
+            "accel_x": round(ax, FLOAT_DECIMALS),
+            "accel_y": round(ay, FLOAT_DECIMALS),
+            "accel_z": round(az, FLOAT_DECIMALS),
+            "gyro_x": round(gx, FLOAT_DECIMALS),
+            "gyro_y": round(gy, FLOAT_DECIMALS),
+            "gyro_z": round(gz, FLOAT_DECIMALS),
+            "tilt_angle": round(tilt, FLOAT_DECIMALS)
+        },
+        "severity": "normal",
+        "location": location
+    }
+
+
+def encode_struct(device_index: int, values: Tuple[float, ...], ts: int = 0,
+                  location: Optional[Tuple[float, float]] = None) -> bytes:
+    """
+    Encode struct v1 (dùng cho test/simulator, firmware ESP32 làm tương tự bằng C)
+
+    Args:
+        device_index: Index thiết bị (u16)
+        values: (ax, ay, az, gx, gy, gz, mx, my, mz, tilt)
+        ts: Timestamp milliseconds (0 = server tự gán)
+        location: (lat, lon) hoặc None
+    """
+    flags = FLAG_LOCATION if location is not None else 0
+    payload = _HEADER.pack(STRUCT_VERSION, flags, device_index, ts) + _BODY.pack(*values)
+    if location is not None:
+        payload += _LOCATION.pack(*location)
+    return payload
+
+
+# ------------------------------------------------------------
+# CBOR (RFC 8949) - chỉ hỗ trợ độ dài xác định, đủ cho payload của ESP32
+# ------------------------------------------------------------
+
+_UINT8 = struct.Struct(">B")
+_UINT16 = struct.Struct(">H")
+_UINT32 = struct.Struct(">I")
+_UINT64 = struct.Struct(">Q")
+_FLOAT16 = struct.Struct(">e")
+_FLOAT32 = struct.Struct(">f")
+_FLOAT64 = struct.Struct(">d")
+
+_SIMPLE_VALUES = {20: False, 21: True, 22: None, 23: None}
+
+
+def decode_cbor(payload: bytes) -> Any:
+    """
+    Decode một CBOR data item
+
+    Args:
+        payload: Raw bytes
+
+    Returns:
+        Giá trị Python (dict/list/str/int/float/bool/None)
+
+    Raises:
+        BinaryDecodeError: CBOR không hợp lệ hoặc không hỗ trợ
+    """
+    view = memoryview(payload)
+    try:
+        value, offset = _decode_item(view, 0)
+    except (struct.error, IndexError, UnicodeDecodeError, TypeError, RecursionError) as e:
+        raise BinaryDecodeError(f"Invalid CBOR: {e}") from e
+
+    if offset != len(view):
+        raise BinaryDecodeError("Trailing bytes after CBOR item")
+    return value
+
+
+def _read_argument(view: memoryview, offset: int, info: int) -> Tuple[int, int]:
+    """Đọc argument (độ dài / giá trị) theo additional info"""
+    if info < 24:
+        return info, offset
+    if info == 24:
+        return _UINT8.unpack_from(view, offset)[0], offset + 1
+    if info == 25:
+        return _UINT16.unpack_from(view, offset)[0], offset + 2
+    if info == 26:
+        return _UINT32.unpack_from(view, offset)[0], offset + 4
+    if info == 27:
+        return _UINT64.unpack_from(view, offset)[0], offset + 8
+    raise BinaryDecodeError("Indefinite-length CBOR items are not supported")
+
+
+def _decode_item(view: memoryview, offset: int) -> Tuple[Any, int]:
+    """Decode item tại offset, trả về (giá trị, offset kế tiếp)"""
+    initial = view[offset]
+    major, info = initial >> 5, initial & 0x1F
+    offset += 1
+
+    if major == 7:
+        if info == 25:
+            return _FLOAT16.unpack_from(view, offset)[0], offset + 2
+        if info == 26:
+            return _FLOAT32.unpack_from(view, offset)[0], offset + 4
+        if info == 27:
+            return _FLOAT64.unpack_from(view, offset)[0], offset + 8
+        if info in _SIMPLE_VALUES:
+            return _SIMPLE_VALUES[info], offset
+        raise BinaryDecodeError(f"Unsupported CBOR simple value {info}")
+
+    argument, offset = _read_argument(view, offset, info)
+
+    if major in (4, 5) and argument > len(view) - offset:
+        # Mỗi phần tử cần ít nhất 1 byte
+        raise BinaryDecodeError("CBOR container length out of range")
+
+    if major == 0:
+        return argument, offset
+    if major == 1:
+        return -1 - argument, offset
+    if major == 2:
+        end = offset + argument
+        if end > len(view):
+            raise BinaryDecodeError("CBOR byte string out of range")
+        return bytes(view[offset:end]), end
+    if major == 3:
+        end = offset + argument
+        if end > len(view):
+            raise BinaryDecodeError("CBOR text string out of range")
+        return str(view[offset:end], "utf-8"), end
+    if major == 4:
+        items = []
+        for _ in range(argument):
+            item, offset = _decode_item(view, offset)
+            items.append(item)
+        return items, offset
+    if major == 5:
+        result = {}
+        for _ in range(argument):
+            key, offset = _decode_item(view, offset)
+            value, offset = _decode_item(view, offset)
+            result[key] = value
+        return result, offset
+
+    # major == 6: tag -> bỏ qua tag, lấy giá trị bên trong
+    return _decode_item(view, offset)
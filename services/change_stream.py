@@ -0,0 +1,156 @@
+"""
+Change-stream subscriber cho triển khai nhiều process
+Process API (không chạy CoAP ingest) theo dõi insert trên sensor_data qua một change stream
+duy nhất và cập nhật latest cache + event bus (SSE) như khi ingest chạy trong cùng process
+"""
+
+import threading
+from typing import Any, Dict, List, Optional
+from pymongo.errors import OperationFailure, PyMongoError
+from config.settings import settings
+from database.mongodb import get_sensor_collection
+from services.event_bus import event_bus
+from services.latest_cache import latest_cache
+from services.response_cache import response_cache
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Resume token không còn trong oplog / stream bị invalidate
+_RESUME_ERRORS = (260, 280, 286)
+
+# Chỉ cần document mới, _id của event là resume token
+_PIPELINE = [
+    {"$match": {"operationType": "insert"}},
+    {"$project": {"fullDocument": 1}}
+]
+
+
+class ChangeStreamSubscriber:
+    """
+    Một change stream cho cả process, fan-out theo batch
+
+    - Gom tối đa CHANGE_STREAM_BATCH event (hoặc tới khi cursor tạm hết) rồi gọi
+      latest_cache.update_many() và event_bus.publish_documents() một lần
+    - Resume token chỉ giữ trong bộ nhớ: mất kết nối thì mở lại stream từ token cuối.
+      Mọi consumer là state trong process (latest cache, SSE, response cache) nên process
+      khởi động lại bắt đầu từ hiện tại và warm latest cache, không cần token đã lưu
+      (mỗi worker gunicorn có stream riêng, không dùng chung một checkpoint)
+    - Token hết hạn (oplog đã xoay vòng): mở stream mới và warm lại latest cache
+    - Bộ đếm thống kê đã được ingest process $inc vào MongoDB nên không cần cập nhật ở đây
+    """
+
+    def __init__(self, batch_size: Optional[int] = None):
+        self.batch_size = batch_size or settings.CHANGE_STREAM_BATCH
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._resume_token: Optional[Dict[str, Any]] = None
+        self._stats = {"events": 0, "batches": 0, "restarts": 0}
+
+    @property
+    def running(self) -> bool:
+        """True nếu thread đang chạy"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        """
+        Khởi động thread theo dõi (trong process phục vụ API khi ingest chạy ở process khác)
+
+        Returns:
+            False nếu không dùng được change stream (time-series collection)
+        """
+        if self.running:
+            return True
+
+        if settings.STORAGE_MODE == "timeseries":
+            logger.warning("[ChangeStream] Not supported on time-series collections")
+            return False
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="change-stream", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Dừng thread"""
+        if not self.running:
+            return
+
+        self._stop_event.set()
+        self._thread.join(timeout=10)
+        self._thread = None
+        latest_cache.detach()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Trạng thái subscriber"""
+        return {"running": self.running, **self._stats}
+
+    def _loop(self):
+        """Thread nền: mở stream, xử lý batch, mở lại khi lỗi"""
+        self._resume_token = None
+
+        while not self._stop_event.is_set():
+            try:
+                self._watch()
+            except OperationFailure as e:
+                if e.code in _RESUME_ERRORS:
+                    logger.warning(f"[ChangeStream] Resume token expired, restarting: {e}")
+                    self._resume_token = None
+                else:
+                    # Vd: MongoDB standalone (change stream cần replica set)
+                    logger.error(f"[ChangeStream] Stopped: {e}")
+                    latest_cache.detach()
+                    return
+            except PyMongoError as e:
+                logger.error(f"[ChangeStream] Stream failed, reconnecting: {e}")
+
+            latest_cache.detach()
+            if self._stop_event.is_set():
+                break
+            self._stats["restarts"] += 1
+            self._stop_event.wait(1)
+
+    def _watch(self):
+        """Xử lý stream tới khi stop hoặc lỗi"""
+        with get_sensor_collection().watch(
+            _PIPELINE,
+            resume_after=self._resume_token,
+            batch_size=self.batch_size,
+            max_await_time_ms=500
+        ) as stream:
+            # Stream đã mở nên không mất insert nào xảy ra trong lúc warm
+            # (latest cache bỏ qua document cũ hơn bản đang giữ)
+            latest_cache.attach()
+            logger.info(f"[ChangeStream] Watching sensor_data "
+                        f"({'resumed' if self._resume_token else 'from now'})")
+
+            while not self._stop_event.is_set() and stream.alive:
+                documents = self._next_batch(stream)
+                if documents:
+                    self._dispatch(documents)
+
+                if stream.resume_token is not None:
+                    self._resume_token = stream.resume_token
+
+    def _next_batch(self, stream) -> List[Dict[str, Any]]:
+        """Gom event tới batch_size hoặc tới khi cursor tạm hết"""
+        documents = []
+        while len(documents) < self.batch_size:
+            change = stream.try_next()
+            if change is None:
+                break
+            documents.append(change["fullDocument"])
+        return documents
+
+    def _dispatch(self, documents: List[Dict[str, Any]]):
+        """Fan-out một batch cho mọi consumer trong process"""
+        latest_cache.update_many(documents)
+        response_cache.records_changed(documents)
+        event_bus.publish_documents(documents)
+        self._stats["events"] += len(documents)
+        self._stats["batches"] += 1
+
+
+# Singleton instance
+change_stream = ChangeStreamSubscriber()
@@ -0,0 +1,231 @@
+"""
+Export lịch sử cảm biến dạng cột (Apache Arrow IPC / Parquet) cho phân tích offline
+Cột được điền theo từng batch của cursor; dùng pymongoarrow nếu đã cài
+(mỗi batch một query keyset (timestamp, _id) nên bộ nhớ không phụ thuộc số record)
+
+Usage (CLI):
+    python -m services.columnar_export --device ESP001 --from 2025-01-01T00:00:00Z \\
+        --format parquet -o ESP001.parquet
+"""
+
+import argparse
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Union
+from bson import ObjectId
+from config.settings import settings
+from database.mongodb import get_sensor_collection
+from services.downsampling import DATA_FIELDS, parse_fields
+from utils.logger import setup_logger
+
+# Arrow/Parquet (optional)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Đọc thẳng cursor vào Arrow bằng C extension (optional)
+try:
+    from pymongoarrow.api import Schema, aggregate_arrow_all
+except ImportError:
+    Schema = aggregate_arrow_all = None
+
+logger = setup_logger(__name__)
+
+COLUMNAR_FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.file", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet")
+}
+
+# Cột cố định, trước các field trong data (cùng thứ tự với CSV export)
+_BASE_COLUMNS = ("deviceId", "timestamp", "severity", "thresholdVersion")
+
+
+def available() -> bool:
+    """True nếu đã cài pyarrow"""
+    return pa is not None
+
+
+def arrow_schema(fields: Sequence[str]) -> "pa.Schema":
+    """Schema của bảng export: cột cố định + một cột float64 cho mỗi field trong data"""
+    return pa.schema(
+        [
+            ("deviceId", pa.string()),
+            ("timestamp", pa.timestamp("ms")),
+            ("severity", pa.string()),
+            ("thresholdVersion", pa.int64())
+        ]
+        + [(field, pa.float64()) for field in fields]
+    )
+
+
+def _pipeline(query: Dict[str, Any], fields: Sequence[str], limit: int) -> List[Dict[str, Any]]:
+    """$match + $sort (timestamp, _id) + $limit + $project phẳng (data.x -> x) cho pymongoarrow"""
+    project = {"_id": 1}
+    project.update({column: 1 for column in _BASE_COLUMNS})
+    project.update({field: f"$data.{field}" for field in fields})
+    return [
+        {"$match": query},
+        {"$sort": {"timestamp": 1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": project}
+    ]
+
+
+def _after(query: Dict[str, Any], timestamp: datetime, last_id: ObjectId) -> Dict[str, Any]:
+    """Query cho các record sau (timestamp, _id) theo thứ tự tăng dần"""
+    return {"$and": [query, {"$or": [
+        {"timestamp": {"$gt": timestamp}},
+        {"timestamp": timestamp, "_id": {"$gt": last_id}}
+    ]}]}
+
+
+def iter_batches(collection, query: Dict[str, Any],
+                 fields: Optional[Sequence[str]] = None,
+                 batch_size: Optional[int] = None) -> Iterator["pa.RecordBatch"]:
+    """
+    Đọc cursor và điền cột theo từng batch
+
+    Args:
+        collection: Collection sensor_data
+        query: Filter (deviceId, khoảng thời gian)
+        fields: Field trong data (None = toàn bộ)
+        batch_size: Số document mỗi RecordBatch (mặc định EXPORT_BATCH_SIZE)
+
+    Returns:
+        Iterator RecordBatch tăng dần theo thời gian
+    """
+    fields = list(fields or DATA_FIELDS)
+    batch_size = batch_size or settings.EXPORT_BATCH_SIZE
+    schema = arrow_schema(fields)
+
+    if aggregate_arrow_all is not None:
+        # Mỗi lần một bảng batch_size dòng: không dựng cả kết quả trong bộ nhớ
+        arrow_types = {"_id": ObjectId}
+        arrow_types.update({name: schema.field(name).type for name in schema.names})
+        batch_query = query
+        while True:
+            table = aggregate_arrow_all(
+                collection, _pipeline(batch_query, fields, batch_size), schema=Schema(arrow_types)
+            )
+            if table.num_rows:
+                yield from table.select(schema.names).cast(schema).to_batches(batch_size)
+            if table.num_rows < batch_size:
+                return
+            batch_query = _after(
+                query,
+                table.column("timestamp")[-1].as_py(),
+                ObjectId(table.column("_id")[-1].as_py())
+            )
+
+    projection = {"_id": 0}
+    projection.update({column: 1 for column in _BASE_COLUMNS})
+    projection.update({f"data.{field}": 1 for field in fields})
+
+    cursor = collection.find(query, projection).sort("timestamp", 1).batch_size(batch_size)
+    columns: Dict[str, list] = {name: [] for name in schema.names}
+    try:
+        for document in cursor:
+            for column in _BASE_COLUMNS:
+                columns[column].append(document.get(column))
+            data = document.get("data") or {}
+            for field in fields:
+                columns[field].append(data.get(field))
+
+            if len(columns["timestamp"]) >= batch_size:
+                yield pa.RecordBatch.from_pydict(columns, schema=schema)
+                columns = {name: [] for name in schema.names}
+
+        if columns["timestamp"]:
+            yield pa.RecordBatch.from_pydict(columns, schema=schema)
+    finally:
+        cursor.close()
+
+
+def write_columnar(collection, query: Dict[str, Any], export_format: str,
+                   sink: Union[str, BinaryIO],
+                   fields: Optional[Sequence[str]] = None) -> int:
+    """
+    Ghi kết quả query ra file Arrow IPC hoặc Parquet
+
+    Args:
+        collection: Collection sensor_data
+        query: Filter (deviceId, khoảng thời gian)
+        export_format: "arrow" hoặc "parquet"
+        sink: Đường dẫn file hoặc file object (binary)
+        fields: Field trong data (None = toàn bộ)
+
+    Returns:
+        Số record đã ghi
+
+    Raises:
+        RuntimeError: Chưa cài pyarrow
+        ValueError: Format không hợp lệ
+    """
+    if not available():
+        raise RuntimeError("pyarrow is not installed")
+    if export_format not in COLUMNAR_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(COLUMNAR_FORMATS)}")
+
+    schema = arrow_schema(list(fields or DATA_FIELDS))
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+
+    rows = 0
+    try:
+        for batch in iter_batches(collection, query, fields):
+            if export_format == "parquet":
+                writer.write_batch(batch)
+            else:
+                writer.write(batch)
+            rows += batch.num_rows
+    finally:
+        writer.close()
+
+    logger.info(f"Exported {rows} records as {export_format}")
+    return rows
+
+
+def build_query(device_id: Optional[str], start: Optional[datetime],
+                end: Optional[datetime]) -> Dict[str, Any]:
+    """Query theo thiết bị (None = tất cả) và khoảng thời gian"""
+    query: Dict[str, Any] = {}
+    if device_id:
+        query["deviceId"] = device_id
+    if start or end:
+        query["timestamp"] = {}
+        if start:
+            query["timestamp"]["$gte"] = start
+        if end:
+            query["timestamp"]["$lte"] = end
+    return query
+
+
+def main():
+    """CLI: export ra file không qua HTTP server"""
+    def iso_datetime(value: str) -> datetime:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+    arg_parser = argparse.ArgumentParser(description="Export sensor history as Arrow/Parquet")
+    arg_parser.add_argument("--device", help="Device ID (mặc định: tất cả thiết bị)")
+    arg_parser.add_argument("--from", dest="from_time", type=iso_datetime, help="ISO 8601")
+    arg_parser.add_argument("--to", dest="to_time", type=iso_datetime, help="ISO 8601")
+    arg_parser.add_argument("--fields", help="Field trong data, phân cách bằng dấu phẩy")
+    arg_parser.add_argument("--format", choices=list(COLUMNAR_FORMATS), default="parquet")
+    arg_parser.add_argument("-o", "--output", required=True, help="File output")
+    args = arg_parser.parse_args()
+
+    rows = write_columnar(
+        get_sensor_collection(),
+        build_query(args.device, args.from_time, args.to_time),
+        args.format,
+        args.output,
+        parse_fields(args.fields)
+    )
+    print(f"{rows} records -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
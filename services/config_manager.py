@@ -1,24 +1,47 @@
-from typing import Dict, Any
+import copy
+import threading
+import time
+from typing import Dict, Any, NamedTuple, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from config.settings import settings
+from database.mongodb import get_configs_collection
+from services.notification_senders import webhook_url_allowed
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# _id của document cấu hình trong collection configs
+CONFIG_ID = "system"
+
 # Default configuration
 DEFAULT_CONFIG = {
     "thresholds": {
-        "tilt_warning": 10.0,
-        "tilt_danger": 20.0,
-        "tilt_critical": 30.0,
-        "accel_warning": 10.5,
-        "accel_danger": 12.0,
-        "accel_critical": 15.0
+        "tilt_warning": settings.THRESHOLD_WARNING,
+        "tilt_danger": settings.THRESHOLD_DANGER,
+        "tilt_critical": settings.THRESHOLD_CRITICAL,
+        "accel_warning": settings.ACCEL_WARNING,
+        "accel_danger": settings.ACCEL_DANGER,
+        "accel_critical": settings.ACCEL_CRITICAL
     },
     "alert_settings": {
         "enable_email": False,
         "enable_sms": False,
         "enable_web_notification": True,
+        "enable_webhook": False,
         "email_recipients": [],
-        "sms_recipients": []
+        "sms_recipients": [],
+        "webhook_urls": [],
+        # Alert engine: mở khi danger/critical kéo dài >= min_duration_seconds,
+        # đóng khi dưới (ngưỡng danger - hysteresis) liên tục >= clear_duration_seconds
+        "min_duration_seconds": 10,
+        "clear_duration_seconds": 30,
+        "tilt_hysteresis": 2.0,  # degree
+        "accel_hysteresis": 0.5,  # m/s²
+        # Khoảng trống giữa 2 reading lớn hơn max_gap_seconds thì đợt chờ (pending) bắt đầu lại;
+        # alert đang mở không nhận reading trong stale_timeout_seconds thì tự đóng
+        "max_gap_seconds": 60,
+        "stale_timeout_seconds": 300
     },
     "sensor_settings": {
         "sample_rate": 5,  # seconds
@@ -31,13 +54,98 @@ DEFAULT_CONFIG = {
 }
 
 
+THRESHOLD_KEYS = (
+    "tilt_warning", "tilt_danger", "tilt_critical",
+    "accel_warning", "accel_danger", "accel_critical"
+)
+
+
+class ThresholdSnapshot(NamedTuple):
+    """
+    Bộ ngưỡng đã compile, bất biến (tuple of floats)
+    
+    Ingest đọc config_manager.snapshot một lần cho mỗi packet rồi dùng các field,
+    không cần lock hay duyệt dict. version = thời điểm áp dụng (ms), tăng dần
+    kể cả qua các lần restart, được lưu vào mỗi document (thresholdVersion).
+    """
+    version: int
+    tilt_warning: float
+    tilt_danger: float
+    tilt_critical: float
+    accel_warning: float
+    accel_danger: float
+    accel_critical: float
+    
+    def thresholds(self) -> Dict[str, float]:
+        """Dict ngưỡng dạng config (không kèm version)"""
+        return {key: getattr(self, key) for key in THRESHOLD_KEYS}
+
+
 class ConfigManager:
-    """Quản lý cấu hình hệ thống"""
+    """
+    Quản lý cấu hình hệ thống
+    
+    Sau attach(), cấu hình được lưu trong collection configs: mỗi lần thay đổi ghi lại
+    (revision tăng dần) và mọi process (CoAP ingest, các worker gunicorn) đọc lại
+    mỗi CONFIG_SYNC_INTERVAL giây, nên thay đổi từ API áp dụng cho cả ingest.
+    """
     
     def __init__(self):
-        self._config = DEFAULT_CONFIG.copy()
+        self._config = copy.deepcopy(DEFAULT_CONFIG)
+        self.snapshot = self._compile_thresholds(self._config["thresholds"], previous=None)
+        self._attached = False
+        self._revision = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
         logger.info("ConfigManager initialized")
     
+    def attach(self):
+        """Nạp cấu hình đã lưu và theo dõi thay đổi từ process khác (gọi một lần mỗi process)"""
+        if self._attached:
+            return
+        self._attached = True
+        self.reload()
+        
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._sync_loop, name="config-sync", daemon=True)
+        self._thread.start()
+    
+    def detach(self):
+        """Dừng theo dõi, thay đổi sau đó chỉ áp dụng trong process này"""
+        if not self._attached:
+            return
+        self._attached = False
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+    
+    def reload(self) -> bool:
+        """
+        Áp dụng cấu hình đã lưu nếu có revision mới hơn
+        
+        Returns:
+            True nếu cấu hình thay đổi
+        """
+        try:
+            stored = get_configs_collection().find_one({"_id": CONFIG_ID})
+        except PyMongoError as e:
+            logger.error(f"Failed to load stored config: {e}")
+            return False
+        
+        if not stored:
+            # Process đầu tiên: lưu cấu hình hiện tại để các process dùng chung thresholdVersion
+            self._save(self._config, self.snapshot)
+            return False
+        if stored.get("revision", 0) <= self._revision:
+            return False
+        
+        if not self._apply(stored["config"], version=stored.get("thresholdVersion"), persist=False):
+            return False
+        self._revision = stored["revision"]
+        logger.info(f"Config revision {self._revision} loaded")
+        return True
+    
     def get_all(self) -> Dict[str, Any]:
         """
         Lấy toàn bộ cấu hình
@@ -80,7 +188,8 @@ class ConfigManager:
             True nếu thành công
         """
         keys = key.split('.')
-        config = self._config
+        new_config = copy.deepcopy(self._config)
+        config = new_config
         
         try:
             # Navigate to parent
@@ -91,6 +200,10 @@ class ConfigManager:
             
             # Set value
             config[keys[-1]] = value
+            
+            if not self._apply(new_config):
+                return False
+            
             logger.info(f"Config updated: {key} = {value}")
             return True
             
@@ -117,7 +230,12 @@ class ConfigManager:
                     else:
                         base[key] = value
             
-            deep_update(self._config, updates)
+            new_config = copy.deepcopy(self._config)
+            deep_update(new_config, updates)
+            
+            if not self._apply(new_config):
+                return False
+            
             logger.info(f"Config updated with {len(updates)} changes")
             return True
             
@@ -133,13 +251,121 @@ class ConfigManager:
             True nếu thành công
         """
         try:
-            self._config = DEFAULT_CONFIG.copy()
+            if not self._apply(copy.deepcopy(DEFAULT_CONFIG)):
+                return False
+            
             logger.info("Config reset to defaults")
             return True
         except Exception as e:
             logger.error(f"Failed to reset config: {e}")
             return False
     
+    def _apply(self, new_config: Dict[str, Any], version: Optional[int] = None,
+               persist: bool = True) -> bool:
+        """
+        Compile thresholds rồi swap config + snapshot (không cần lock: mỗi phép gán
+        là atomic, reader trên hot path chỉ đọc self.snapshot)
+        
+        Args:
+            new_config: Cấu hình mới
+            version: Version của thresholds (cấu hình đọc từ collection configs)
+            persist: Ghi vào collection configs trước khi áp dụng (khi đã attach())
+        
+        Returns:
+            False nếu thresholds / webhook_urls mới không hợp lệ hoặc không lưu được
+            (giữ nguyên cấu hình cũ)
+        """
+        if persist and not self._webhooks_allowed(new_config):
+            return False
+        
+        thresholds = new_config.get("thresholds", {})
+        snapshot = self.snapshot
+        
+        if thresholds != snapshot.thresholds() or version not in (None, snapshot.version):
+            snapshot = self._compile_thresholds(thresholds, previous=snapshot, version=version)
+            if snapshot is None:
+                return False
+            logger.info(f"Thresholds v{snapshot.version} applied: {snapshot.thresholds()}")
+        
+        if persist and self._attached and not self._save(new_config, snapshot):
+            return False
+        
+        self._config = new_config
+        self.snapshot = snapshot
+        return True
+    
+    @staticmethod
+    def _webhooks_allowed(new_config: Dict[str, Any]) -> bool:
+        """Từ chối webhook_urls không qua allow-list (NOTIFY_WEBHOOK_ALLOWED_HOSTS)"""
+        urls = (new_config.get("alert_settings") or {}).get("webhook_urls") or []
+        if not isinstance(urls, list):
+            logger.error("alert_settings.webhook_urls must be a list")
+            return False
+        rejected = [url for url in urls if not webhook_url_allowed(url)]
+        if rejected:
+            logger.error(f"Webhook URLs not allowed (scheme/host): {rejected}")
+            return False
+        return True
+    
+    def _save(self, new_config: Dict[str, Any], snapshot: ThresholdSnapshot) -> bool:
+        """Ghi cấu hình vào collection configs, tăng revision"""
+        try:
+            stored = get_configs_collection().find_one_and_update(
+                {"_id": CONFIG_ID},
+                {
+                    "$set": {"config": new_config, "thresholdVersion": snapshot.version,
+                             "updatedAt": time.time()},
+                    "$inc": {"revision": 1}
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except PyMongoError as e:
+            logger.error(f"Failed to store config: {e}")
+            return False
+        
+        self._revision = stored["revision"]
+        return True
+    
+    def _sync_loop(self):
+        """Thread nền: đọc lại cấu hình đã lưu định kỳ"""
+        while not self._stop_event.wait(settings.CONFIG_SYNC_INTERVAL):
+            self.reload()
+    
+    @staticmethod
+    def _compile_thresholds(thresholds: Dict[str, Any],
+                            previous: Optional[ThresholdSnapshot],
+                            version: Optional[int] = None) -> Optional[ThresholdSnapshot]:
+        """
+        Tạo ThresholdSnapshot từ dict thresholds
+        
+        Args:
+            thresholds: Dict thresholds (đủ 6 key, warning < danger < critical)
+            previous: Snapshot hiện tại (để version luôn tăng)
+            version: Version đã có (cấu hình do process khác lưu), None = tạo mới
+            
+        Returns:
+            Snapshot mới hoặc None nếu không hợp lệ
+        """
+        try:
+            values = {key: float(thresholds[key]) for key in THRESHOLD_KEYS}
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Invalid thresholds: {e}")
+            return None
+        
+        for prefix in ("tilt", "accel"):
+            if not (values[f"{prefix}_warning"] <= values[f"{prefix}_danger"]
+                    <= values[f"{prefix}_critical"]):
+                logger.error(f"Invalid thresholds: {prefix} must be warning <= danger <= critical")
+                return None
+        
+        if version is None:
+            version = int(time.time() * 1000)
+            if previous is not None and version <= previous.version:
+                version = previous.version + 1
+        
+        return ThresholdSnapshot(version=version, **values)
+    
     def get_thresholds(self) -> Dict[str, float]:
         """Lấy tất cả thresholds"""
         return self._config.get("thresholds", {}).copy()
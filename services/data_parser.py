@@ -5,12 +5,57 @@ Chuyển đổi dữ liệu từ ESP32 sang format chuẩn
 
 import json
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Dict, Any, List
+from config.settings import settings
 from models.sensor_data import CoapPayload, SensorData, SensorReading, Location
+from services.binary_codec import (
+    BinaryDecodeError, decode_cbor, decode_struct,
+    CONTENT_FORMAT_JSON, CONTENT_FORMAT_CBOR, CONTENT_FORMAT_OCTET_STREAM
+)
 from utils.logger import setup_logger
 
+# JSON decoder nhanh (optional)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = setup_logger(__name__)
 
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# (key trong CoapPayload, key trong document) - bắt buộc, thứ tự giống SensorData.to_dict()
+_READING_FIELDS = (
+    ("ax", "accel_x"),
+    ("ay", "accel_y"),
+    ("az", "accel_z"),
+    ("gx", "gyro_x"),
+    ("gy", "gyro_y"),
+    ("gz", "gyro_z"),
+)
+# Field optional chỉ validate (to_dict() không lưu magnetometer)
+_OPTIONAL_FIELDS = ("mx", "my", "mz")
+
+
+def _as_float(value: Any) -> float:
+    """Ép kiểu float giống Pydantic lax mode (int, float, bool, chuỗi số)"""
+    if type(value) is float:
+        return value
+    if isinstance(value, (int, str)):
+        return float(value)
+    raise ValueError(f"Invalid number: {value!r}")
+
+
+def _as_int(value: Any) -> int:
+    """Ép kiểu int giống Pydantic lax mode (float phải là số nguyên)"""
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        return int(value)
+    raise ValueError(f"Invalid integer: {value!r}")
+
 
 class DataParser:
     """Parser để chuyển đổi CoAP payload sang SensorData"""
@@ -34,21 +79,275 @@ class DataParser:
             # Parse JSON
             payload_dict = json.loads(payload_str)
             
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON decode error: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Parse error: {e}")
+            return None
+        
+        return DataParser.parse_payload_dict(payload_dict)
+    
+    @staticmethod
+    def parse_payload_dict(payload_dict: Dict[str, Any]) -> Optional[SensorData]:
+        """
+        Validate payload đã decode (JSON/CBOR) bằng Pydantic
+        
+        Args:
+            payload_dict: Payload compact từ ESP32
+            
+        Returns:
+            SensorData object hoặc None nếu không hợp lệ
+        """
+        try:
             # Validate với Pydantic model
             coap_data = CoapPayload(**payload_dict)
             
             # Convert sang SensorData
-            sensor_data = DataParser._convert_to_sensor_data(coap_data)
-            
-            return sensor_data
+            return DataParser._convert_to_sensor_data(coap_data)
             
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {e}")
-            return None
         except Exception as e:
             logger.error(f"Parse error: {e}")
             return None
     
+    @staticmethod
+    def supports_content_format(content_format: Optional[int]) -> bool:
+        """
+        Kiểm tra CoAP Content-Format có được hỗ trợ không
+        
+        Args:
+            content_format: Giá trị option Content-Format (None = không gửi, coi như JSON)
+        """
+        return content_format in (
+            None, CONTENT_FORMAT_JSON, CONTENT_FORMAT_CBOR, CONTENT_FORMAT_OCTET_STREAM
+        )
+    
+    @staticmethod
+    def parse_document(payload: bytes,
+                       strict: Optional[bool] = None,
+                       content_format: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Parse CoAP payload thành document MongoDB
+
+        Args:
+            payload: Raw bytes từ CoAP request
+            strict: True = đi qua Pydantic (CoapPayload -> SensorData),
+                    False = fast path; None = theo settings.PARSER_MODE
+            content_format: CoAP Content-Format (None/50 = JSON, 60 = CBOR,
+                            42 = struct nhị phân v1)
+
+        Returns:
+            Document (giống SensorData.to_dict()) hoặc None nếu payload lỗi
+        """
+        if strict is None:
+            strict = settings.PARSER_MODE == "strict"
+
+        try:
+            if content_format == CONTENT_FORMAT_OCTET_STREAM:
+                # Layout cố định, không cần validate từng field
+                return decode_struct(payload)
+
+            if content_format == CONTENT_FORMAT_CBOR:
+                payload_dict = decode_cbor(payload)
+            elif strict:
+                sensor_data = DataParser.parse_coap_payload(payload)
+                return sensor_data.to_dict() if sensor_data is not None else None
+            else:
+                payload_dict = _json_loads(payload)
+
+        except BinaryDecodeError as e:
+            logger.error(f"Binary decode error: {e}")
+            return None
+        except ValueError as e:
+            # json.JSONDecodeError và orjson.JSONDecodeError đều là ValueError
+            logger.error(f"JSON decode error: {e}")
+            return None
+
+        if strict:
+            sensor_data = DataParser.parse_payload_dict(payload_dict)
+            return sensor_data.to_dict() if sensor_data is not None else None
+
+        return DataParser.document_from_dict(payload_dict)
+
+    @staticmethod
+    def document_from_dict(payload_dict: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Validate payload compact (id, ts, ax..mz, tilt, lat, lon) trong một lượt
+        và tạo document MongoDB trực tiếp, không qua model Pydantic
+
+        Args:
+            payload_dict: Payload đã decode (JSON/CBOR)
+
+        Returns:
+            Document hoặc None nếu thiếu field / sai kiểu
+        """
+        try:
+            device_id = payload_dict["id"]
+            if not isinstance(device_id, str):
+                raise ValueError(f"Invalid device id: {device_id!r}")
+
+            data = {}
+            for key, field in _READING_FIELDS:
+                data[field] = _as_float(payload_dict[key])
+            for key in _OPTIONAL_FIELDS:
+                if key in payload_dict:
+                    _as_float(payload_dict[key])
+            tilt = payload_dict.get("tilt", 0.0)
+            data["tilt_angle"] = _as_float(tilt)
+
+            ts = payload_dict.get("ts")
+            if ts is not None:
+                ts = _as_int(ts)
+            if ts:
+                # Convert milliseconds sang datetime UTC (cùng đồng hồ với utcnow() ở mọi nơi)
+                timestamp = datetime.utcfromtimestamp(ts / 1000.0)
+            else:
+                timestamp = datetime.utcnow()
+
+            lat = payload_dict.get("lat")
+            lon = payload_dict.get("lon")
+            location = None
+            if lat is not None:
+                lat = _as_float(lat)
+            if lon is not None:
+                lon = _as_float(lon)
+            if lat is not None and lon is not None:
+                location = {"lat": lat, "lon": lon}
+
+            return {
+                "deviceId": device_id,
+                "timestamp": timestamp,
+                "data": data,
+                "severity": "normal",  # Sẽ được tính sau bởi SeverityAnalyzer
+                "location": location
+            }
+
+        except KeyError as e:
+            logger.error(f"Parse error: missing field {e}")
+            return None
+        except (TypeError, ValueError, OverflowError, OSError) as e:
+            logger.error(f"Parse error: {e}")
+            return None
+
+    @staticmethod
+    def parse_batch_documents(payload: bytes,
+                              strict: Optional[bool] = None,
+                              content_format: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Parse payload batch (nhiều sample của một thiết bị) thành list document
+
+        Hai dạng (JSON hoặc CBOR):
+        - {"id", "lat"?, "lon"?, "samples": [{"ts", "ax", ...}, ...]}
+        - {"id", "t0", "dt", "fields": ["ax", ...], "rows": [[...], ...]}
+          row đầu là giá trị tuyệt đối, các row sau là delta so với row trước,
+          timestamp của row i = t0 + i * dt (ms)
+
+        Args:
+            payload: Raw bytes từ CoAP request
+            strict: True = validate từng sample bằng Pydantic; None = theo settings.PARSER_MODE
+            content_format: None/50 = JSON, 60 = CBOR
+
+        Returns:
+            List document hoặc None nếu batch lỗi (một sample lỗi => bỏ cả batch)
+        """
+        if strict is None:
+            strict = settings.PARSER_MODE == "strict"
+
+        try:
+            if content_format == CONTENT_FORMAT_CBOR:
+                batch = decode_cbor(payload)
+            elif content_format in (None, CONTENT_FORMAT_JSON):
+                batch = _json_loads(payload)
+            else:
+                logger.error(f"Unsupported batch Content-Format {content_format}")
+                return None
+        except BinaryDecodeError as e:
+            logger.error(f"Binary decode error: {e}")
+            return None
+        except ValueError as e:
+            logger.error(f"JSON decode error: {e}")
+            return None
+
+        samples = DataParser._expand_batch(batch)
+        if samples is None:
+            return None
+
+        documents = []
+        for sample in samples:
+            if strict:
+                sensor_data = DataParser.parse_payload_dict(sample)
+                document = sensor_data.to_dict() if sensor_data is not None else None
+            else:
+                document = DataParser.document_from_dict(sample)
+
+            if document is None:
+                return None
+            documents.append(document)
+
+        return documents
+
+    @staticmethod
+    def _expand_batch(batch: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Đổi batch về list payload compact (cùng format với payload đơn)
+
+        Returns:
+            List payload hoặc None nếu batch sai cấu trúc
+        """
+        try:
+            device_id = batch["id"]
+            common = {key: batch[key] for key in ("lat", "lon") if key in batch}
+
+            if "samples" in batch:
+                samples = batch["samples"]
+                if not isinstance(samples, list):
+                    raise ValueError("'samples' must be an array")
+
+                expanded = []
+                for sample in samples:
+                    merged = {**common, **sample}
+                    merged["id"] = device_id
+                    expanded.append(merged)
+
+            elif "rows" in batch:
+                fields = batch["fields"]
+                t0 = _as_int(batch["t0"])
+                dt = _as_int(batch.get("dt", 0))
+
+                expanded = []
+                current = None
+                for index, row in enumerate(batch["rows"]):
+                    if len(row) != len(fields):
+                        raise ValueError(f"Row {index} has {len(row)} values, expected {len(fields)}")
+
+                    if current is None:
+                        current = [_as_float(value) for value in row]
+                    else:
+                        current = [base + _as_float(delta) for base, delta in zip(current, row)]
+
+                    sample = dict(zip(fields, current))
+                    sample.update(common)
+                    sample["id"] = device_id
+                    sample["ts"] = t0 + index * dt
+                    expanded.append(sample)
+
+            else:
+                raise ValueError("Batch needs 'samples' or 'rows'")
+
+            if not expanded:
+                raise ValueError("Empty batch")
+            if len(expanded) > settings.MAX_BATCH_SAMPLES:
+                raise ValueError(f"Batch too large ({len(expanded)} > {settings.MAX_BATCH_SAMPLES})")
+
+            return expanded
+
+        except KeyError as e:
+            logger.error(f"Batch parse error: missing field {e}")
+            return None
+        except (TypeError, ValueError) as e:
+            logger.error(f"Batch parse error: {e}")
+            return None
+
     @staticmethod
     def _convert_to_sensor_data(coap_data: CoapPayload) -> SensorData:
         """
@@ -85,8 +384,8 @@ class DataParser:
         
         # Tạo timestamp
         if coap_data.ts:
-            # Convert milliseconds sang datetime
-            timestamp = datetime.fromtimestamp(coap_data.ts / 1000.0)
+            # Convert milliseconds sang datetime UTC (cùng đồng hồ với utcnow() ở mọi nơi)
+            timestamp = datetime.utcfromtimestamp(coap_data.ts / 1000.0)
         else:
             timestamp = datetime.utcnow()
         
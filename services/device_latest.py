@@ -0,0 +1,142 @@
+"""
+Collection device_latest: record mới nhất của từng thiết bị
+Được upsert khi ingest, dùng chung cho mọi process (HTTP, nhiều CoAP worker)
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from pymongo import UpdateOne, DESCENDING
+from pymongo.errors import BulkWriteError, PyMongoError
+from config.settings import settings
+from database.mongodb import get_sensor_collection, get_device_latest_collection
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Upsert bị chặn bởi điều kiện timestamp => insert trùng _id, bỏ qua
+DUPLICATE_KEY = 11000
+
+
+class DeviceLatestStore:
+    """
+    Mỗi thiết bị một document: {"_id": deviceId, "timestamp": ..., "record": <document sensor_data>}
+
+    Upsert có điều kiện {"timestamp": {"$lt": ts}}: packet đến trễ (timestamp cũ hơn)
+    không khớp filter, upsert thử insert trùng _id và bị từ chối => không ghi đè dữ liệu mới hơn.
+    """
+
+    @property
+    def enabled(self) -> bool:
+        """True nếu LATEST_STATE_BACKEND = "collection" """
+        return settings.LATEST_STATE_BACKEND == "collection"
+
+    def initialize(self):
+        """Tạo device_latest từ sensor_data nếu collection còn trống (lần đầu bật backend)"""
+        try:
+            if get_device_latest_collection().estimated_document_count() == 0:
+                count = self.rebuild()
+                logger.info(f"[DeviceLatest] Initialized with {count} devices")
+        except PyMongoError as e:
+            logger.error(f"[DeviceLatest] Initialization failed: {e}")
+
+    def upsert(self, documents: List[Dict[str, Any]]) -> int:
+        """
+        Cập nhật device_latest với các document vừa lưu (gọi từ writer thread)
+
+        Returns:
+            Số thiết bị đã cập nhật
+        """
+        operations = self._operations(documents)
+        if not operations:
+            return 0
+
+        try:
+            result = get_device_latest_collection().bulk_write(operations, ordered=False)
+            return result.upserted_count + result.modified_count
+        except BulkWriteError as e:
+            return self._handle_bulk_error(e, len(operations))
+        except PyMongoError as e:
+            logger.error(f"[DeviceLatest] Upsert failed: {e}")
+            return 0
+
+    def rebuild(self, device_id: Optional[str] = None) -> int:
+        """
+        Tính lại device_latest từ sensor_data (sau khi xóa hoặc reclassify record)
+
+        Args:
+            device_id: Chỉ tính lại một thiết bị (None = tất cả)
+
+        Returns:
+            Số thiết bị còn dữ liệu
+        """
+        sensor = get_sensor_collection()
+        latest = get_device_latest_collection()
+
+        if device_id is not None:
+            device_ids = {device_id}
+        else:
+            device_ids = set(sensor.distinct("deviceId")) | set(latest.distinct("_id"))
+
+        count = 0
+        for current_id in device_ids:
+            record = sensor.find_one({"deviceId": current_id}, sort=[("timestamp", DESCENDING)])
+            if record is None:
+                latest.delete_one({"_id": current_id})
+                continue
+
+            latest.replace_one(
+                {"_id": current_id},
+                {"timestamp": record["timestamp"], "record": record},
+                upsert=True
+            )
+            count += 1
+
+        return count
+
+    def get_all(self) -> List[Dict[str, Any]]:
+        """Record mới nhất của tất cả thiết bị"""
+        return [
+            latest["record"]
+            for latest in get_device_latest_collection().find({}, {"record": 1})
+        ]
+
+    def count_devices(self, since: Optional[datetime] = None) -> int:
+        """
+        Đếm thiết bị (có dữ liệu từ since trở đi nếu truyền since)
+
+        Args:
+            since: Mốc thời gian (None = tất cả thiết bị)
+        """
+        query = {"timestamp": {"$gte": since}} if since is not None else {}
+        return get_device_latest_collection().count_documents(query)
+
+    @staticmethod
+    def _operations(documents: List[Dict[str, Any]]) -> List[UpdateOne]:
+        """Một UpdateOne cho document mới nhất của mỗi thiết bị trong batch"""
+        newest: Dict[str, Dict[str, Any]] = {}
+        for document in documents:
+            current = newest.get(document["deviceId"])
+            if current is None or document["timestamp"] >= current["timestamp"]:
+                newest[document["deviceId"]] = document
+
+        return [
+            UpdateOne(
+                {"_id": device_id, "timestamp": {"$lt": document["timestamp"]}},
+                {"$set": {"timestamp": document["timestamp"], "record": document}},
+                upsert=True
+            )
+            for device_id, document in newest.items()
+        ]
+
+    @staticmethod
+    def _handle_bulk_error(error: BulkWriteError, total: int) -> int:
+        """Bỏ qua lỗi trùng key (packet cũ hơn), log các lỗi còn lại"""
+        details = error.details
+        errors = [e for e in details.get("writeErrors", []) if e.get("code") != DUPLICATE_KEY]
+        if errors:
+            logger.error(f"[DeviceLatest] {len(errors)}/{total} upserts failed: {errors[0].get('errmsg')}")
+        return details.get("nUpserted", 0) + details.get("nModified", 0)
+
+
+# Singleton instance
+device_latest_store = DeviceLatestStore()
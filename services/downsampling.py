@@ -0,0 +1,198 @@
+"""
+Downsampling cho biểu đồ history
+- "avg": $group theo bucket thời gian cố định ngay trong MongoDB (mean/min/max mỗi bucket)
+- "lttb": Largest-Triangle-Three-Buckets bằng NumPy, giữ hình dạng/đỉnh của series
+"""
+
+import math
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+from services.severity_analyzer import SEVERITY_LEVELS
+
+# Field trong document["data"] có thể chọn qua tham số fields
+DATA_FIELDS = ("accel_x", "accel_y", "accel_z", "gyro_x", "gyro_y", "gyro_z", "tilt_angle")
+DEFAULT_FIELDS = ("tilt_angle", "accel_x", "accel_y", "accel_z")
+
+DOWNSAMPLE_METHODS = ("avg", "lttb")
+
+_DURATION = re.compile(r"^(\d+)([mhd])$")
+_DURATION_UNITS = {"m": "minutes", "h": "hours", "d": "days"}
+
+
+def parse_duration(value: str) -> timedelta:
+    """
+    Đọc khoảng thời gian dạng "30m", "24h", "7d" (vd: display_settings.default_chart_range)
+
+    Raises:
+        ValueError: Sai định dạng
+    """
+    match = _DURATION.match(str(value).strip())
+    if not match:
+        raise ValueError(f"Invalid duration {value!r}")
+    return timedelta(**{_DURATION_UNITS[match.group(2)]: int(match.group(1))})
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """
+    Đọc tham số fields ("tilt_angle,accel_x")
+
+    Returns:
+        List field hoặc None nếu không truyền (lấy toàn bộ)
+
+    Raises:
+        ValueError: Có field không hợp lệ
+    """
+    if not fields:
+        return None
+
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in DATA_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+
+def projection(fields: Optional[Sequence[str]]) -> Optional[Dict[str, int]]:
+    """Projection MongoDB chỉ gồm các field cần (None = toàn bộ document)"""
+    if fields is None:
+        return None
+
+    result = {"deviceId": 1, "timestamp": 1, "severity": 1}
+    for field in fields:
+        result[f"data.{field}"] = 1
+    return result
+
+
+def bucket_milliseconds(start: datetime, end: datetime, max_points: int) -> int:
+    """Độ rộng bucket (ms) để [start, end] có tối đa max_points bucket"""
+    span = (end - start).total_seconds() * 1000
+    return max(1, math.ceil(span / max_points))
+
+
+def bucket_pipeline(query: Dict[str, Any], start: datetime, bucket_ms: int,
+                    fields: Sequence[str]) -> List[Dict[str, Any]]:
+    """
+    Pipeline $group theo bucket thời gian cố định (bắt đầu từ start)
+
+    Args:
+        query: $match (deviceId + khoảng thời gian)
+        start: Mốc bắt đầu của bucket đầu tiên
+        bucket_ms: Độ rộng bucket (ms)
+        fields: Field trong data cần tính mean/min/max
+
+    Returns:
+        Pipeline aggregate, mỗi output là một bucket tăng dần theo thời gian
+    """
+    group: Dict[str, Any] = {
+        # start + floor((timestamp - start) / bucket) * bucket
+        "_id": {"$add": [start, {"$multiply": [
+            {"$floor": {"$divide": [{"$subtract": ["$timestamp", start]}, bucket_ms]}},
+            bucket_ms
+        ]}]},
+        "count": {"$sum": 1},
+        "severityCode": {"$max": {"$indexOfArray": [list(SEVERITY_LEVELS), "$severity"]}}
+    }
+    for field in fields:
+        group[f"avg_{field}"] = {"$avg": f"$data.{field}"}
+        group[f"min_{field}"] = {"$min": f"$data.{field}"}
+        group[f"max_{field}"] = {"$max": f"$data.{field}"}
+
+    return [
+        {"$match": query},
+        {"$group": group},
+        {"$sort": {"_id": 1}}
+    ]
+
+
+def format_buckets(buckets: List[Dict[str, Any]], fields: Sequence[str]) -> List[Dict[str, Any]]:
+    """Đổi output của bucket_pipeline sang dạng điểm biểu đồ"""
+    points = []
+    for bucket in buckets:
+        code = bucket.get("severityCode", -1)
+        points.append({
+            "timestamp": bucket["_id"],
+            "count": bucket["count"],
+            "severity": SEVERITY_LEVELS[code] if code is not None and code >= 0 else None,
+            "data": {field: bucket.get(f"avg_{field}") for field in fields},
+            "min": {field: bucket.get(f"min_{field}") for field in fields},
+            "max": {field: bucket.get(f"max_{field}") for field in fields}
+        })
+    return points
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: chọn threshold điểm giữ hình dạng series
+
+    Điểm đầu/cuối luôn được giữ; mỗi bucket ở giữa chọn điểm tạo tam giác lớn nhất
+    với điểm đã chọn ở bucket trước và trung bình của bucket sau.
+
+    Args:
+        x: Trục thời gian (tăng dần)
+        y: Giá trị
+        threshold: Số điểm cần giữ
+
+    Returns:
+        Index các điểm được chọn (tăng dần)
+    """
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+
+    # Biên của threshold - 2 bucket giữa (bỏ điểm đầu và cuối)
+    edges = np.floor(np.linspace(1, count - 1, threshold - 1)).astype(np.int64)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = count - 1
+
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Trung bình bucket kế tiếp (bucket cuối dùng điểm cuối)
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+
+        px, py = x[previous], y[previous]
+        areas = np.abs(
+            (px - avg_x) * (y[start:end] - py) - (px - x[start:end]) * (avg_y - py)
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+
+    return selected
+
+
+def lttb_documents(documents: List[Dict[str, Any]], max_points: int,
+                   field: str) -> List[Dict[str, Any]]:
+    """
+    Chọn max_points document theo LTTB trên một field
+
+    Args:
+        documents: Document tăng dần theo timestamp
+        max_points: Số điểm tối đa
+        field: Field trong data dùng để tính diện tích tam giác
+
+    Returns:
+        Document được chọn (tăng dần theo thời gian)
+    """
+    count = len(documents)
+    if count <= max_points:
+        return documents
+
+    x = np.fromiter((document["timestamp"].timestamp() for document in documents),
+                    np.float64, count)
+    y = np.fromiter(((document.get("data") or {}).get(field, np.nan) for document in documents),
+                    np.float64, count)
+
+    return [documents[index] for index in lttb_indices(x, y, max_points).tolist()]
@@ -0,0 +1,153 @@
+"""
+Pub/sub trong process cho push real-time (Server-Sent Events)
+CoAP ingest publish document vừa nhận, mỗi client SSE có queue riêng có giới hạn
+"""
+
+import queue
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+from config.settings import settings
+from utils.logger import setup_logger
+from utils.serialization import dumps
+
+logger = setup_logger(__name__)
+
+# Loại event: mọi record và record có severity danger/critical
+EVENT_TYPES = ("reading", "alert")
+ALERT_SEVERITIES = ("danger", "critical")
+
+
+class Subscription:
+    """
+    Một client đang nghe
+
+    Event được đẩy vào queue (không block ingest); queue đầy nghĩa là client đọc
+    chậm hơn tốc độ ingest, subscription bị đóng và client phải kết nối lại.
+    """
+
+    def __init__(self, device_ids: Optional[Set[str]], event_types: Set[str], maxsize: int):
+        self.device_ids = device_ids
+        self.event_types = event_types
+        self.dropped = False
+        self._queue: "queue.Queue[bytes]" = queue.Queue(maxsize=maxsize)
+
+    def wants(self, event_type: str, device_id: str) -> bool:
+        """True nếu client đăng ký loại event và thiết bị này"""
+        return (event_type in self.event_types
+                and (self.device_ids is None or device_id in self.device_ids))
+
+    def offer(self, message: bytes) -> bool:
+        """
+        Đưa event vào queue
+
+        Returns:
+            False nếu queue đầy (client chậm)
+        """
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except queue.Full:
+            return False
+
+    def get(self, timeout: float) -> Optional[bytes]:
+        """Event kế tiếp, None nếu hết timeout"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBus:
+    """
+    Phát event từ ingest tới các subscription
+
+    - publish_documents() được gọi sau khi batch đã ghi vào MongoDB, từ writer thread của
+      write buffer, executor của async ingest hoặc thread change stream: an toàn đa luồng
+      (queue của client là queue.Queue, list subscription copy-on-write);
+      không có client thì return ngay, mỗi document chỉ serialize một lần dù có nhiều client
+    - Client chậm (queue đầy) bị loại khỏi bus thay vì làm chậm ingest
+    - Chỉ thấy document ingest trong cùng process
+    """
+
+    def __init__(self, queue_size: Optional[int] = None, max_clients: Optional[int] = None):
+        self.queue_size = queue_size or settings.SSE_QUEUE_SIZE
+        self.max_clients = max_clients or settings.SSE_MAX_CLIENTS
+
+        self._lock = threading.Lock()
+        self._subscriptions: List[Subscription] = []
+        self._stats = {"published": 0, "dropped_clients": 0}
+
+    def subscribe(self, device_ids: Optional[Iterable[str]] = None,
+                  event_types: Optional[Iterable[str]] = None) -> Optional[Subscription]:
+        """
+        Đăng ký client mới
+
+        Args:
+            device_ids: Chỉ nhận event của các thiết bị này (None = tất cả)
+            event_types: Loại event (None = tất cả EVENT_TYPES)
+
+        Returns:
+            Subscription, hoặc None nếu đã đủ SSE_MAX_CLIENTS
+        """
+        subscription = Subscription(
+            set(device_ids) if device_ids else None,
+            set(event_types) if event_types else set(EVENT_TYPES),
+            self.queue_size
+        )
+        with self._lock:
+            if len(self._subscriptions) >= self.max_clients:
+                return None
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Hủy đăng ký (client ngắt kết nối)"""
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+
+    def publish_documents(self, documents: Sequence[Dict[str, Any]]):
+        """
+        Phát event cho các document vừa ingest
+
+        Args:
+            documents: Document đã có severity và _id
+        """
+        # Copy-on-write: đọc list không cần lock
+        subscriptions = self._subscriptions
+        if not subscriptions:
+            return
+
+        slow = []
+        published = 0
+        for document in documents:
+            device_id = document["deviceId"]
+            event_types = ["reading"]
+            if document.get("severity") in ALERT_SEVERITIES:
+                event_types.append("alert")
+
+            for event_type in event_types:
+                targets = [s for s in subscriptions if s.wants(event_type, device_id)]
+                if not targets:
+                    continue
+
+                message = b"event: " + event_type.encode() + b"\ndata: " + dumps(document) + b"\n\n"
+                for subscription in targets:
+                    if not subscription.dropped and not subscription.offer(message):
+                        subscription.dropped = True
+                        slow.append(subscription)
+                published += 1
+
+        with self._lock:
+            self._stats["published"] += published
+            self._stats["dropped_clients"] += len(slow)
+        for subscription in slow:
+            self.unsubscribe(subscription)
+            logger.warning("[EventBus] Dropped slow client (queue full)")
+
+    def get_stats(self) -> Dict[str, int]:
+        """Số client đang nghe và số event đã phát"""
+        return {"clients": len(self._subscriptions), **self._stats}
+
+
+# Singleton instance
+event_bus = EventBus()
@@ -0,0 +1,136 @@
+"""
+Export lịch sử cảm biến dạng streaming (NDJSON / CSV, tùy chọn gzip)
+Đọc cursor theo từng batch và yield từng chunk, bộ nhớ không phụ thuộc số record
+"""
+
+import csv
+import io
+import zlib
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence
+from pymongo.errors import PyMongoError
+from config.settings import settings
+from services.downsampling import DATA_FIELDS
+from utils.logger import setup_logger
+from utils.serialization import dumps
+
+logger = setup_logger(__name__)
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+# Gom dòng tới ~64KB rồi mới yield (tránh một chunk HTTP cho mỗi record)
+_CHUNK_SIZE = 64 * 1024
+
+# Cột CSV cố định, trước các field trong data
+_CSV_COLUMNS = ("deviceId", "timestamp", "severity", "thresholdVersion")
+
+
+def _ndjson_lines(documents: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """Mỗi document một dòng JSON (cùng encoder với các API khác)"""
+    for document in documents:
+        yield dumps(document).decode("utf-8") + "\n"
+
+
+def _csv_lines(documents: Iterable[Dict[str, Any]], fields: Sequence[str]) -> Iterator[str]:
+    """Header rồi mỗi document một dòng CSV"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(list(_CSV_COLUMNS) + list(fields))
+    for document in documents:
+        data = document.get("data") or {}
+        timestamp = document.get("timestamp")
+        writer.writerow(
+            [
+                document.get("deviceId"),
+                timestamp.isoformat() if timestamp else "",
+                document.get("severity"),
+                document.get("thresholdVersion")
+            ]
+            + [data.get(field) for field in fields]
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _chunks(lines: Iterable[str], compress: bool) -> Iterator[bytes]:
+    """Gom các dòng thành chunk ~_CHUNK_SIZE byte, nén gzip nếu cần"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending = []
+    size = 0
+
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size < _CHUNK_SIZE:
+            continue
+
+        chunk = "".join(pending).encode("utf-8")
+        pending, size = [], 0
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+            if not chunk:
+                continue
+        yield chunk
+
+    chunk = "".join(pending).encode("utf-8")
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def stream_export(collection, query: Dict[str, Any], export_format: str,
+                  fields: Optional[Sequence[str]] = None,
+                  compress: bool = False) -> Iterator[bytes]:
+    """
+    Generator các chunk của file export
+
+    Args:
+        collection: Collection sensor_data
+        query: Filter (deviceId, khoảng thời gian)
+        export_format: "ndjson" hoặc "csv"
+        fields: Field trong data (None = toàn bộ)
+        compress: Nén gzip
+
+    Returns:
+        Iterator bytes cho streaming response
+    """
+    projection = {"_id": 0}
+    if fields is not None:
+        projection.update({"deviceId": 1, "timestamp": 1, "severity": 1, "thresholdVersion": 1})
+        projection.update({f"data.{field}": 1 for field in fields})
+
+    # Tăng dần theo thời gian, đi trên index (deviceId, timestamp)
+    cursor = (
+        collection
+        .find(query, projection)
+        .sort("timestamp", 1)
+        .batch_size(settings.EXPORT_BATCH_SIZE)
+    )
+
+    if export_format == "csv":
+        lines = _csv_lines(cursor, fields or DATA_FIELDS)
+    else:
+        lines = _ndjson_lines(cursor)
+
+    count = 0
+
+    def counted(source: Iterable[str]) -> Iterator[str]:
+        nonlocal count
+        for line in source:
+            count += 1
+            yield line
+
+    try:
+        yield from _chunks(counted(lines), compress)
+        logger.info(f"Exported {count} lines ({export_format}{', gzip' if compress else ''})")
+    except PyMongoError as e:
+        # Header đã gửi, chỉ có thể cắt response; client nhận file thiếu
+        logger.error(f"Export aborted after {count} lines: {e}")
+        raise
+    finally:
+        cursor.close()
@@ -0,0 +1,167 @@
+"""
+Cache trạng thái mới nhất của từng thiết bị (in-process)
+Phục vụ /api/devices/latest trong O(số thiết bị), không cần aggregate trên MongoDB
+"""
+
+import threading
+from typing import Any, Dict, List, Optional
+from pymongo import DESCENDING
+from pymongo.errors import PyMongoError
+from config.settings import settings
+from database.mongodb import get_sensor_collection
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class LatestStateCache:
+    """
+    Lưu document mới nhất theo deviceId
+
+    - Ingest path gọi update_many() sau khi document đã ghi vào MongoDB (hook của write buffer)
+    - attach() warm cache từ MongoDB (1 query dùng index deviceId+timestamp cho mỗi thiết bị)
+      và đánh dấu cache là authoritative
+    - Cache chỉ authoritative trong process chạy CoAP server; process khác (HTTP tách riêng,
+      nhiều CoAP worker) phải đọc MongoDB qua query_latest()
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest: Dict[str, Dict[str, Any]] = {}
+        self._authoritative = False
+
+    @property
+    def authoritative(self) -> bool:
+        """True nếu mọi document ingest đều đi qua cache này"""
+        return self._authoritative and settings.LATEST_CACHE_ENABLED
+
+    def attach(self) -> bool:
+        """
+        Warm cache và bật chế độ authoritative (gọi khi CoAP server khởi động trong process này)
+
+        Returns:
+            False nếu không warm được (API sẽ fallback về MongoDB)
+        """
+        if not settings.LATEST_CACHE_ENABLED or settings.LATEST_STATE_BACKEND != "memory":
+            return False
+
+        try:
+            count = self.warm()
+        except PyMongoError as e:
+            logger.error(f"[LatestCache] Warm-up failed, falling back to MongoDB: {e}")
+            return False
+
+        self._authoritative = True
+        logger.info(f"[LatestCache] Warmed with {count} devices")
+        return True
+
+    def detach(self):
+        """Tắt chế độ authoritative (CoAP server dừng)"""
+        self._authoritative = False
+
+    def warm(self) -> int:
+        """
+        Nạp lại toàn bộ cache từ MongoDB
+
+        Returns:
+            Số thiết bị
+        """
+        latest = {document["deviceId"]: document for document in self.query_latest()}
+        with self._lock:
+            for device_id, document in latest.items():
+                self._store(device_id, document)
+        return len(latest)
+
+    def refresh(self, device_id: Optional[str] = None):
+        """
+        Đọc lại từ MongoDB sau khi dữ liệu đã lưu bị sửa/xóa (delete, reclassify)
+
+        Args:
+            device_id: Chỉ refresh một thiết bị (None = tất cả)
+        """
+        if not self.authoritative:
+            return
+
+        try:
+            if device_id is None:
+                documents = self.query_latest()
+                with self._lock:
+                    self._latest = {document["deviceId"]: document for document in documents}
+                return
+
+            document = self._find_latest(get_sensor_collection(), device_id)
+            with self._lock:
+                if document is None:
+                    self._latest.pop(device_id, None)
+                else:
+                    self._latest[device_id] = document
+
+        except PyMongoError as e:
+            # Không đảm bảo nhất quán được nữa => fallback về MongoDB
+            logger.error(f"[LatestCache] Refresh failed, disabling cache: {e}")
+            self._authoritative = False
+
+    def update(self, document: Dict[str, Any]):
+        """
+        Cập nhật cache với document vừa ingest
+
+        Args:
+            document: Document MongoDB (đã có _id và severity)
+        """
+        with self._lock:
+            self._store(document["deviceId"], document)
+
+    def update_many(self, documents: List[Dict[str, Any]]):
+        """Cập nhật cache với một batch document"""
+        with self._lock:
+            for document in documents:
+                self._store(document["deviceId"], document)
+
+    def get_all(self) -> List[Dict[str, Any]]:
+        """Lấy document mới nhất của tất cả thiết bị"""
+        with self._lock:
+            return list(self._latest.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê cache"""
+        return {
+            "authoritative": self.authoritative,
+            "devices": len(self._latest)
+        }
+
+    def _store(self, device_id: str, document: Dict[str, Any]):
+        """Chỉ ghi đè khi document mới hơn (gọi khi đang giữ lock)"""
+        current = self._latest.get(device_id)
+        if current is None or document["timestamp"] >= current["timestamp"]:
+            self._latest[device_id] = document
+
+    @classmethod
+    def query_latest(cls, collection=None) -> List[Dict[str, Any]]:
+        """
+        Lấy document mới nhất của từng thiết bị trực tiếp từ MongoDB
+
+        Mỗi thiết bị là một find_one dùng index (deviceId, timestamp), chi phí không
+        tăng theo tổng số record như $sort + $group trên cả collection.
+
+        Returns:
+            List document
+        """
+        collection = collection if collection is not None else get_sensor_collection()
+        results = []
+        for device_id in collection.distinct("deviceId"):
+            document = cls._find_latest(collection, device_id)
+            if document is not None:
+                results.append(document)
+        return results
+
+    @staticmethod
+    def _find_latest(collection, device_id: str) -> Optional[Dict[str, Any]]:
+        """Document mới nhất của một thiết bị"""
+        return collection.find_one(
+            {"deviceId": device_id},
+            sort=[("timestamp", DESCENDING)]
+        )
+
+
+# Singleton instance
+latest_cache = LatestStateCache()
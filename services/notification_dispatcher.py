@@ -0,0 +1,325 @@
+"""
+Gửi thông báo cảnh báo bất đồng bộ
+Alert engine đẩy chuyển trạng thái vào queue; event loop riêng gom batch, giới hạn tốc độ
+theo channel, retry với exponential backoff và lưu thông báo gửi thất bại vào dead-letter store
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Set
+from pymongo.errors import PyMongoError
+from config.settings import settings
+from database.mongodb import get_notification_dlq_collection
+from services.alert_engine import alert_engine
+from services.config_manager import config_manager
+from services.notification_senders import Notification, NotificationSender, default_senders
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_STOP = object()
+
+# Thời gian tối đa chờ các lần gửi/retry còn dở khi dừng (giây)
+_STOP_TIMEOUT = 10.0
+
+
+class _RateLimiter:
+    """Token bucket: trung bình rate lần gửi/giây, tối đa burst lần liên tiếp"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        """Chờ tới khi được gửi (rate <= 0: không giới hạn)"""
+        if self.rate <= 0:
+            return
+
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class NotificationDispatcher:
+    """
+    Thread riêng chạy event loop gửi thông báo, tách hoàn toàn khỏi ingest
+
+    - notify() (listener của alert engine) chỉ append vào deque và đánh thức event loop
+      nhiều nhất một lần cho tới khi loop lấy hết; deque (NOTIFY_INBOX_SIZE) và queue mỗi
+      channel đều có giới hạn, đầy thì bỏ và tăng "dropped"
+    - Mỗi channel một worker task: gom thông báo trong NOTIFY_BATCH_WINDOW giây
+      (tối đa NOTIFY_BATCH_SIZE) thành một tin cho mỗi người nhận
+    - Giới hạn NOTIFY_RATE_LIMIT lần gửi/giây mỗi channel (token bucket)
+    - Lỗi: retry sau base * 2^n giây (có jitter, tối đa NOTIFY_RETRY_MAX);
+      hết NOTIFY_MAX_ATTEMPTS lần thì ghi vào collection notification_dlq
+    - Sender là code blocking (smtplib, urllib), chạy trong thread pool NOTIFY_WORKERS
+    """
+
+    def __init__(self, queue_size: Optional[int] = None,
+                 batch_size: Optional[int] = None,
+                 batch_window: Optional[float] = None,
+                 max_attempts: Optional[int] = None,
+                 inbox_size: Optional[int] = None):
+        self.queue_size = queue_size or settings.NOTIFY_QUEUE_SIZE
+        self.inbox_size = inbox_size or settings.NOTIFY_INBOX_SIZE
+        self.batch_size = batch_size or settings.NOTIFY_BATCH_SIZE
+        self.batch_window = batch_window if batch_window is not None else settings.NOTIFY_BATCH_WINDOW
+        self.max_attempts = max_attempts or settings.NOTIFY_MAX_ATTEMPTS
+
+        self._senders: Dict[str, NotificationSender] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._inbox: "deque[Notification]" = deque()
+        self._wakeup_pending = False
+        self._deliveries: Set[asyncio.Task] = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats = {"queued": 0, "dropped": 0, "sent": 0, "retried": 0, "dead": 0}
+
+    @property
+    def enabled(self) -> bool:
+        """True nếu NOTIFY_ENABLED"""
+        return settings.NOTIFY_ENABLED
+
+    @property
+    def running(self) -> bool:
+        """True nếu event loop đang chạy"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def register(self, sender: NotificationSender):
+        """
+        Thêm/thay sender cho một channel (gọi trước start())
+
+        Args:
+            sender: Sender, channel trùng thì thay sender cũ
+        """
+        self._senders[sender.channel] = sender
+
+    def start(self):
+        """Khởi động event loop (trong process chạy alert engine)"""
+        if self.running:
+            return
+
+        if not self._senders:
+            for sender in default_senders():
+                self.register(sender)
+
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name="notify", daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout=5)
+        logger.info(f"[Notify] Started (channels: {', '.join(self._senders)})")
+
+    def stop(self):
+        """Gửi nốt các batch đang gom, chờ retry còn dở tối đa _STOP_TIMEOUT giây rồi dừng"""
+        if not self.running or self._loop is None:
+            return
+
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        self._thread.join(timeout=_STOP_TIMEOUT + 5)
+        self._thread = None
+        logger.info(f"[Notify] Stopped (sent={self._stats['sent']}, dead={self._stats['dead']})")
+
+    def notify(self, event: str, alert: Dict[str, Any]):
+        """
+        Listener của alert engine: xếp thông báo cho các channel đang bật (không block)
+
+        Args:
+            event: opened / escalated / closed
+            alert: Bản copy của alert
+        """
+        loop = self._loop
+        if loop is None:
+            return
+
+        if len(self._inbox) >= self.inbox_size:
+            # Event loop không theo kịp (sender block hết thread pool): bỏ thay vì giữ vô hạn
+            self._drop("inbox")
+            return
+
+        self._inbox.append(Notification(event, alert, datetime.utcnow()))
+        if not self._wakeup_pending:
+            # Mỗi lần đánh thức là một syscall: storm nhiều transition chỉ tốn một lần
+            self._wakeup_pending = True
+            try:
+                loop.call_soon_threadsafe(self._drain_inbox)
+            except RuntimeError:
+                # Event loop vừa đóng
+                pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Số thông báo theo trạng thái và số đang chờ mỗi channel"""
+        return {
+            "running": self.running,
+            "pending": {channel: queue.qsize() for channel, queue in self._queues.items()},
+            "inFlight": len(self._deliveries),
+            **self._stats
+        }
+
+    def _run(self):
+        """Thread nền: chạy event loop tới khi stop()"""
+        try:
+            asyncio.run(self._main())
+        finally:
+            self._loop = None
+            self._ready.set()
+
+    async def _main(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.NOTIFY_WORKERS, thread_name_prefix="notify-sender"
+        )
+        self._queues = {channel: asyncio.Queue(maxsize=self.queue_size) for channel in self._senders}
+        workers = [
+            asyncio.create_task(self._worker(sender, self._queues[channel]))
+            for channel, sender in self._senders.items()
+        ]
+        self._loop = asyncio.get_running_loop()
+        self._ready.set()
+
+        await asyncio.gather(*workers)
+
+        if self._deliveries:
+            _, pending = await asyncio.wait(self._deliveries, timeout=_STOP_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+        self._executor.shutdown(wait=True)
+
+    async def _shutdown(self):
+        """Báo các worker dừng sau khi gửi nốt batch hiện tại"""
+        self._drain_inbox()
+        for queue in self._queues.values():
+            await queue.put(_STOP)
+
+    def _drain_inbox(self):
+        """Chạy trên event loop: chuyển thông báo từ inbox vào queue các channel đang bật"""
+        # Reset trước khi lấy: thông báo append sau dòng này sẽ đặt lịch lần drain mới
+        self._wakeup_pending = False
+        alert_settings = config_manager.get("alert_settings", {})
+        channels = [channel for channel, sender in self._senders.items()
+                    if sender.enabled(alert_settings)]
+
+        while self._inbox:
+            notification = self._inbox.popleft()
+            for channel in channels:
+                try:
+                    self._queues[channel].put_nowait(notification)
+                    self._stats["queued"] += 1
+                except asyncio.QueueFull:
+                    self._drop(f"{channel} queue")
+
+    def _drop(self, where: str):
+        """Đếm thông báo bị bỏ vì queue đầy (log mỗi 1000 lần)"""
+        self._stats["dropped"] += 1
+        if self._stats["dropped"] % 1000 == 1:
+            logger.warning(f"[Notify] {where} full, dropped "
+                           f"{self._stats['dropped']} notifications so far")
+
+    async def _worker(self, sender: NotificationSender, queue: asyncio.Queue):
+        """Gom thông báo của một channel theo size/thời gian rồi tạo lần gửi cho từng người nhận"""
+        loop = asyncio.get_running_loop()
+        limiter = _RateLimiter(settings.NOTIFY_RATE_LIMIT, settings.NOTIFY_RATE_BURST)
+
+        while True:
+            notification = await queue.get()
+            if notification is _STOP:
+                break
+
+            batch = [notification]
+            deadline = loop.time() + self.batch_window
+            stopping = False
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    notification = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+                if notification is _STOP:
+                    stopping = True
+                    break
+                batch.append(notification)
+
+            for recipient in sender.recipients(config_manager.get("alert_settings", {})):
+                task = asyncio.create_task(self._deliver(sender, limiter, recipient, batch))
+                self._deliveries.add(task)
+                task.add_done_callback(self._deliveries.discard)
+
+            if stopping:
+                break
+
+    async def _deliver(self, sender: NotificationSender, limiter: _RateLimiter,
+                       recipient: str, batch: List[Notification]):
+        """Gửi một batch tới một người nhận, retry với backoff, hết lượt thì dead-letter"""
+        loop = asyncio.get_running_loop()
+        error = None
+        attempt = 0
+
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                await limiter.acquire()
+                try:
+                    await loop.run_in_executor(self._executor, sender.send, recipient, batch)
+                    self._stats["sent"] += 1
+                    return
+                except Exception as e:
+                    error = e
+                    logger.warning(f"[Notify] {sender.channel} to {recipient} failed "
+                                   f"(attempt {attempt}/{self.max_attempts}): {e}")
+
+                if attempt < self.max_attempts:
+                    self._stats["retried"] += 1
+                    await asyncio.sleep(self._backoff(attempt))
+        except asyncio.CancelledError:
+            # Dừng khi còn đang retry: lưu lại để không mất thông báo
+            self._dead_letter(sender.channel, recipient, batch, "dispatcher stopped", attempt)
+            raise
+
+        await loop.run_in_executor(
+            self._executor, self._dead_letter, sender.channel, recipient, batch, str(error), attempt
+        )
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """Thời gian chờ trước lần thử attempt + 1 (exponential, jitter 50-100%)"""
+        delay = min(settings.NOTIFY_RETRY_MAX, settings.NOTIFY_RETRY_BASE * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _dead_letter(self, channel: str, recipient: str,
+                     batch: Sequence[Notification], error: str, attempts: int):
+        """Ghi batch gửi thất bại vào notification_dlq"""
+        self._stats["dead"] += 1
+        try:
+            get_notification_dlq_collection().insert_one({
+                "channel": channel,
+                "recipient": recipient,
+                "notifications": [notification._asdict() for notification in batch],
+                "error": error,
+                "attempts": attempts,
+                "failedAt": datetime.utcnow()
+            })
+        except PyMongoError as e:
+            logger.error(f"[Notify] Cannot store dead letter ({channel} to {recipient}, "
+                         f"{len(batch)} notifications): {e}")
+
+
+# Singleton instance
+notification_dispatcher = NotificationDispatcher()
+alert_engine.add_listener(notification_dispatcher.notify)
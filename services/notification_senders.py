@@ -0,0 +1,223 @@
+"""
+Các channel gửi thông báo cảnh báo (email / SMS / webhook)
+Mỗi sender gửi một batch thông báo tới một người nhận, lỗi thì raise để dispatcher retry
+"""
+
+import smtplib
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from email.message import EmailMessage
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence
+from config.settings import settings
+from utils.logger import setup_logger
+from utils.serialization import dumps
+
+logger = setup_logger(__name__)
+
+# Độ dài tối đa một tin SMS
+_SMS_MAX_LENGTH = 160
+
+# Scheme được dùng cho webhook
+_WEBHOOK_SCHEMES = ("http", "https")
+
+
+class Notification(NamedTuple):
+    """Một chuyển trạng thái alert cần thông báo"""
+    event: str  # opened / escalated / closed
+    alert: Dict[str, Any]
+    createdAt: datetime
+
+
+def format_line(notification: Notification) -> str:
+    """Một dòng mô tả, vd: "ESP001 CRITICAL opened 2025-01-01 00:00:10 UTC (tilt 35.0°)" """
+    alert = notification.alert
+    data = alert.get("data") or {}
+    timestamp = alert.get("closedAt") if notification.event == "closed" else alert.get("timestamp")
+    line = f"{alert.get('deviceId')} {str(alert.get('severity')).upper()} {notification.event}"
+    if isinstance(timestamp, datetime):
+        line += f" {timestamp:%Y-%m-%d %H:%M:%S} UTC"
+    if "tilt_angle" in data:
+        line += f" (tilt {data['tilt_angle']:.1f}°)"
+    return line
+
+
+def summary(notifications: Sequence[Notification]) -> str:
+    """Tiêu đề ngắn cho một batch"""
+    devices = sorted({str(n.alert.get("deviceId")) for n in notifications})
+    opened = sum(1 for n in notifications if n.event != "closed")
+    text = f"[Landslide] {opened} alert(s), {len(notifications) - opened} resolved"
+    return f"{text}: {', '.join(devices[:5])}{' ...' if len(devices) > 5 else ''}"
+
+
+def allowed_webhook_hosts() -> List[str]:
+    """Danh sách NOTIFY_WEBHOOK_ALLOWED_HOSTS (chữ thường)"""
+    return [host.strip().lower() for host in settings.NOTIFY_WEBHOOK_ALLOWED_HOSTS.split(",")
+            if host.strip()]
+
+
+def webhook_url_allowed(url: Any, allowed_hosts: Optional[Iterable[str]] = None) -> bool:
+    """
+    Kiểm tra URL webhook: scheme http/https, không kèm user:password và host nằm trong allow-list
+    (URL do admin cấu hình qua API nên không được trỏ tới dịch vụ nội bộ tùy ý)
+
+    Args:
+        url: URL trong alert_settings.webhook_urls
+        allowed_hosts: "host" hoặc "host:port" (mặc định NOTIFY_WEBHOOK_ALLOWED_HOSTS)
+
+    Returns:
+        True nếu được phép gửi
+    """
+    if not isinstance(url, str):
+        return False
+    try:
+        parsed = urllib.parse.urlsplit(url)
+        port = parsed.port
+    except ValueError:
+        return False
+
+    host = (parsed.hostname or "").lower()
+    if parsed.scheme not in _WEBHOOK_SCHEMES or not host or parsed.username or parsed.password:
+        return False
+
+    allowed = allowed_webhook_hosts() if allowed_hosts is None else allowed_hosts
+    return host in allowed or (port is not None and f"{host}:{port}" in allowed)
+
+
+def _post_json(url: str, body: bytes, headers: Optional[Dict[str, str]] = None,
+               timeout: Optional[float] = None):
+    """
+    POST JSON
+
+    Raises:
+        urllib.error.URLError: Không kết nối được hoặc status >= 400
+    """
+    request = urllib.request.Request(
+        url, data=body, method="POST",
+        headers={"Content-Type": "application/json", **(headers or {})}
+    )
+    with urllib.request.urlopen(request, timeout=timeout or settings.NOTIFY_TIMEOUT) as response:
+        response.read()
+
+
+class NotificationSender:
+    """
+    Channel gửi thông báo (lớp cơ sở)
+
+    Bật/tắt và danh sách người nhận đọc từ alert_settings của config_manager
+    tại thời điểm gửi (enabled_key, recipients_key). send() chạy trong thread
+    của dispatcher nên được phép block.
+    """
+
+    channel = ""
+    enabled_key = ""
+    recipients_key = ""
+
+    def enabled(self, alert_settings: Dict[str, Any]) -> bool:
+        """True nếu channel đang bật"""
+        return bool(alert_settings.get(self.enabled_key))
+
+    def recipients(self, alert_settings: Dict[str, Any]) -> List[str]:
+        """Danh sách người nhận hiện tại"""
+        if not self.enabled(alert_settings):
+            return []
+        return list(alert_settings.get(self.recipients_key) or [])
+
+    def send(self, recipient: str, notifications: Sequence[Notification]):
+        """
+        Gửi một batch tới một người nhận
+
+        Raises:
+            Exception: Gửi thất bại (dispatcher sẽ retry)
+        """
+        raise NotImplementedError
+
+
+class EmailSender(NotificationSender):
+    """Email qua SMTP (một email tóm tắt cho mỗi batch)"""
+
+    channel = "email"
+    enabled_key = "enable_email"
+    recipients_key = "email_recipients"
+
+    def __init__(self, host: Optional[str] = None, port: Optional[int] = None):
+        self.host = host or settings.SMTP_HOST
+        self.port = port or settings.SMTP_PORT
+
+    def send(self, recipient: str, notifications: Sequence[Notification]):
+        message = EmailMessage()
+        message["Subject"] = summary(notifications)
+        message["From"] = settings.SMTP_FROM
+        message["To"] = recipient
+        message.set_content("\n".join(format_line(n) for n in notifications))
+
+        with smtplib.SMTP(self.host, self.port, timeout=settings.NOTIFY_TIMEOUT) as smtp:
+            if settings.SMTP_STARTTLS:
+                smtp.starttls()
+            if settings.SMTP_USERNAME:
+                smtp.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
+            smtp.send_message(message)
+
+
+class SmsGatewaySender(NotificationSender):
+    """SMS qua HTTP gateway: POST {"to", "message"} (một tin cho mỗi batch)"""
+
+    channel = "sms"
+    enabled_key = "enable_sms"
+    recipients_key = "sms_recipients"
+
+    def __init__(self, url: Optional[str] = None, token: Optional[str] = None):
+        self.url = url or settings.SMS_GATEWAY_URL
+        self.token = token if token is not None else settings.SMS_GATEWAY_TOKEN
+
+    def send(self, recipient: str, notifications: Sequence[Notification]):
+        if len(notifications) == 1:
+            text = format_line(notifications[0])
+        else:
+            text = summary(notifications)
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else None
+        _post_json(self.url, dumps({"to": recipient, "message": text[:_SMS_MAX_LENGTH]}), headers)
+
+
+class WebhookSender(NotificationSender):
+    """
+    POST JSON {"notifications": [{"event", "alert", "createdAt"}]} tới từng URL
+
+    Chỉ gửi tới URL qua được webhook_url_allowed(), URL khác bị bỏ qua (có log)
+    """
+
+    channel = "webhook"
+    enabled_key = "enable_webhook"
+    recipients_key = "webhook_urls"
+
+    def __init__(self, allowed_hosts: Optional[Iterable[str]] = None):
+        self.allowed_hosts = (
+            [host.lower() for host in allowed_hosts] if allowed_hosts is not None
+            else allowed_webhook_hosts()
+        )
+
+    def recipients(self, alert_settings: Dict[str, Any]) -> List[str]:
+        urls = []
+        for url in super().recipients(alert_settings):
+            if webhook_url_allowed(url, self.allowed_hosts):
+                urls.append(url)
+            else:
+                logger.warning(f"[Notify] Webhook URL not allowed, skipped: {url!r}")
+        return urls
+
+    def send(self, recipient: str, notifications: Sequence[Notification]):
+        if not webhook_url_allowed(recipient, self.allowed_hosts):
+            raise ValueError(f"Webhook URL not allowed: {recipient!r}")
+        _post_json(recipient, dumps({
+            "notifications": [notification._asdict() for notification in notifications]
+        }))
+
+
+def default_senders() -> List[NotificationSender]:
+    """Sender theo cấu hình môi trường (email cần SMTP_HOST, SMS cần SMS_GATEWAY_URL)"""
+    senders: List[NotificationSender] = [WebhookSender()]
+    if settings.SMTP_HOST:
+        senders.append(EmailSender())
+    if settings.SMS_GATEWAY_URL:
+        senders.append(SmsGatewaySender())
+    return senders
@@ -0,0 +1,70 @@
+"""
+Keyset pagination cho các endpoint trả về record theo thời gian
+Cursor "<timestamp ISO 8601>,<_id>" trỏ tới record cuối của trang trước
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from config.settings import settings
+
+# Thứ tự mới nhất trước, _id phân định các record trùng timestamp
+SORT = [("timestamp", -1), ("_id", -1)]
+
+
+def page_size(limit: Optional[int]) -> int:
+    """Giới hạn limit trong [1, MAX_PAGE_SIZE]"""
+    if not limit or limit < 1:
+        return 1
+    return min(limit, settings.MAX_PAGE_SIZE)
+
+
+def encode_cursor(document: Dict[str, Any]) -> str:
+    """Cursor của record cuối trang"""
+    return f"{document['timestamp'].isoformat()},{document['_id']}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """
+    Đọc cursor "<timestamp>,<_id>"
+
+    Raises:
+        ValueError: Cursor không hợp lệ
+    """
+    try:
+        timestamp, object_id = cursor.rsplit(",", 1)
+        return datetime.fromisoformat(timestamp.replace('Z', '+00:00')), ObjectId(object_id)
+    except (ValueError, InvalidId, TypeError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+
+def apply_cursor(query: Dict[str, Any], cursor: Optional[str]) -> Dict[str, Any]:
+    """
+    Thêm điều kiện "sau cursor" (theo thứ tự SORT) vào query
+
+    Args:
+        query: Query gốc (deviceId, khoảng thời gian, ...)
+        cursor: Cursor từ header X-Next-Cursor của trang trước
+
+    Returns:
+        Query mới
+
+    Raises:
+        ValueError: Cursor không hợp lệ
+    """
+    if not cursor:
+        return query
+
+    timestamp, object_id = decode_cursor(cursor)
+    return {"$and": [query, {"$or": [
+        {"timestamp": {"$lt": timestamp}},
+        {"timestamp": timestamp, "_id": {"$lt": object_id}}
+    ]}]}
+
+
+def next_cursor(results: list, limit: int) -> Optional[str]:
+    """Cursor cho trang kế tiếp (None nếu đã hết dữ liệu)"""
+    if len(results) < limit or not results:
+        return None
+    return encode_cursor(results[-1])
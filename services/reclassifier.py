@@ -0,0 +1,355 @@
+"""
+Re-classification job
+Tính lại severity cho dữ liệu đã lưu khi thresholds thay đổi (chạy nền)
+"""
+
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+import numpy as np
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from config.settings import settings
+from database.mongodb import get_sensor_collection, get_jobs_collection
+from services.config_manager import config_manager, ThresholdSnapshot
+from services.latest_cache import latest_cache
+from services.device_latest import device_latest_store
+from services.response_cache import response_cache
+from services.stats_counters import stats_counters
+from services.severity_analyzer import analyzer, SEVERITY_LEVELS
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+JOB_ID = "reclassify"
+
+# State của job đang giữ lease (process chạy job cập nhật updatedAt sau mỗi chunk)
+_ACTIVE_STATES = ("starting", "running")
+
+# Chỉ đọc các field cần để tính severity
+_PROJECTION = {
+    "_id": 1,
+    "deviceId": 1,
+    "timestamp": 1,
+    "severity": 1,
+    "thresholdVersion": 1,
+    "data.tilt_angle": 1,
+    "data.accel_x": 1,
+    "data.accel_y": 1,
+    "data.accel_z": 1
+}
+
+
+class ReclassificationJob:
+    """
+    Duyệt sensor_data theo _id tăng dần, mỗi chunk:
+    1. Tính severity vectorized với thresholds hiện tại
+    2. bulk_write UpdateOne cho các document có severity thay đổi
+    3. Lưu checkpoint (_id cuối) vào collection jobs để resume
+    4. Sleep để không vượt max_rate docs/s
+
+    Document jobs (_id "reclassify") là nguồn trạng thái duy nhất, dùng chung giữa các process
+    (worker gunicorn): start() nhận job bằng find_one_and_update, process đang chạy cập nhật
+    updatedAt (heartbeat) và đọc stopRequested sau mỗi chunk. Process chết giữa chừng thì sau
+    RECLASSIFY_LEASE giây không có heartbeat, process khác được nhận lại job từ checkpoint.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._owner: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        """True nếu job đang chạy trong process này"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, resume: bool = True,
+              chunk_size: Optional[int] = None,
+              max_rate: Optional[float] = None) -> bool:
+        """
+        Nhận job trong collection jobs và chạy trong thread nền
+
+        Args:
+            resume: Tiếp tục từ checkpoint nếu thresholds không đổi
+            chunk_size: Số document mỗi chunk
+            max_rate: Giới hạn docs/s (0 = không giới hạn)
+
+        Returns:
+            False nếu job đang chạy (ở process này hoặc process khác)
+        """
+        if self.running:
+            return False
+
+        # pid tính lúc start: singleton được tạo trước khi gunicorn fork worker
+        owner = f"{socket.gethostname()}:{os.getpid()}"
+        now = datetime.utcnow()
+        try:
+            checkpoint = get_jobs_collection().find_one_and_update(
+                {"_id": JOB_ID, "$or": [
+                    {"state": {"$nin": list(_ACTIVE_STATES)}},
+                    {"updatedAt": {"$lt": now - timedelta(seconds=settings.RECLASSIFY_LEASE)}}
+                ]},
+                {"$set": {"state": "starting", "owner": owner, "updatedAt": now,
+                          "stopRequested": False},
+                 "$unset": {"error": ""}},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # Document đã có và job còn heartbeat
+            return False
+
+        self._owner = owner
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(
+                config_manager.snapshot,
+                checkpoint if resume else None,
+                chunk_size or settings.RECLASSIFY_CHUNK_SIZE,
+                max_rate if max_rate is not None else settings.RECLASSIFY_MAX_RATE
+            ),
+            name="reclassify-job",
+            daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def stop(self) -> bool:
+        """
+        Yêu cầu job dừng sau chunk hiện tại (checkpoint được giữ để resume),
+        kể cả khi job chạy ở process khác
+
+        Returns:
+            False nếu không có job đang chạy
+        """
+        self._stop_event.set()
+        try:
+            result = get_jobs_collection().update_one(
+                {"_id": JOB_ID, "state": {"$in": list(_ACTIVE_STATES)}},
+                {"$set": {"stopRequested": True}}
+            )
+        except PyMongoError as e:
+            logger.error(f"Failed to request reclassify stop: {e}")
+            return self.running
+        return result.matched_count > 0 or self.running
+
+    def get_status(self) -> Dict[str, Any]:
+        """Lấy tiến độ job từ collection jobs"""
+        try:
+            checkpoint = get_jobs_collection().find_one({"_id": JOB_ID})
+        except PyMongoError as e:
+            logger.error(f"Failed to read reclassify checkpoint: {e}")
+            return {"state": "unknown", "error": str(e)}
+
+        if not checkpoint:
+            return {"state": "idle"}
+
+        status = self._format_checkpoint(checkpoint)
+        updated_at = checkpoint.get("updatedAt")
+        if (status["state"] in _ACTIVE_STATES and updated_at is not None
+                and updated_at < datetime.utcnow() - timedelta(seconds=settings.RECLASSIFY_LEASE)):
+            # Process chạy job đã chết: start() sẽ nhận lại từ checkpoint
+            status["state"] = "interrupted"
+        return status
+
+    def _run(self, snapshot: ThresholdSnapshot, checkpoint: Optional[Dict[str, Any]],
+             chunk_size: int, max_rate: float):
+        """
+        Vòng lặp chính của job
+
+        Args:
+            snapshot: Thresholds lúc start
+            checkpoint: Document jobs trước khi nhận job (None = chạy lại từ đầu)
+            chunk_size: Số document mỗi chunk
+            max_rate: Giới hạn docs/s
+        """
+        thresholds = snapshot.thresholds()
+        collection = get_sensor_collection()
+        jobs = get_jobs_collection()
+
+        try:
+            if (checkpoint and checkpoint.get("state") != "completed"
+                    and checkpoint.get("thresholds") == thresholds):
+                last_id = checkpoint.get("lastId")
+                processed = checkpoint.get("processed", 0)
+                updated = checkpoint.get("updated", 0)
+                started_at = checkpoint.get("startedAt", datetime.utcnow())
+                logger.info(f"[Reclassify] Resuming after _id={last_id} ({processed} done)")
+            else:
+                last_id, processed, updated = None, 0, 0
+                started_at = datetime.utcnow()
+                logger.info(f"[Reclassify] Starting with thresholds {thresholds}")
+
+            total = collection.estimated_document_count()
+            state = "running"
+            run_started = time.monotonic()
+            run_processed = 0
+
+            while True:
+                query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+                documents = list(
+                    collection
+                    .find(query, _PROJECTION)
+                    .sort("_id", 1)
+                    .limit(chunk_size)
+                )
+                if not documents:
+                    state = "completed"
+                    break
+
+                updated += self._reclassify_chunk(collection, documents, snapshot)
+                processed += len(documents)
+                run_processed += len(documents)
+                last_id = documents[-1]["_id"]
+
+                if not self._save_checkpoint(jobs, state, thresholds, last_id, processed,
+                                             updated, total, started_at):
+                    state = "stopped"
+                    break
+
+                # Throttle: giữ tốc độ trung bình <= max_rate (heartbeat trong lúc chờ)
+                if max_rate > 0:
+                    ahead = run_processed / max_rate - (time.monotonic() - run_started)
+                    while ahead > 0 and not self._stop_event.is_set():
+                        self._stop_event.wait(min(ahead, settings.RECLASSIFY_LEASE / 3))
+                        ahead = run_processed / max_rate - (time.monotonic() - run_started)
+                        if ahead > 0 and not self._heartbeat(jobs):
+                            break
+                if self._stop_event.is_set():
+                    state = "stopped"
+                    break
+
+            self._save_checkpoint(jobs, state, thresholds, last_id, processed,
+                                  updated, total, started_at)
+            if updated:
+                # Severity của record mới nhất có thể đã đổi
+                latest_cache.refresh()
+                if device_latest_store.enabled:
+                    device_latest_store.rebuild()
+            logger.info(f"[Reclassify] {state}: processed={processed}, updated={updated}")
+
+        except Exception as e:
+            logger.error(f"[Reclassify] Failed: {e}", exc_info=True)
+            try:
+                jobs.update_one({"_id": JOB_ID, "owner": self._owner},
+                                {"$set": {"state": "failed", "error": str(e),
+                                          "updatedAt": datetime.utcnow()}})
+            except PyMongoError as write_error:
+                logger.error(f"[Reclassify] Cannot record failure: {write_error}")
+
+    @staticmethod
+    def _reclassify_chunk(collection, documents: list, snapshot: ThresholdSnapshot) -> int:
+        """
+        Tính lại severity cho một chunk và ghi các thay đổi (kèm thresholdVersion)
+
+        Returns:
+            Số document đã update
+        """
+        count = len(documents)
+        data = [document.get("data") or {} for document in documents]
+        codes, _ = analyzer.calculate_severity_batch(
+            np.fromiter((d.get("tilt_angle", 0.0) for d in data), np.float64, count),
+            np.fromiter((d.get("accel_x", 0.0) for d in data), np.float64, count),
+            np.fromiter((d.get("accel_y", 0.0) for d in data), np.float64, count),
+            np.fromiter((d.get("accel_z", 0.0) for d in data), np.float64, count),
+            snapshot=snapshot
+        )
+
+        operations = []
+        changes = []
+        for document, code in zip(documents, codes.tolist()):
+            severity = SEVERITY_LEVELS[code]
+            if (document.get("severity") != severity
+                    or document.get("thresholdVersion") != snapshot.version):
+                operations.append(UpdateOne(
+                    {"_id": document["_id"]},
+                    {"$set": {"severity": severity, "thresholdVersion": snapshot.version}}
+                ))
+            if document.get("severity") != severity and "timestamp" in document:
+                changes.append((document.get("deviceId"), document["timestamp"],
+                                document.get("severity"), severity))
+
+        if not operations:
+            return 0
+
+        result = collection.bulk_write(operations, ordered=False)
+        # Alerts/thống kê đã cache có thể dùng severity cũ
+        response_cache.invalidate()
+        if changes and stats_counters.enabled:
+            # Chuyển bộ đếm từ severity cũ sang severity mới
+            stats_counters.adjust_reclassified(changes)
+        return result.modified_count
+
+    def _save_checkpoint(self, jobs, state: str, thresholds: Dict[str, float], last_id,
+                         processed: int, updated: int, total: int, started_at: datetime) -> bool:
+        """
+        Lưu checkpoint (kèm heartbeat) nếu process này còn giữ job
+
+        Returns:
+            False nếu phải dừng: có yêu cầu stop hoặc job đã bị process khác nhận lại
+        """
+        job = jobs.find_one_and_update(
+            {"_id": JOB_ID, "owner": self._owner},
+            {"$set": {
+                "state": state,
+                "thresholds": thresholds,
+                "lastId": last_id,
+                "processed": processed,
+                "updated": updated,
+                "total": total,
+                "startedAt": started_at,
+                "updatedAt": datetime.utcnow()
+            }},
+            projection={"stopRequested": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None:
+            logger.warning("[Reclassify] Lease taken over by another process, stopping")
+            return False
+        return not job.get("stopRequested")
+
+    def _heartbeat(self, jobs) -> bool:
+        """Gia hạn lease khi đang chờ throttle (False nếu phải dừng, xem _save_checkpoint)"""
+        job = jobs.find_one_and_update(
+            {"_id": JOB_ID, "owner": self._owner},
+            {"$set": {"updatedAt": datetime.utcnow()}},
+            projection={"stopRequested": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None or job.get("stopRequested"):
+            self._stop_event.set()
+            return False
+        return True
+
+    @staticmethod
+    def _format_checkpoint(checkpoint: Dict[str, Any]) -> Dict[str, Any]:
+        """Đổi checkpoint sang dict trả về qua API (JSON-serializable)"""
+        total = checkpoint.get("total") or 0
+        processed = checkpoint.get("processed", 0)
+        last_id = checkpoint.get("lastId")
+        started_at = checkpoint.get("startedAt")
+        updated_at = checkpoint.get("updatedAt")
+
+        status = {
+            "state": checkpoint.get("state"),
+            "processed": processed,
+            "updated": checkpoint.get("updated", 0),
+            "total": total,
+            "progress": round(min(processed / total, 1.0) * 100, 2) if total else 0.0,
+            "lastId": str(last_id) if last_id is not None else None,
+            "thresholds": checkpoint.get("thresholds"),
+            "startedAt": started_at.isoformat() if started_at else None,
+            "updatedAt": updated_at.isoformat() if updated_at else None
+        }
+        if checkpoint.get("error"):
+            status["error"] = checkpoint["error"]
+        return status
+
+
+# Singleton instance
+reclassification_job = ReclassificationJob()
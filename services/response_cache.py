@@ -0,0 +1,182 @@
+"""
+Cache response cho các endpoint đọc mà dashboard gọi lặp lại
+(/api/devices/latest, /api/alerts, /api/statistics)
+Key = endpoint + tham số đã chuẩn hóa, entry chỉ dùng được khi version của các nhóm dữ liệu
+mà endpoint phụ thuộc chưa đổi
+"""
+
+import functools
+import hashlib
+import inspect
+import itertools
+from collections import namedtuple
+from typing import Any, Callable, Dict, Hashable, Optional, Sequence, Tuple
+from flask import Response, has_request_context, request
+from config.settings import settings
+from utils.logger import setup_logger
+from utils.ttl_cache import TTLCache
+
+logger = setup_logger(__name__)
+
+# Header không lưu lại (Response tự tạo lại)
+_SKIP_HEADERS = ("Content-Type", "Content-Length")
+
+CachedResponse = namedtuple("CachedResponse", "body etag mimetype headers version")
+
+# Nhóm dữ liệu có version riêng
+# - records: sensor_data (latest, thống kê tính từ record thô)
+# - alerts: collection alerts (alert engine flush)
+# - stats: bộ đếm thống kê (stats_counters flush)
+TOPICS = ("records", "alerts", "stats")
+
+
+class ResponseCache:
+    """
+    LRU + TTL cho response 200 đã serialize
+
+    - Mỗi nhóm dữ liệu (TOPICS) có version riêng, tăng sau khi dữ liệu đã ghi xong:
+      records sau mỗi batch insert (write buffer, async ingest, change stream),
+      alerts / stats sau mỗi lần flush; entry có version cũ của nhóm nó phụ thuộc coi như miss
+    - TTL (RESPONSE_CACHE_TTL) chặn độ trễ khi dữ liệu ghi ở process khác mà không có
+      change stream (vd: alert flush của CoAP ingest khi API chạy bằng gunicorn)
+    - ETag = hash của body: client gửi If-None-Match trùng thì nhận 304 không có body
+    """
+
+    def __init__(self, maxsize: Optional[int] = None, ttl: Optional[float] = None):
+        self.enabled = settings.RESPONSE_CACHE_ENABLED
+        self._cache = TTLCache(
+            maxsize or settings.RESPONSE_CACHE_SIZE,
+            ttl if ttl is not None else settings.RESPONSE_CACHE_TTL
+        )
+        self._counter = itertools.count(1)
+        self._versions = {topic: 0 for topic in TOPICS}
+        self._stats = {"hits": 0, "misses": 0, "notModified": 0}
+
+    def version(self, topics: Sequence[str]) -> Tuple[int, ...]:
+        """Version hiện tại của các nhóm dữ liệu"""
+        return tuple(self._versions[topic] for topic in topics)
+
+    def bump(self, topic: str):
+        """
+        Đánh dấu một nhóm dữ liệu đã thay đổi (không I/O)
+
+        Args:
+            topic: Một trong TOPICS
+        """
+        # next() của itertools.count là atomic dưới GIL
+        self._versions[topic] = next(self._counter)
+
+    def records_changed(self, documents: Optional[Sequence[Dict[str, Any]]] = None):
+        """
+        sensor_data vừa được ghi (gọi sau khi insert thành công)
+
+        Khi không chạy alert engine, alert được tính từ record thô nên cũng đổi.
+
+        Args:
+            documents: Batch vừa ghi (không dùng)
+        """
+        self.bump("records")
+        if not settings.ALERT_ENGINE_ENABLED:
+            self.bump("alerts")
+
+    def invalidate(self):
+        """Xóa toàn bộ cache (xóa record, tính lại thống kê, reclassify)"""
+        for topic in TOPICS:
+            self.bump(topic)
+        self._cache.clear()
+
+    def serve(self, key: Hashable, produce: Callable[[], Any],
+              topics: Sequence[str] = TOPICS) -> Any:
+        """
+        Trả response từ cache hoặc gọi produce() rồi lưu lại
+
+        Args:
+            key: Endpoint + tham số
+            produce: Hàm tạo response (method của controller)
+            topics: Nhóm dữ liệu mà response phụ thuộc
+
+        Returns:
+            Response (304 nếu If-None-Match khớp); response lỗi/streaming trả nguyên trạng
+        """
+        if not self.enabled:
+            return produce()
+
+        # Đọc version trước khi query: ingest xảy ra trong lúc query thì entry đã cũ ngay
+        version = self.version(topics)
+        entry = self._cache.get(key)
+        if entry is not None and entry.version == version:
+            self._stats["hits"] += 1
+            return self._respond(entry)
+
+        self._stats["misses"] += 1
+        result = produce()
+        if (not isinstance(result, Response) or result.status_code != 200
+                or result.is_streamed):
+            return result
+
+        body = result.get_data()
+        entry = CachedResponse(
+            body=body,
+            etag=hashlib.blake2b(body, digest_size=16).hexdigest(),
+            mimetype=result.mimetype,
+            headers=[(name, value) for name, value in result.headers
+                     if name not in _SKIP_HEADERS],
+            version=version
+        )
+        self._cache.set(key, entry)
+        return self._respond(entry)
+
+    def _respond(self, entry: CachedResponse) -> Response:
+        """Response từ entry, 304 nếu client đã có bản này"""
+        response = Response(entry.body, mimetype=entry.mimetype)
+        response.headers.extend(entry.headers)
+        response.set_etag(entry.etag)
+        # Client luôn hỏi lại server, server trả 304 khi ETag chưa đổi
+        response.headers["Cache-Control"] = "no-cache"
+
+        if has_request_context():
+            response.make_conditional(request)
+            if response.status_code == 304:
+                self._stats["notModified"] += 1
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Trạng thái cache và hit/miss"""
+        return {
+            "enabled": self.enabled,
+            "versions": dict(self._versions),
+            "size": self._cache.get_stats()["size"],
+            **self._stats
+        }
+
+
+def cached(*topics: str) -> Callable[[Callable], Callable]:
+    """
+    Decorator cho method đọc của APIController: key = tên method + tham số
+    (positional/keyword và giá trị mặc định được chuẩn hóa qua signature)
+
+    Args:
+        topics: Nhóm dữ liệu mà response phụ thuộc (TOPICS)
+    """
+    def decorator(method: Callable) -> Callable:
+        signature = inspect.signature(method)
+        name = method.__qualname__
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = tuple(
+                (param, value) for param, value in bound.arguments.items() if param != "self"
+            )
+            return response_cache.serve(
+                (name, params), lambda: method(*args, **kwargs), topics
+            )
+
+        return wrapper
+
+    return decorator
+
+
+# Singleton instance
+response_cache = ResponseCache()
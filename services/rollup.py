@@ -0,0 +1,380 @@
+"""
+Rollup job
+Tổng hợp sensor_data thành bucket 1 phút / 1 giờ (min/max/mean của tilt và accel magnitude)
+"""
+
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from pymongo.errors import PyMongoError
+from config.settings import settings
+from database.mongodb import get_sensor_collection, get_rollup_collection, get_jobs_collection
+from services.severity_analyzer import SEVERITY_LEVELS
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+JOB_ID = "rollup"
+
+# (tên, độ dài bucket giây) từ thô đến mịn - history chọn bucket thô nhất còn đủ chi tiết
+ROLLUP_RESOLUTIONS = (("1h", 3600), ("1m", 60))
+
+# Mỗi aggregation xử lý tối đa một ngày dữ liệu (backfill lần đầu)
+_WINDOW = timedelta(days=1)
+
+
+def _truncate(date_expr: str, unit: str) -> Dict[str, Any]:
+    """Biểu thức cắt timestamp về đầu phút/giờ ($dateFromParts, MongoDB 4.0+)"""
+    parts = {
+        "year": {"$year": date_expr},
+        "month": {"$month": date_expr},
+        "day": {"$dayOfMonth": date_expr},
+        "hour": {"$hour": date_expr}
+    }
+    if unit == "minute":
+        parts["minute"] = {"$minute": date_expr}
+    return {"$dateFromParts": parts}
+
+
+# Dạng document rollup (sau $group), dùng cho cả $merge và bucket tính trực tiếp
+_BUCKET_PROJECTION = {
+    "_id": 1,
+    "deviceId": "$_id.deviceId",
+    "start": "$_id.start",
+    "count": 1,
+    "tilt": {
+        "min": "$tiltMin",
+        "max": "$tiltMax",
+        "sum": "$tiltSum",
+        "mean": {"$divide": ["$tiltSum", "$count"]}
+    },
+    "accel": {
+        "min": "$accelMin",
+        "max": "$accelMax",
+        "sum": "$accelSum",
+        "mean": {"$divide": ["$accelSum", "$count"]}
+    },
+    "severity": {"$cond": [
+        {"$gte": ["$severityCode", 0]},
+        {"$arrayElemAt": [list(SEVERITY_LEVELS), "$severityCode"]},
+        None
+    ]}
+}
+
+# Độ dài bucket của từng resolution
+_UNITS = {"1m": "minute", "1h": "hour"}
+
+
+def _output_stages(into: str) -> List[Dict[str, Any]]:
+    """$project về dạng document rollup rồi $merge (idempotent: tính lại thì replace)"""
+    return [
+        {"$project": _BUCKET_PROJECTION},
+        {"$merge": {"into": into, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]
+
+
+def _raw_bucket_stages(unit: str) -> List[Dict[str, Any]]:
+    """$project + $group sensor_data theo (deviceId, đầu phút/giờ)"""
+    return [
+        {"$project": {
+            "deviceId": 1,
+            "timestamp": 1,
+            "severity": 1,
+            "tilt": "$data.tilt_angle",
+            "accel": {"$sqrt": {"$add": [
+                {"$multiply": ["$data.accel_x", "$data.accel_x"]},
+                {"$multiply": ["$data.accel_y", "$data.accel_y"]},
+                {"$multiply": ["$data.accel_z", "$data.accel_z"]}
+            ]}}
+        }},
+        {"$group": {
+            "_id": {"deviceId": "$deviceId", "start": _truncate("$timestamp", unit)},
+            "count": {"$sum": 1},
+            "tiltMin": {"$min": "$tilt"},
+            "tiltMax": {"$max": "$tilt"},
+            "tiltSum": {"$sum": "$tilt"},
+            "accelMin": {"$min": "$accel"},
+            "accelMax": {"$max": "$accel"},
+            "accelSum": {"$sum": "$accel"},
+            "severityCode": _severity_code("$severity")
+        }}
+    ]
+
+
+def _severity_code(field: str) -> Dict[str, Any]:
+    """Index severity trong SEVERITY_LEVELS (-1 nếu không xác định)"""
+    return {"$max": {"$indexOfArray": [list(SEVERITY_LEVELS), field]}}
+
+
+def _floor_minute(timestamp: datetime) -> datetime:
+    return timestamp.replace(second=0, microsecond=0)
+
+
+def _floor_hour(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+class RollupJob:
+    """
+    Chạy định kỳ mỗi ROLLUP_INTERVAL giây:
+    1. Tính bucket 1 phút cho [checkpoint - ROLLUP_LOOKBACK, đầu phút hiện tại)
+       (lookback để gom cả packet đến trễ)
+    2. Tính lại các bucket 1 giờ bị ảnh hưởng từ bucket 1 phút
+    3. Lưu checkpoint vào collection jobs
+    """
+
+    def __init__(self, interval: Optional[float] = None, lookback: Optional[float] = None):
+        self.interval = interval or settings.ROLLUP_INTERVAL
+        self.lookback = timedelta(seconds=lookback if lookback is not None else settings.ROLLUP_LOOKBACK)
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._run_lock = threading.Lock()
+        self._status: Dict[str, Any] = {"state": "idle"}
+
+    @property
+    def running(self) -> bool:
+        """True nếu thread định kỳ đang chạy"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Khởi động thread định kỳ (một instance cho cả hệ thống, trong process chính)"""
+        if self.running:
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="rollup-job", daemon=True)
+        self._thread.start()
+        logger.info(f"[Rollup] Started (interval={self.interval}s)")
+
+    def stop(self):
+        """Dừng thread định kỳ"""
+        if not self.running:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=30)
+        self._thread = None
+
+    def get_status(self) -> Dict[str, Any]:
+        """Trạng thái lần chạy gần nhất"""
+        return self._status.copy()
+
+    def run_once(self, full: bool = False) -> Dict[str, Any]:
+        """
+        Chạy một lượt rollup
+
+        Args:
+            full: Tính lại từ record đầu tiên (bỏ qua checkpoint)
+
+        Returns:
+            Status của lượt chạy
+        """
+        with self._run_lock:
+            jobs = get_jobs_collection()
+            end = _floor_minute(datetime.utcnow())
+
+            checkpoint = None if full else jobs.find_one({"_id": JOB_ID})
+            if checkpoint and checkpoint.get("lastEnd"):
+                start = _floor_minute(checkpoint["lastEnd"] - self.lookback)
+            else:
+                first = get_sensor_collection().find_one({}, {"timestamp": 1}, sort=[("timestamp", 1)])
+                if first is None:
+                    return self._set_status("idle", None, 0)
+                start = _floor_minute(first["timestamp"])
+
+            windows = 0
+            window_start = start
+            while window_start < end and not self._stop_event.is_set():
+                window_end = min(window_start + _WINDOW, end)
+                self._rollup_minutes(window_start, window_end)
+                self._rollup_hours(_floor_hour(window_start), window_end)
+                windows += 1
+
+                jobs.update_one(
+                    {"_id": JOB_ID},
+                    {"$set": {"lastEnd": window_end, "updatedAt": datetime.utcnow()}},
+                    upsert=True
+                )
+                window_start = window_end
+
+            return self._set_status("ok", window_start, windows)
+
+    def _set_status(self, state: str, last_end: Optional[datetime], windows: int) -> Dict[str, Any]:
+        self._status = {
+            "state": state,
+            "lastEnd": last_end.isoformat() if last_end else None,
+            "windows": windows,
+            "updatedAt": datetime.utcnow().isoformat()
+        }
+        return self._status
+
+    def _loop(self):
+        """Thread nền: chạy ngay rồi lặp theo interval"""
+        while True:
+            try:
+                status = self.run_once()
+                logger.debug(f"[Rollup] {status}")
+            except PyMongoError as e:
+                logger.error(f"[Rollup] Failed: {e}")
+                self._status = {"state": "failed", "error": str(e)}
+
+            if self._stop_event.wait(self.interval):
+                break
+
+    @staticmethod
+    def _rollup_minutes(start: datetime, end: datetime):
+        """Bucket 1 phút từ sensor_data trong [start, end)"""
+        pipeline = [
+            {"$match": {"timestamp": {"$gte": start, "$lt": end}}},
+            *_raw_bucket_stages("minute")
+        ] + _output_stages(get_rollup_collection("1m").name)
+
+        get_sensor_collection().aggregate(pipeline, allowDiskUse=True)
+
+    @staticmethod
+    def _rollup_hours(start: datetime, end: datetime):
+        """Bucket 1 giờ từ bucket 1 phút trong [start, end) (start là đầu giờ)"""
+        pipeline = [
+            {"$match": {"start": {"$gte": start, "$lt": end}}},
+            {"$group": {
+                "_id": {"deviceId": "$deviceId", "start": _truncate("$start", "hour")},
+                "count": {"$sum": "$count"},
+                "tiltMin": {"$min": "$tilt.min"},
+                "tiltMax": {"$max": "$tilt.max"},
+                "tiltSum": {"$sum": "$tilt.sum"},
+                "accelMin": {"$min": "$accel.min"},
+                "accelMax": {"$max": "$accel.max"},
+                "accelSum": {"$sum": "$accel.sum"},
+                "severityCode": _severity_code("$severity")
+            }}
+        ] + _output_stages(get_rollup_collection("1h").name)
+
+        get_rollup_collection("1m").aggregate(pipeline, allowDiskUse=True)
+
+
+def select_resolution(resolution: Optional[str], from_time: Optional[datetime],
+                      to_time: Optional[datetime], limit: int) -> str:
+    """
+    Chọn nguồn dữ liệu cho history: "raw", "1m" hoặc "1h"
+
+    Args:
+        resolution: "raw", "1m", "1h", số giây mỗi điểm, "auto"
+                    (auto = khoảng thời gian / limit) hoặc None (= "raw")
+        from_time, to_time: Khoảng thời gian query
+        limit: Số điểm tối đa
+
+    Returns:
+        Bucket thô nhất có độ dài <= độ phân giải yêu cầu
+
+    Raises:
+        ValueError: resolution không hợp lệ, hoặc yêu cầu "1m"/"1h" khi rollup đang tắt
+    """
+    # Không truyền resolution: luôn là record thô (dạng response cũ của endpoint)
+    if resolution in (None, "", "raw"):
+        return "raw"
+
+    if resolution in ("1m", "1h"):
+        # Collection rollup không còn được cập nhật khi tắt: không trả bucket cũ
+        if not settings.ROLLUP_ENABLED:
+            raise ValueError("Rollup is disabled. Use resolution=raw")
+        return resolution
+
+    if not settings.ROLLUP_ENABLED:
+        return "raw"
+
+    if resolution == "auto":
+        if from_time is None or limit <= 0:
+            return "raw"
+        if to_time is None:
+            to_time = datetime.now(timezone.utc) if from_time.tzinfo else datetime.utcnow()
+        seconds_per_point = (to_time - from_time).total_seconds() / limit
+    else:
+        try:
+            seconds_per_point = float(resolution)
+        except ValueError:
+            raise ValueError("Invalid resolution. Use raw, 1m, 1h, auto or seconds")
+
+    for name, seconds in ROLLUP_RESOLUTIONS:
+        if seconds <= seconds_per_point:
+            return name
+    return "raw"
+
+
+def _naive_utc(timestamp: Optional[datetime]) -> Optional[datetime]:
+    """Datetime UTC không tzinfo (cùng kiểu với dữ liệu trong MongoDB)"""
+    if timestamp is None or timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def rollup_tail_start(resolution: str) -> Optional[datetime]:
+    """
+    Đầu bucket đầu tiên mà rollup job chưa tính xong (None nếu job chưa chạy lần nào)
+
+    Rollup 1m chỉ tới đầu phút của lần chạy gần nhất, bucket 1h chứa phút đó cũng chưa đủ.
+    """
+    checkpoint = get_jobs_collection().find_one({"_id": JOB_ID}, {"lastEnd": 1})
+    if not checkpoint or not checkpoint.get("lastEnd"):
+        return None
+    if resolution == "1h":
+        return _floor_hour(checkpoint["lastEnd"])
+    return _floor_minute(checkpoint["lastEnd"])
+
+
+def rollup_history(device_id: str, resolution: str, start: Optional[datetime],
+                   end: Optional[datetime], limit: int) -> List[Dict[str, Any]]:
+    """
+    Bucket rollup của một thiết bị, mới nhất trước
+
+    Phần đã được rollup job tính đọc từ collection rollup; phần đuôi chưa được tính
+    (từ rollup_tail_start) được group trực tiếp từ sensor_data nên không mất dữ liệu mới.
+
+    Args:
+        device_id: ID thiết bị
+        resolution: "1m" hoặc "1h"
+        start, end: Khoảng thời gian
+        limit: Số bucket tối đa
+
+    Returns:
+        Bucket (có thêm "resolution"), giảm dần theo start
+    """
+    start, end = _naive_utc(start), _naive_utc(end)
+    tail = rollup_tail_start(resolution) or start
+
+    live: List[Dict[str, Any]] = []
+    if tail is not None and (end is None or tail <= end):
+        match: Dict[str, Any] = {"deviceId": device_id, "timestamp": {"$gte": max(tail, start or tail)}}
+        if end is not None:
+            match["timestamp"]["$lte"] = end
+        live = list(get_sensor_collection().aggregate([
+            {"$match": match},
+            *_raw_bucket_stages(_UNITS[resolution]),
+            {"$project": _BUCKET_PROJECTION},
+            {"$sort": {"start": -1}},
+            {"$limit": limit}
+        ]))
+
+    stored: List[Dict[str, Any]] = []
+    if len(live) < limit:
+        query: Dict[str, Any] = {"deviceId": device_id}
+        bounds: Dict[str, Any] = {}
+        if start is not None:
+            bounds["$gte"] = start
+        if end is not None:
+            bounds["$lte"] = end
+        if tail is not None:
+            bounds["$lt"] = tail
+        if bounds:
+            query["start"] = bounds
+        stored = list(
+            get_rollup_collection(resolution).find(query).sort("start", -1).limit(limit - len(live))
+        )
+
+    results = live + stored
+    for bucket in results:
+        bucket["resolution"] = resolution
+    return results
+
+
+# Singleton instance
+rollup_job = RollupJob()
@@ -4,15 +4,19 @@ Tính toán severity dựa trên dữ liệu cảm biến
 """
 
 import math
-from typing import Literal
+import numpy as np
+from typing import Literal, Dict, Any, List, Optional, Tuple
 from models.sensor_data import SensorData
-from config.settings import settings
+from services.config_manager import config_manager, ThresholdSnapshot
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
 SeverityLevel = Literal["normal", "warning", "danger", "critical"]
 
+# Thứ tự tăng dần theo mức độ nghiêm trọng
+SEVERITY_LEVELS = ("normal", "warning", "danger", "critical")
+
 
 class SeverityAnalyzer:
     """Phân tích và tính toán mức độ nghiêm trọng"""
@@ -36,19 +40,137 @@ class SeverityAnalyzer:
         logger.debug(f"Device {sensor_data.deviceId}: "
                     f"tilt={tilt_angle:.2f}°, accel={accel_magnitude:.2f}m/s²")
         
+        return SeverityAnalyzer.classify(tilt_angle, accel_magnitude)
+    
+    @staticmethod
+    def analyze_document(document: Dict[str, Any]) -> SeverityLevel:
+        """
+        Tính severity cho một document và gán "severity" + "thresholdVersion"
+        
+        Snapshot ngưỡng được đọc đúng một lần nên severity và version luôn khớp nhau
+        kể cả khi config đổi giữa chừng.
+        
+        Args:
+            document: Document dạng SensorData.to_dict()
+            
+        Returns:
+            Severity level
+        """
+        snapshot = config_manager.snapshot
+        data = document["data"]
+        tilt_angle = abs(data["tilt_angle"])
+        accel_magnitude = math.sqrt(
+            data["accel_x"] ** 2 + data["accel_y"] ** 2 + data["accel_z"] ** 2
+        )
+        severity = SeverityAnalyzer.classify(tilt_angle, accel_magnitude, snapshot)
+        
+        document["severity"] = severity
+        document["thresholdVersion"] = snapshot.version
+        return severity
+    
+    @staticmethod
+    def analyze_documents(documents: List[Dict[str, Any]]) -> SeverityLevel:
+        """
+        Tính severity cho từng document trong batch
+        (gán vào document["severity"] và document["thresholdVersion"])
+        
+        Args:
+            documents: List document cùng một batch
+            
+        Returns:
+            Severity nghiêm trọng nhất trong batch
+        """
+        snapshot = config_manager.snapshot
+        count = len(documents)
+        codes, _ = SeverityAnalyzer.calculate_severity_batch(
+            np.fromiter((d["data"]["tilt_angle"] for d in documents), np.float64, count),
+            np.fromiter((d["data"]["accel_x"] for d in documents), np.float64, count),
+            np.fromiter((d["data"]["accel_y"] for d in documents), np.float64, count),
+            np.fromiter((d["data"]["accel_z"] for d in documents), np.float64, count),
+            snapshot=snapshot
+        )
+        
+        for document, code in zip(documents, codes.tolist()):
+            document["severity"] = SEVERITY_LEVELS[code]
+            document["thresholdVersion"] = snapshot.version
+        return SEVERITY_LEVELS[int(codes.max())] if count else "normal"
+    
+    @staticmethod
+    def calculate_severity_batch(tilt_angle, accel_x, accel_y, accel_z,
+                                 snapshot: Optional[ThresholdSnapshot] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Tính severity cho N reading trong một lượt vectorized
+        
+        Mỗi thang ngưỡng (warning < danger < critical) được tra bằng searchsorted:
+        số ngưỡng nhỏ hơn hẳn giá trị chính là mức severity (cùng điều kiện ">"
+        như classify()). Severity cuối cùng là mức cao hơn giữa tilt và accel.
+        
+        Args:
+            tilt_angle: Array góc nghiêng (độ)
+            accel_x, accel_y, accel_z: Array gia tốc (m/s²)
+            snapshot: ThresholdSnapshot cần dùng; None = snapshot hiện tại của config_manager
+            
+        Returns:
+            (severity codes int8 - index trong SEVERITY_LEVELS, accel magnitudes)
+        """
+        tilt = np.abs(np.asarray(tilt_angle, dtype=np.float64))
+        ax = np.asarray(accel_x, dtype=np.float64)
+        ay = np.asarray(accel_y, dtype=np.float64)
+        az = np.asarray(accel_z, dtype=np.float64)
+        
+        magnitude = np.sqrt(ax * ax + ay * ay + az * az)
+        
+        if snapshot is None:
+            snapshot = config_manager.snapshot
+        
+        tilt_ladder = np.array(snapshot[1:4])
+        accel_ladder = np.array(snapshot[4:7])
+        
+        tilt_codes = np.searchsorted(tilt_ladder, tilt, side="left")
+        accel_codes = np.searchsorted(accel_ladder, magnitude, side="left")
+        
+        # NaN không vượt ngưỡng nào (giống so sánh ">" trong classify())
+        tilt_codes[np.isnan(tilt)] = 0
+        accel_codes[np.isnan(magnitude)] = 0
+        
+        codes = np.maximum(tilt_codes, accel_codes).astype(np.int8)
+        return codes, magnitude
+    
+    @staticmethod
+    def severity_names(codes: np.ndarray) -> np.ndarray:
+        """Đổi severity codes sang tên ("normal", "warning", ...)"""
+        return np.asarray(SEVERITY_LEVELS)[codes]
+    
+    @staticmethod
+    def classify(tilt_angle: float, accel_magnitude: float,
+                 snapshot: Optional[ThresholdSnapshot] = None) -> SeverityLevel:
+        """
+        So sánh góc nghiêng và độ lớn gia tốc với các ngưỡng
+        
+        Args:
+            tilt_angle: Góc nghiêng tuyệt đối (độ)
+            accel_magnitude: Độ lớn gia tốc (m/s²)
+            snapshot: ThresholdSnapshot cần dùng; None = snapshot hiện tại của config_manager
+            
+        Returns:
+            Severity level
+        """
+        if snapshot is None:
+            snapshot = config_manager.snapshot
+        
         # Kiểm tra điều kiện critical
-        if (tilt_angle > settings.THRESHOLD_CRITICAL or 
-            accel_magnitude > settings.ACCEL_CRITICAL):
+        if (tilt_angle > snapshot.tilt_critical or 
+            accel_magnitude > snapshot.accel_critical):
             return "critical"
         
         # Kiểm tra điều kiện danger
-        if (tilt_angle > settings.THRESHOLD_DANGER or 
-            accel_magnitude > settings.ACCEL_DANGER):
+        if (tilt_angle > snapshot.tilt_danger or 
+            accel_magnitude > snapshot.accel_danger):
             return "danger"
         
         # Kiểm tra điều kiện warning
-        if (tilt_angle > settings.THRESHOLD_WARNING or 
-            accel_magnitude > settings.ACCEL_WARNING):
+        if (tilt_angle > snapshot.tilt_warning or 
+            accel_magnitude > snapshot.accel_warning):
             return "warning"
         
         # Ngược lại là normal
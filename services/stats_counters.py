@@ -0,0 +1,405 @@
+"""
+Bộ đếm thống kê tăng dần (incremental counters)
+Thay cho count_documents/distinct trên toàn bộ sensor_data mỗi lần gọi /api/statistics
+"""
+
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from config.settings import settings
+from database.mongodb import (
+    get_sensor_collection,
+    get_stats_counters_collection,
+    get_device_counters_collection,
+    get_stats_minute_collection,
+    get_stats_hour_collection
+)
+from services.response_cache import response_cache
+from services.severity_analyzer import SEVERITY_LEVELS
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+GLOBAL_ID = "global"
+
+
+def _minute(timestamp: datetime) -> datetime:
+    """Đầu phút chứa timestamp"""
+    return timestamp.replace(second=0, microsecond=0)
+
+
+def _hour(timestamp: datetime) -> datetime:
+    """Đầu giờ chứa timestamp"""
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+class _Deltas:
+    """Các giá trị $inc chưa ghi xuống MongoDB"""
+
+    def __init__(self):
+        self.severity: Counter = Counter()
+        self.devices: Dict[str, Counter] = {}
+        self.last_seen: Dict[str, datetime] = {}
+        self.minutes: Dict[datetime, Counter] = {}
+        self.hours: Dict[datetime, Counter] = {}
+
+    def __bool__(self) -> bool:
+        return any((self.severity, self.devices, self.last_seen, self.minutes, self.hours))
+
+    def add(self, device_id: str, severity: str, timestamp: datetime, count: int = 1):
+        """Cộng count record (device, severity, timestamp)"""
+        self.severity[severity] += count
+        self.devices.setdefault(device_id, Counter())[severity] += count
+        self.minutes.setdefault(_minute(timestamp), Counter())[severity] += count
+        self.hours.setdefault(_hour(timestamp), Counter())[severity] += count
+
+        if count > 0:
+            last_seen = self.last_seen.get(device_id)
+            if last_seen is None or timestamp > last_seen:
+                self.last_seen[device_id] = timestamp
+
+    def merge(self, other: "_Deltas"):
+        """Gộp deltas chưa ghi được (retry ở lần flush sau)"""
+        self.severity.update(other.severity)
+        for device_id, counts in other.devices.items():
+            self.devices.setdefault(device_id, Counter()).update(counts)
+        for device_id, timestamp in other.last_seen.items():
+            if device_id not in self.last_seen or timestamp > self.last_seen[device_id]:
+                self.last_seen[device_id] = timestamp
+        for start, counts in other.minutes.items():
+            self.minutes.setdefault(start, Counter()).update(counts)
+        for start, counts in other.hours.items():
+            self.hours.setdefault(start, Counter()).update(counts)
+
+
+def _inc(counts: Counter) -> Dict[str, int]:
+    """Counter severity -> document $inc"""
+    inc = {f"severity.{severity}": count for severity, count in counts.items() if count}
+    inc["total"] = sum(counts.values())
+    return inc
+
+
+def _bulk_pending(collection, pending: Dict[Hashable, Any],
+                  operation: Callable[[Hashable], UpdateOne]):
+    """
+    bulk_write một UpdateOne cho mỗi key của pending, bỏ các key đã ghi khỏi pending
+
+    Raises:
+        PyMongoError: pending chỉ còn các key chưa ghi (BulkWriteError: các op bị lỗi)
+    """
+    keys = list(pending)
+    if not keys:
+        return
+    try:
+        collection.bulk_write([operation(key) for key in keys], ordered=False)
+    except BulkWriteError as e:
+        failed = {keys[error["index"]] for error in e.details.get("writeErrors", [])}
+        for key in keys:
+            if key not in failed:
+                del pending[key]
+        raise
+    pending.clear()
+
+
+class StatsCounters:
+    """
+    Tally theo severity, theo thiết bị và theo bucket thời gian (phút/giờ)
+
+    - Ingest gọi add(): chỉ cộng vào deltas trong bộ nhớ
+    - Thread nền flush deltas mỗi STATS_FLUSH_INTERVAL giây bằng bulk $inc (upsert),
+      nhiều CoAP worker process cùng $inc vào một bộ đếm
+    - adjust_*() dùng cho delete/reclassify, ghi ngay
+    - rebuild() tính lại toàn bộ từ sensor_data (lần đầu bật hoặc khi bộ đếm lệch)
+    """
+
+    def __init__(self, flush_interval: Optional[float] = None):
+        self.flush_interval = flush_interval or settings.STATS_FLUSH_INTERVAL
+
+        self._lock = threading.Lock()
+        self._deltas = _Deltas()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        """True nếu STATS_COUNTERS_ENABLED"""
+        return settings.STATS_COUNTERS_ENABLED
+
+    def initialize(self):
+        """Tính bộ đếm từ sensor_data nếu chưa có (lần đầu bật counters)"""
+        try:
+            if get_stats_counters_collection().find_one({"_id": GLOBAL_ID}) is None:
+                total = self.rebuild()
+                logger.info(f"[Counters] Initialized from {total} records")
+        except PyMongoError as e:
+            logger.error(f"[Counters] Initialization failed: {e}")
+
+    def start(self):
+        """Khởi động thread flush (trong process chạy CoAP ingest)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name="stats-flush", daemon=True)
+        self._thread.start()
+        logger.info(f"[Counters] Flushing every {self.flush_interval}s")
+
+    def stop(self):
+        """Dừng thread flush và ghi nốt deltas còn lại"""
+        if self._thread is None:
+            return
+
+        self._stop_event.set()
+        self._thread.join(timeout=10)
+        self._thread = None
+        self.flush()
+
+    def add(self, documents: Iterable[Dict[str, Any]]):
+        """
+        Cộng các document vừa ingest vào deltas (không I/O)
+
+        Args:
+            documents: Document đã có severity
+        """
+        with self._lock:
+            for document in documents:
+                self._deltas.add(document["deviceId"], document["severity"], document["timestamp"])
+
+    def flush(self) -> bool:
+        """
+        Ghi deltas xuống MongoDB
+
+        Returns:
+            False nếu ghi lỗi (deltas được giữ lại cho lần sau)
+        """
+        with self._lock:
+            deltas, self._deltas = self._deltas, _Deltas()
+
+        if not deltas:
+            return True
+
+        try:
+            self._write(deltas)
+            response_cache.bump("stats")
+            return True
+        except PyMongoError as e:
+            # deltas chỉ còn phần chưa ghi được
+            logger.error(f"[Counters] Flush failed, will retry: {e}")
+            with self._lock:
+                self._deltas.merge(deltas)
+            return False
+
+    def adjust_reclassified(self, changes: List[Tuple[str, datetime, str, str]]):
+        """
+        Chuyển bộ đếm khi severity của record cũ thay đổi
+
+        Args:
+            changes: List (deviceId, timestamp, severity cũ, severity mới)
+        """
+        deltas = _Deltas()
+        for device_id, timestamp, old, new in changes:
+            if old in SEVERITY_LEVELS:
+                deltas.add(device_id, old, timestamp, -1)
+            deltas.add(device_id, new, timestamp, 1)
+        self._write(deltas, include_last_seen=False)
+
+    def adjust_deleted(self, query: Dict[str, Any]) -> Set[str]:
+        """
+        Trừ bộ đếm cho các record sắp bị xóa (gọi trước delete_many)
+
+        Args:
+            query: Query của delete_many
+
+        Returns:
+            Các thiết bị bị ảnh hưởng (truyền cho refresh_last_seen sau khi xóa)
+        """
+        deltas = _Deltas()
+        for row in self._aggregate(query):
+            key = row["_id"]
+            deltas.add(key["deviceId"], key["severity"], key["minute"], -row["count"])
+        devices = set(deltas.devices)
+        self._write(deltas, include_last_seen=False)
+        return devices
+
+    def refresh_last_seen(self, device_ids: Iterable[str]):
+        """
+        Đặt lại lastSeen theo record còn lại (gọi sau delete_many), để thiết bị
+        bị xóa dữ liệu gần đây không còn được tính là active
+
+        Args:
+            device_ids: Thiết bị đã bị xóa record
+        """
+        device_ids = list(device_ids)
+        if not device_ids:
+            return
+
+        last_seen = get_sensor_collection().aggregate([
+            {"$match": {"deviceId": {"$in": device_ids}}},
+            {"$group": {"_id": "$deviceId", "lastSeen": {"$max": "$timestamp"}}}
+        ])
+        operations = [UpdateOne({"_id": row["_id"]}, {"$set": {"lastSeen": row["lastSeen"]}})
+                      for row in last_seen]
+        if operations:
+            get_device_counters_collection().bulk_write(operations, ordered=False)
+
+    def rebuild(self) -> int:
+        """
+        Tính lại toàn bộ bộ đếm từ sensor_data (một aggregation theo device/severity/phút)
+
+        Returns:
+            Tổng số record đã đếm
+        """
+        deltas = _Deltas()
+        total = 0
+        for row in self._aggregate({}):
+            key = row["_id"]
+            deltas.add(key["deviceId"], key["severity"], key["minute"], row["count"])
+            total += row["count"]
+
+        # lastSeen chính xác tới từng record, không chỉ tới phút
+        last_seen = get_sensor_collection().aggregate([
+            {"$group": {"_id": "$deviceId", "lastSeen": {"$max": "$timestamp"}}}
+        ])
+        deltas.last_seen = {row["_id"]: row["lastSeen"] for row in last_seen}
+
+        # Record được insert trong lúc rebuild có thể bị đếm lệch; chạy lại khi ingest rảnh
+        for collection in (get_stats_counters_collection(), get_device_counters_collection(),
+                           get_stats_minute_collection(), get_stats_hour_collection()):
+            collection.delete_many({})
+        self._write(deltas)
+
+        logger.info(f"[Counters] Rebuilt from {total} records, {len(deltas.devices)} devices")
+        return total
+
+    def get_summary(self, active_since: datetime) -> Dict[str, int]:
+        """
+        Thống kê tổng quan trong thời gian hằng số
+
+        Args:
+            active_since: Thiết bị có data từ mốc này được tính là active
+
+        Returns:
+            Dict totalDevices, activeDevices, số record theo severity
+        """
+        counters = get_stats_counters_collection().find_one({"_id": GLOBAL_ID}) or {}
+        severity = counters.get("severity", {})
+        devices = get_device_counters_collection()
+
+        return {
+            "totalDevices": devices.estimated_document_count(),
+            "activeDevices": devices.count_documents({"lastSeen": {"$gte": active_since}}),
+            "criticalAlerts": severity.get("critical", 0),
+            "dangerAlerts": severity.get("danger", 0),
+            "warningAlerts": severity.get("warning", 0)
+        }
+
+    def get_timeline(self, since: datetime, resolution: str = "minute") -> List[Dict[str, Any]]:
+        """
+        Số record theo severity trong từng bucket thời gian
+
+        Args:
+            since: Bucket bắt đầu từ mốc này
+            resolution: "minute" hoặc "hour"
+
+        Returns:
+            List {"start", "total", "severity": {...}} tăng dần theo thời gian
+        """
+        if resolution == "hour":
+            collection, since = get_stats_hour_collection(), _hour(since)
+        else:
+            collection, since = get_stats_minute_collection(), _minute(since)
+
+        return [
+            {
+                "start": bucket["_id"],
+                "total": bucket.get("total", 0),
+                "severity": bucket.get("severity", {})
+            }
+            for bucket in collection.find({"_id": {"$gte": since}}).sort("_id", 1)
+        ]
+
+    def _flush_loop(self):
+        """Thread nền: flush định kỳ"""
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+    @staticmethod
+    def _aggregate(query: Dict[str, Any]):
+        """Đếm record theo (deviceId, severity, phút)"""
+        return get_sensor_collection().aggregate([
+            {"$match": query},
+            {"$group": {
+                "_id": {
+                    "deviceId": "$deviceId",
+                    "severity": "$severity",
+                    "minute": {"$dateFromParts": {
+                        "year": {"$year": "$timestamp"},
+                        "month": {"$month": "$timestamp"},
+                        "day": {"$dayOfMonth": "$timestamp"},
+                        "hour": {"$hour": "$timestamp"},
+                        "minute": {"$minute": "$timestamp"}
+                    }}
+                },
+                "count": {"$sum": 1}
+            }}
+        ], allowDiskUse=True)
+
+    @staticmethod
+    def _write(deltas: _Deltas, include_last_seen: bool = True):
+        """
+        Ghi deltas bằng bulk $inc (upsert) lên từng collection
+
+        Phần nào ghi xong được bỏ khỏi deltas ngay. Khi lỗi, deltas chỉ còn phần chưa ghi
+        nên flush() gộp lại để retry mà không $inc hai lần phần đã ghi.
+
+        Raises:
+            PyMongoError: Ghi lỗi (deltas = phần còn lại)
+        """
+        if not deltas:
+            return
+
+        if deltas.severity:
+            get_stats_counters_collection().update_one(
+                {"_id": GLOBAL_ID}, {"$inc": _inc(deltas.severity)}, upsert=True
+            )
+            deltas.severity = Counter()
+
+        if not include_last_seen:
+            deltas.last_seen = {}
+        # Thiết bị chỉ còn lastSeen (lần ghi trước đã $inc xong)
+        devices = {device_id: deltas.devices.get(device_id)
+                   for device_id in {**deltas.devices, **deltas.last_seen}}
+
+        def device_op(device_id: str) -> UpdateOne:
+            update: Dict[str, Any] = {}
+            if devices[device_id]:
+                update["$inc"] = _inc(devices[device_id])
+            if device_id in deltas.last_seen:
+                update["$max"] = {"lastSeen": deltas.last_seen[device_id]}
+            return UpdateOne({"_id": device_id}, update, upsert=True)
+
+        try:
+            _bulk_pending(get_device_counters_collection(), devices, device_op)
+        finally:
+            deltas.devices = {device_id: counts for device_id, counts in devices.items() if counts}
+            deltas.last_seen = {device_id: timestamp for device_id, timestamp in deltas.last_seen.items()
+                                if device_id in devices}
+
+        for collection, buckets in ((get_stats_minute_collection(), deltas.minutes),
+                                    (get_stats_hour_collection(), deltas.hours)):
+            _bulk_pending(collection, buckets, lambda start: UpdateOne(
+                {"_id": start},
+                {"$inc": _inc(buckets[start]), "$setOnInsert": {"start": start}},
+                upsert=True
+            ))
+
+        if not include_last_seen:
+            # Thiết bị không còn record nào sau khi xóa
+            get_device_counters_collection().delete_many({"total": {"$lte": 0}})
+
+
+# Singleton instance
+stats_counters = StatsCounters()
@@ -0,0 +1,141 @@
+"""
+Danh sách token đã thu hồi (logout) dùng chung giữa các process qua MongoDB
+Mỗi process giữ một bloom filter của danh sách, chỉ hỏi MongoDB khi filter báo "có thể có"
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from config.settings import settings
+from database.mongodb import get_revoked_tokens_collection
+from utils.bloom import BloomFilter
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class TokenRevocationList:
+    """
+    Collection revoked_tokens: {_id: jti, expiresAt}, TTL index xóa khi token hết hạn
+    nên danh sách chỉ gồm token còn hạn đã logout.
+
+    - is_revoked(): bloom filter trả lời "không" trong bộ nhớ cho hầu hết request;
+      "có thể có" thì xác nhận bằng find_one theo _id
+    - Bloom filter được dựng lại từ MongoDB mỗi AUTH_REVOCATION_REFRESH giây
+      (token logout ở worker khác bị chặn chậm nhất sau khoảng này)
+    - MongoDB lỗi khi xác nhận: coi như đã thu hồi (fail closed)
+    """
+
+    def __init__(self, refresh_interval: Optional[float] = None):
+        self.refresh_interval = (refresh_interval if refresh_interval is not None
+                                 else settings.AUTH_REVOCATION_REFRESH)
+
+        self._bloom = BloomFilter(settings.AUTH_BLOOM_CAPACITY)
+        # Token thu hồi trong process này (jti -> expiresAt), giữ lại khi dựng lại filter
+        self._local: Dict[str, datetime] = {}
+        self._refreshed_at = 0.0
+        self._refresh_lock = threading.Lock()
+        self._add_lock = threading.Lock()
+
+    def revoke(self, jti: str, expires_at: datetime):
+        """
+        Thu hồi token (gọi lại với token đã thu hồi không có tác dụng)
+
+        Args:
+            jti: ID của token
+            expires_at: Thời điểm token hết hạn (UTC), sau đó entry tự bị xóa
+        """
+        self.claim(jti, expires_at)
+
+    def claim(self, jti: str, expires_at: datetime) -> bool:
+        """
+        Thu hồi token và cho biết lần gọi này có phải lần đầu không
+
+        insert_one theo _id là thao tác atomic trên MongoDB: giữa các thread và
+        các process chỉ một lần insert thành công, nên dùng được cho token một lần (ticket).
+
+        Args:
+            jti: ID của token
+            expires_at: Thời điểm token hết hạn (UTC), sau đó entry tự bị xóa
+
+        Returns:
+            True nếu token chưa bị thu hồi trước đó; False nếu đã thu hồi
+            hoặc không ghi được MongoDB (fail closed)
+        """
+        with self._add_lock:
+            self._local[jti] = expires_at
+            self._bloom.add(jti)
+
+        try:
+            get_revoked_tokens_collection().insert_one({
+                "_id": jti,
+                "expiresAt": expires_at,
+                "revokedAt": datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            return False
+        except PyMongoError as e:
+            # Vẫn chặn trong process này (bloom + fail closed), worker khác không biết
+            logger.error(f"[Auth] Cannot persist revoked token: {e}")
+            return False
+        return True
+
+    def is_revoked(self, jti: str) -> bool:
+        """True nếu token đã bị thu hồi"""
+        self._maybe_refresh()
+
+        if jti not in self._bloom:
+            return False
+        if jti in self._local:
+            return True
+
+        try:
+            return get_revoked_tokens_collection().find_one({"_id": jti}, {"_id": 1}) is not None
+        except PyMongoError as e:
+            logger.error(f"[Auth] Cannot check revoked token, rejecting: {e}")
+            return True
+
+    def refresh(self) -> int:
+        """
+        Dựng lại bloom filter từ MongoDB
+
+        Returns:
+            Số token đang bị thu hồi
+        """
+        now = datetime.utcnow()
+        jtis = [
+            document["_id"]
+            for document in get_revoked_tokens_collection().find(
+                {"expiresAt": {"$gt": now}}, {"_id": 1}
+            )
+        ]
+        bloom = BloomFilter.from_items(jtis, max(settings.AUTH_BLOOM_CAPACITY, 2 * len(jtis)))
+
+        with self._add_lock:
+            # Token thu hồi trong lúc đọc MongoDB có thể chưa có trong kết quả
+            self._local = {jti: expires for jti, expires in self._local.items() if expires > now}
+            for jti in self._local:
+                bloom.add(jti)
+            self._bloom = bloom
+        return len(jtis)
+
+    def _maybe_refresh(self):
+        """Refresh nếu quá hạn; chỉ một thread refresh, các thread khác dùng filter hiện tại"""
+        if time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+
+        try:
+            self.refresh()
+        except PyMongoError as e:
+            logger.error(f"[Auth] Cannot refresh revoked tokens: {e}")
+        finally:
+            self._refreshed_at = time.monotonic()
+            self._refresh_lock.release()
+
+
+# Singleton instance
+revocation_list = TokenRevocationList()
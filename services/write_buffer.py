@@ -0,0 +1,312 @@
+"""
+Write-behind buffer cho CoAP ingest
+Gom document thành batch insert_many(ordered=False) thay vì insert_one mỗi packet
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo.errors import AutoReconnect, BulkWriteError, PyMongoError
+from config.settings import settings
+from database.mongodb import get_sensor_collection
+from services.device_latest import device_latest_store
+from services.stats_counters import stats_counters
+from services.alert_engine import alert_engine
+from services.event_bus import event_bus
+from services.latest_cache import latest_cache
+from services.response_cache import response_cache
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Sentinel báo writer dừng sau khi đã flush hết queue
+_STOP = object()
+
+# Mã lỗi duplicate key: document đã được ghi ở lần thử trước
+_DUPLICATE_KEY = 11000
+
+
+def _is_transient(error: PyMongoError) -> bool:
+    """True nếu lỗi do mạng/failover (gửi lại batch có thể thành công)"""
+    return isinstance(error, AutoReconnect) or error.has_error_label("RetryableWriteError")
+
+
+def run_saved_hooks(saved: List[Dict[str, Any]]):
+    """
+    Cập nhật latest cache, device_latest, bộ đếm thống kê, alert engine và phát SSE với
+    document đã ghi vào sensor_data (write buffer và Motor ingest đều gọi sau khi insert,
+    chỉ với các document đã ghi được, từ writer thread / executor)
+
+    Mỗi hook chạy độc lập: một hook lỗi không làm batch bị tính là lỗi
+    và không chặn các hook còn lại.
+    """
+    hooks = (
+        ("latest_cache", True, latest_cache.update_many),
+        ("device_latest", device_latest_store.enabled, device_latest_store.upsert),
+        ("stats", stats_counters.enabled, stats_counters.add),
+        ("alerts", alert_engine.enabled, alert_engine.process)
+    )
+    for name, enabled, hook in hooks:
+        if not enabled:
+            continue
+        try:
+            hook(saved)
+        except Exception:
+            logger.exception(f"[Ingest] {name} update failed for {len(saved)} saved documents")
+
+    # Sau khi ghi xong (và latest đã cập nhật): response cache mới bỏ entry cũ
+    response_cache.records_changed(saved)
+    try:
+        event_bus.publish_documents(saved)
+    except Exception:
+        logger.exception(f"[Ingest] SSE publish failed for {len(saved)} saved documents")
+
+
+def saved_documents(documents: List[Dict[str, Any]], error: BulkWriteError) -> List[Dict[str, Any]]:
+    """Các document đã ghi được khi insert_many(ordered=False) lỗi một phần"""
+    failed = {write_error["index"] for write_error in error.details.get("writeErrors", [])}
+    return [document for index, document in enumerate(documents) if index not in failed]
+
+
+class IngestWriteBuffer:
+    """
+    Buffer ghi MongoDB theo batch, chạy trên event loop của CoAP server
+
+    - Flush khi đủ batch_size document hoặc khi document cũ nhất chờ quá flush_interval
+    - Queue có giới hạn (max_queue); khi đầy, put() chờ tối đa put_timeout (backpressure)
+      rồi từ chối để ESP32 gửi lại thay vì làm phình bộ nhớ
+    - insert_many chạy trong 1 thread riêng nên round-trip MongoDB không chặn event loop
+    - Lỗi mạng/failover: gửi lại batch tối đa INGEST_RETRY_ATTEMPTS lần (backoff tăng dần)
+      trước khi bỏ; document đã ghi ở lần trước (duplicate _id) được tính là đã ghi
+    """
+
+    def __init__(self,
+                 batch_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None,
+                 max_queue: Optional[int] = None,
+                 put_timeout: Optional[float] = None):
+        self.batch_size = batch_size or settings.INGEST_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.INGEST_FLUSH_INTERVAL
+        self.max_queue = max_queue or settings.INGEST_QUEUE_SIZE
+        self.put_timeout = put_timeout if put_timeout is not None else settings.INGEST_PUT_TIMEOUT
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats = {
+            "enqueued": 0,
+            "inserted": 0,
+            "failed": 0,
+            "rejected": 0,
+            "batches": 0,
+            "retried": 0
+        }
+
+    @property
+    def running(self) -> bool:
+        """True nếu writer task đang chạy"""
+        return self._writer_task is not None and not self._writer_task.done()
+
+    async def start(self):
+        """Khởi động writer task (gọi bên trong event loop của CoAP server)"""
+        if self.running:
+            return
+
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        # 1 thread duy nhất: các batch được ghi tuần tự, đúng thứ tự nhận
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-writer")
+        self._writer_task = asyncio.create_task(self._writer_loop())
+
+        logger.info(
+            f"[Buffer] Started (batch={self.batch_size}, "
+            f"interval={self.flush_interval}s, queue={self.max_queue})"
+        )
+
+    async def put(self, document: Dict[str, Any]) -> bool:
+        """
+        Đưa một document vào buffer
+
+        Args:
+            document: Document MongoDB (đã tính severity)
+
+        Returns:
+            True nếu được nhận, False nếu buffer đầy quá put_timeout (backpressure)
+        """
+        try:
+            self._queue.put_nowait(document)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put(document), timeout=self.put_timeout)
+            except asyncio.TimeoutError:
+                self._stats["rejected"] += 1
+                logger.warning(f"[Buffer] Queue full ({self.max_queue}), document rejected")
+                return False
+
+        self._stats["enqueued"] += 1
+        return True
+
+    async def put_many(self, documents: List[Dict[str, Any]]) -> bool:
+        """
+        Đưa cả batch vào buffer theo kiểu all-or-nothing
+
+        Chờ tới khi queue đủ chỗ cho toàn bộ batch (tối đa put_timeout) để ESP32
+        không phải gửi lại một batch đã được nhận một phần.
+
+        Args:
+            documents: List document của một batch upload
+
+        Returns:
+            True nếu cả batch được nhận, False nếu bị từ chối (backpressure)
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.put_timeout
+
+        while self.max_queue - self._queue.qsize() < len(documents):
+            if len(documents) > self.max_queue or loop.time() >= deadline:
+                self._stats["rejected"] += len(documents)
+                logger.warning(f"[Buffer] No room for batch of {len(documents)}, rejected")
+                return False
+            await asyncio.sleep(0.01)
+
+        # Không có await giữa lúc kiểm tra và lúc put nên chắc chắn đủ chỗ
+        for document in documents:
+            self._queue.put_nowait(document)
+
+        self._stats["enqueued"] += len(documents)
+        return True
+
+    async def stop(self):
+        """Flush toàn bộ document còn lại rồi dừng writer"""
+        if not self.running:
+            return
+
+        await self._queue.put(_STOP)
+        await self._writer_task
+        self._executor.shutdown(wait=True)
+        self._writer_task = None
+
+        logger.info(
+            f"[Buffer] Stopped (inserted={self._stats['inserted']}, "
+            f"failed={self._stats['failed']})"
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê buffer"""
+        stats = self._stats.copy()
+        stats["queued"] = self._queue.qsize() if self._queue is not None else 0
+        return stats
+
+    async def _writer_loop(self):
+        """Gom document theo size/age và flush từng batch"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            document = await self._queue.get()
+            if document is _STOP:
+                break
+
+            batch = [document]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+
+            while len(batch) < self.batch_size:
+                try:
+                    # Lấy nhanh những gì đã có sẵn, tránh tạo timer cho từng document
+                    document = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        document = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+
+                if document is _STOP:
+                    stopping = True
+                    break
+                batch.append(document)
+
+            try:
+                await self._flush(batch)
+            except Exception:
+                # Lỗi ngoài dự kiến không được làm chết writer (queue sẽ đầy và chặn ingest)
+                self._stats["failed"] += len(batch)
+                logger.exception(f"[Buffer] Flush of {len(batch)} documents failed")
+
+            if stopping:
+                break
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        """Ghi một batch trong writer thread"""
+        loop = asyncio.get_running_loop()
+        inserted, failed, retried = await loop.run_in_executor(
+            self._executor, self._insert_batch, batch
+        )
+
+        self._stats["batches"] += 1
+        self._stats["inserted"] += inserted
+        self._stats["failed"] += failed
+        self._stats["retried"] += retried
+
+    @staticmethod
+    def _insert_batch(batch: List[Dict[str, Any]],
+                      attempts: Optional[int] = None,
+                      backoff: Optional[float] = None) -> Tuple[int, int, int]:
+        """
+        insert_many(ordered=False): một document lỗi không chặn phần còn lại
+        Lỗi tạm thời (mất kết nối, đổi primary) thì gửi lại cả batch; sau đó chạy
+        các hook (device_latest, stats, alert) với các document đã ghi
+
+        Args:
+            batch: Document cần ghi (_id được gán ở lần thử đầu nên gửi lại không tạo bản trùng)
+            attempts: Số lần thử tối đa (mặc định INGEST_RETRY_ATTEMPTS)
+            backoff: Thời gian chờ trước lần thử thứ 2, gấp đôi mỗi lần (giây)
+
+        Returns:
+            (số document đã ghi, số document lỗi, số lần gửi lại)
+        """
+        attempts = max(1, attempts or settings.INGEST_RETRY_ATTEMPTS)
+        backoff = backoff if backoff is not None else settings.INGEST_RETRY_BACKOFF
+        saved: List[Dict[str, Any]] = []
+
+        for attempt in range(1, attempts + 1):
+            try:
+                result = get_sensor_collection().insert_many(batch, ordered=False)
+                logger.debug(f"[MongoDB] Saved batch of {len(result.inserted_ids)}")
+                saved = batch
+                break
+
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors", [])
+                # Từ lần thử thứ 2, duplicate _id nghĩa là lần trước đã ghi được document đó
+                failed = {
+                    error["index"] for error in write_errors
+                    if attempt == 1 or error.get("code") != _DUPLICATE_KEY
+                }
+                saved = [document for index, document in enumerate(batch) if index not in failed]
+                if failed:
+                    logger.error(
+                        f"[MongoDB] Batch partially failed: {len(saved)}/{len(batch)} saved, "
+                        f"{len(failed)} write errors"
+                    )
+                break
+
+            except PyMongoError as e:
+                if attempt < attempts and _is_transient(e):
+                    delay = backoff * 2 ** (attempt - 1)
+                    logger.warning(f"[MongoDB] Batch of {len(batch)} failed "
+                                   f"(attempt {attempt}/{attempts}), retrying in {delay:.1f}s: {e}")
+                    time.sleep(delay)
+                    continue
+                logger.error(f"[MongoDB] Batch of {len(batch)} dropped after {attempt} attempt(s): {e}")
+                return 0, len(batch), attempt - 1
+
+        if saved:
+            run_saved_hooks(saved)
+        return len(saved), len(batch) - len(saved), attempt - 1
+
+
+# Singleton instance
+write_buffer = IngestWriteBuffer()
@@ -0,0 +1,22 @@
+"""
+Fixture dùng chung cho test (pip install pytest mongomock)
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database.mongodb as mongodb  # noqa: E402
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """Database mongomock thay cho MongoDB thật (mỗi test một database trống)"""
+    mongomock = pytest.importorskip("mongomock")
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(mongodb, "_client", client)
+    monkeypatch.setattr(mongodb, "_db", client["landslide_test"])
+    return mongodb._db
@@ -0,0 +1,161 @@
+"""
+Máy trạng thái của alert engine (_observe): mở, nâng mức, hysteresis, đóng, khoảng trống
+"""
+
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.alert_engine import AlertEngine, AlertRules, _DeviceState
+from services.data_parser import parser
+
+T0 = datetime(2025, 1, 1)
+
+RULES = AlertRules(min_duration=10, clear_duration=10, tilt_clear=15.0, accel_clear=11.0,
+                   max_gap=60, stale_timeout=300)
+
+
+def reading(seconds: float, severity: str, tilt: float = 0.0) -> dict:
+    return {
+        "deviceId": "ESP001",
+        "timestamp": T0 + timedelta(seconds=seconds),
+        "severity": severity,
+        "thresholdVersion": 1,
+        "data": {"tilt_angle": tilt, "accel_x": 0.0, "accel_y": 0.0, "accel_z": 9.8}
+    }
+
+
+@pytest.fixture
+def engine():
+    engine = AlertEngine()
+    # _emit chỉ giữ event khi có listener
+    engine.add_listener(lambda event, alert: None)
+    return engine
+
+
+def observe(engine: AlertEngine, state: _DeviceState, *documents, rules: AlertRules = RULES):
+    for document in documents:
+        engine._observe(state, document, rules)
+    events, engine._events = engine._events, []
+    return [event for event, _ in events]
+
+
+def test_opens_only_after_min_duration(engine):
+    state = _DeviceState()
+
+    assert observe(engine, state, reading(0, "danger", 25), reading(5, "danger", 25)) == []
+    assert state.alert is None
+    assert state.pending_readings == 2
+
+    assert observe(engine, state, reading(10, "danger", 25)) == ["opened"]
+    alert = state.alert
+    assert alert["status"] == "open"
+    assert alert["timestamp"] == T0
+    assert alert["readings"] == 3
+    assert alert["_id"] in engine._dirty
+
+
+def test_normal_reading_resets_pending(engine):
+    state = _DeviceState()
+
+    observe(engine, state, reading(0, "danger", 25), reading(5, "normal", 2))
+    assert state.pending_since is None
+    assert state.pending_readings == 0
+
+    assert observe(engine, state, reading(10, "danger", 25)) == []
+
+
+def test_escalation_keeps_peak_reading(engine):
+    state = _DeviceState()
+    observe(engine, state, reading(0, "danger", 25), reading(10, "danger", 25))
+
+    assert observe(engine, state, reading(15, "critical", 35)) == ["escalated"]
+    assert state.alert["severity"] == "critical"
+    assert state.alert["data"]["tilt_angle"] == 35
+
+    # Reading thấp hơn không hạ severity
+    assert observe(engine, state, reading(20, "danger", 22)) == []
+    assert state.alert["severity"] == "critical"
+    assert state.alert["lastSeen"] == T0 + timedelta(seconds=20)
+
+
+def test_hysteresis_and_clear_duration(engine):
+    state = _DeviceState()
+    observe(engine, state, reading(0, "danger", 25), reading(10, "danger", 25))
+
+    # 18° < ngưỡng danger nhưng còn trên ngưỡng đóng (15°): alert vẫn mở
+    assert observe(engine, state, reading(15, "warning", 18)) == []
+    assert state.clear_since is None
+
+    assert observe(engine, state, reading(20, "normal", 2), reading(25, "normal", 2)) == []
+    assert state.alert is not None
+
+    alert = state.alert
+    assert observe(engine, state, reading(30, "normal", 2)) == ["closed"]
+    assert state.alert is None
+    assert alert["status"] == "closed"
+    assert alert["closedAt"] == T0 + timedelta(seconds=20)
+
+
+def test_late_reading_is_ignored(engine):
+    state = _DeviceState()
+    observe(engine, state, reading(10, "normal", 2))
+
+    assert observe(engine, state, reading(5, "critical", 40)) == []
+    assert state.pending_since is None
+    assert state.last_timestamp == T0 + timedelta(seconds=10)
+    assert engine.get_stats()["late"] == 1
+
+
+def test_gap_resets_pending(engine):
+    state = _DeviceState()
+    observe(engine, state, reading(0, "danger", 25))
+
+    # Khoảng trống > max_gap: đợt pending bắt đầu lại từ reading sau khoảng trống
+    assert observe(engine, state, reading(100, "danger", 25)) == []
+    assert state.pending_since == T0 + timedelta(seconds=100)
+    assert state.pending_readings == 1
+
+
+def test_gap_closes_stale_alert_at_last_reading(engine):
+    state = _DeviceState()
+    observe(engine, state, reading(0, "danger", 25), reading(10, "danger", 25))
+    alert = state.alert
+
+    events = observe(engine, state, reading(1000, "danger", 25))
+    assert events == ["closed"]
+    assert alert["status"] == "closed"
+    assert alert["closedAt"] == T0 + timedelta(seconds=10)
+    assert engine.get_stats()["stale"] == 1
+    # Reading sau khoảng trống mở đợt pending mới
+    assert state.alert is None
+    assert state.pending_since == T0 + timedelta(seconds=1000)
+
+
+
+@pytest.mark.parametrize("tz", ["Asia/Ho_Chi_Minh", "America/Los_Angeles"])
+def test_parsed_readings_share_the_stale_clock(engine, monkeypatch, tz):
+    # Timestamp của reading và deadline của close_stale phải cùng là UTC trên mọi host
+    monkeypatch.setenv("TZ", tz)
+    time.tzset()
+    try:
+        payload = json.dumps({"id": "ESP001", "ts": int(time.time() * 1000), "ax": 0, "ay": 0,
+                              "az": 9.8, "gx": 0, "gy": 0, "gz": 0, "tilt": 25}).encode()
+        document = parser.parse_document(payload)
+    finally:
+        monkeypatch.delenv("TZ")
+        time.tzset()
+
+    assert abs((document["timestamp"] - datetime.utcnow()).total_seconds()) < 5
+
+    state = engine._devices["ESP001"] = _DeviceState()
+    document["severity"] = "danger"
+    observe(engine, state, document, dict(document, timestamp=document["timestamp"]
+                                           + timedelta(seconds=10)))
+    assert state.alert is not None
+
+    monkeypatch.setattr("services.alert_engine.current_rules", lambda: RULES)
+    assert engine.close_stale() == 0
+    assert engine.close_stale(datetime.utcnow() + timedelta(seconds=600)) == 1
@@ -0,0 +1,134 @@
+"""
+Decoder CBOR tự viết (đối chiếu với cbor2) và struct nhị phân v1
+"""
+
+import struct
+from datetime import datetime
+
+import pytest
+
+from services.binary_codec import (BinaryDecodeError, FLAG_LOCATION, decode_cbor, decode_struct,
+                                   encode_struct)
+
+cbor2 = pytest.importorskip("cbor2")
+
+SAMPLE = {
+    "id": "ESP001",
+    "ts": 1735123456789,
+    "ax": 0.12, "ay": -0.05, "az": 9.81,
+    "gx": 0.01, "gy": 0.02, "gz": 0.0,
+    "tilt": 5.2,
+    "lat": 21.0285, "lon": 105.8542
+}
+
+VALUES = (0.12, -0.05, 9.81, 0.01, 0.02, 0.0, 30.5, -12.25, 44.0, 5.2)
+
+
+@pytest.mark.parametrize("value", [
+    SAMPLE,
+    {"id": "ESP002", "samples": [SAMPLE, dict(SAMPLE, ts=SAMPLE["ts"] + 200)]},
+    {"id": "ESP003", "t0": 1735123456789, "dt": 200, "fields": ["ax", "tilt"],
+     "rows": [[0.12, 5.2], [0.01, -0.1], [0, 0]]},
+    [0, 23, 24, 255, 256, 65535, 65536, 2 ** 32, 2 ** 64 - 1],
+    [-1, -24, -25, -256, -65537, -(2 ** 63)],
+    {"flags": [True, False, None], "bytes": b"\x00\xff", "text": "độ nghiêng"},
+    {"nested": {"deep": [[], {}, [1, [2, [3]]]]}},
+])
+def test_cbor_round_trip(value):
+    assert decode_cbor(cbor2.dumps(value)) == value
+
+
+@pytest.mark.parametrize("number", [0.5, -2.0, 65504.0, 1.1, 3.4028234663852886e38, 1e300])
+def test_cbor_floats_use_shortest_encoding(number):
+    # cbor2 chọn float16/32/64 ngắn nhất giữ nguyên giá trị
+    assert decode_cbor(cbor2.dumps(number, canonical=True)) == number
+
+
+def test_cbor_tag_is_unwrapped():
+    assert decode_cbor(cbor2.dumps(cbor2.CBORTag(1, 1735123456))) == 1735123456
+
+
+def test_cbor_truncated_input_is_rejected():
+    encoded = cbor2.dumps({"id": "ESP001", "samples": [SAMPLE] * 3})
+    for length in range(len(encoded)):
+        with pytest.raises(BinaryDecodeError):
+            decode_cbor(encoded[:length])
+
+
+def test_cbor_trailing_bytes_are_rejected():
+    with pytest.raises(BinaryDecodeError, match="Trailing"):
+        decode_cbor(cbor2.dumps(SAMPLE) + b"\x00")
+
+
+@pytest.mark.parametrize("payload", [
+    b"\x9f\x01\x02\xff",          # array độ dài không xác định
+    b"\xbf\x61a\x01\xff",         # map độ dài không xác định
+    b"\x7f\x61a\xff",             # text string độ dài không xác định
+    b"\x5f\x41\x00\xff",          # byte string độ dài không xác định
+])
+def test_cbor_indefinite_lengths_are_rejected(payload):
+    # cbor2 đọc được các payload này, decoder của ESP32 ingest thì không hỗ trợ
+    cbor2.loads(payload)
+    with pytest.raises(BinaryDecodeError):
+        decode_cbor(payload)
+
+
+@pytest.mark.parametrize("payload", [
+    b"\x9a\xff\xff\xff\xff",      # array khai báo 2^32 - 1 phần tử
+    b"\x78\x10abc",               # text dài hơn payload
+    b"\xf8\x20",                  # simple value 32
+    b"\x63\xff\xfe\xfd",          # UTF-8 không hợp lệ
+])
+def test_cbor_malformed_items_are_rejected(payload):
+    with pytest.raises(BinaryDecodeError):
+        decode_cbor(payload)
+
+
+def test_struct_round_trip():
+    payload = encode_struct(7, VALUES, ts=1735123456789)
+    assert payload == struct.pack("<BBHQ10f", 1, 0, 7, 1735123456789, *VALUES)
+
+    document = decode_struct(payload)
+
+    assert document["deviceId"] == "ESP007"
+    assert document["timestamp"] == datetime(2024, 12, 25, 10, 44, 16, 789000)
+    assert document["location"] is None
+    assert document["data"] == {
+        "accel_x": 0.12, "accel_y": -0.05, "accel_z": 9.81,
+        "gyro_x": 0.01, "gyro_y": 0.02, "gyro_z": 0.0, "tilt_angle": 5.2
+    }
+
+
+def test_struct_with_trailing_location_floats():
+    payload = struct.pack("<BBHQ10f2f", 1, FLAG_LOCATION, 1, 0, *VALUES, 21.0285, 105.8542)
+    assert payload == encode_struct(1, VALUES, location=(21.0285, 105.8542))
+
+    document = decode_struct(payload)
+
+    # float32 → làm tròn FLOAT_DECIMALS chữ số, không khớp tuyệt đối
+    assert document["location"] == pytest.approx({"lat": 21.0285, "lon": 105.8542}, abs=1e-4)
+    # ts = 0: server tự gán
+    assert abs((document["timestamp"] - datetime.utcnow()).total_seconds()) < 5
+
+
+@pytest.mark.parametrize("payload", [
+    struct.pack("<BBHQ10f", 1, 0, 1, 0, *VALUES)[:-1],                   # thiếu byte
+    struct.pack("<BBHQ10f", 1, FLAG_LOCATION, 1, 0, *VALUES),            # cờ GPS nhưng thiếu lat/lon
+    struct.pack("<BBHQ10f2f", 1, 0, 1, 0, *VALUES, 21.0, 105.8),         # lat/lon nhưng không có cờ
+    struct.pack("<BBHQ10f", 2, 0, 1, 0, *VALUES),                        # version lạ
+    struct.pack("<BBHQ10f", 1, 0, 1, 2 ** 64 - 1, *VALUES),              # timestamp tràn
+    b"",
+])
+def test_struct_invalid_payloads_are_rejected(payload):
+    with pytest.raises(BinaryDecodeError):
+        decode_struct(payload)
+
+
+def test_struct_device_index_bounds():
+    with pytest.raises(BinaryDecodeError, match="index 0"):
+        decode_struct(struct.pack("<BBHQ10f", 1, 0, 0, 0, *VALUES))
+
+    assert decode_struct(encode_struct(65535, VALUES))["deviceId"] == "ESP65535"
+    # u16: index ngoài phạm vi không encode được
+    with pytest.raises(struct.error):
+        encode_struct(65536, VALUES)
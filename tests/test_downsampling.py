@@ -0,0 +1,91 @@
+"""
+Downsampling: tham số, bucket cố định và LTTB
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from services.downsampling import (bucket_milliseconds, format_buckets, lttb_documents,
+                                   lttb_indices, parse_duration, parse_fields, projection)
+
+
+def test_parse_duration():
+    assert parse_duration("30m") == timedelta(minutes=30)
+    assert parse_duration(" 24h ") == timedelta(hours=24)
+    assert parse_duration("7d") == timedelta(days=7)
+    with pytest.raises(ValueError):
+        parse_duration("7w")
+
+
+def test_parse_fields_and_projection():
+    assert parse_fields(None) is None
+    assert parse_fields("tilt_angle, accel_x,") == ["tilt_angle", "accel_x"]
+    with pytest.raises(ValueError):
+        parse_fields("tilt_angle,pressure")
+
+    assert projection(None) is None
+    assert projection(["tilt_angle"]) == {"deviceId": 1, "timestamp": 1, "severity": 1,
+                                          "data.tilt_angle": 1}
+
+
+def test_bucket_milliseconds_caps_point_count():
+    start = datetime(2025, 1, 1)
+    assert bucket_milliseconds(start, start + timedelta(hours=1), 60) == 60000
+    # Không chia hết: làm tròn lên để không vượt max_points
+    assert bucket_milliseconds(start, start + timedelta(seconds=10), 3) == 3334
+    assert bucket_milliseconds(start, start, 100) == 1
+
+
+def test_format_buckets_maps_severity_code():
+    buckets = [
+        {"_id": datetime(2025, 1, 1), "count": 3, "severityCode": 2,
+         "avg_tilt_angle": 12.5, "min_tilt_angle": 10.0, "max_tilt_angle": 15.0},
+        {"_id": datetime(2025, 1, 1, 0, 1), "count": 1, "severityCode": -1}
+    ]
+
+    points = format_buckets(buckets, ["tilt_angle"])
+
+    assert points[0]["severity"] == "danger"
+    assert points[0]["data"] == {"tilt_angle": 12.5}
+    assert points[0]["min"] == {"tilt_angle": 10.0}
+    assert points[0]["max"] == {"tilt_angle": 15.0}
+    assert points[1]["severity"] is None
+    assert points[1]["data"] == {"tilt_angle": None}
+
+
+def test_lttb_keeps_endpoints_and_spike():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.sin(x / 50)
+    y[437] = 25.0
+
+    indices = lttb_indices(x, y, 100)
+
+    assert len(indices) == 100
+    assert indices[0] == 0
+    assert indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+    assert 437 in indices
+
+
+def test_lttb_returns_everything_when_under_threshold():
+    x = np.arange(10, dtype=np.float64)
+    assert lttb_indices(x, x, 10).tolist() == list(range(10))
+    assert lttb_indices(x, x, 2).tolist() == list(range(10))
+
+
+def test_lttb_documents_tolerates_missing_values():
+    start = datetime(2025, 1, 1)
+    documents = [
+        {"timestamp": start + timedelta(seconds=index),
+         "data": {"tilt_angle": float(index % 7)} if index % 5 else {}}
+        for index in range(200)
+    ]
+
+    selected = lttb_documents(documents, 20, "tilt_angle")
+
+    assert len(selected) == 20
+    assert selected[0] is documents[0]
+    assert selected[-1] is documents[-1]
+    assert lttb_documents(documents[:10], 20, "tilt_angle") == documents[:10]
@@ -0,0 +1,163 @@
+"""
+NotificationDispatcher: gom batch, rate limit, retry với backoff, dead-letter và đếm thông báo bị bỏ
+"""
+
+import asyncio
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from config.settings import settings
+from services.notification_dispatcher import NotificationDispatcher, _RateLimiter
+from services.notification_senders import Notification, NotificationSender
+
+ALERT = {"deviceId": "ESP001", "severity": "critical", "data": {"tilt_angle": 35.0}}
+
+
+class FakeSender(NotificationSender):
+    """Channel giả: lỗi failures lần đầu rồi gửi thành công, ghi lại mọi batch đã gửi"""
+
+    channel = "fake"
+
+    def __init__(self, failures: int = 0, recipients=("ops",)):
+        self.failures = failures
+        self._recipients = list(recipients)
+        self.attempts = 0
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def enabled(self, alert_settings):
+        return True
+
+    def recipients(self, alert_settings):
+        return list(self._recipients)
+
+    def send(self, recipient, notifications):
+        with self._lock:
+            self.attempts += 1
+            if self.attempts <= self.failures:
+                raise ConnectionError(f"attempt {self.attempts} refused")
+            self.sent.append((recipient, list(notifications)))
+
+
+@pytest.fixture(autouse=True)
+def fast_settings(monkeypatch):
+    monkeypatch.setattr(settings, "NOTIFY_RATE_LIMIT", 0)
+    monkeypatch.setattr(settings, "NOTIFY_RETRY_BASE", 0.01)
+    monkeypatch.setattr(settings, "NOTIFY_RETRY_MAX", 0.05)
+
+
+def run_dispatcher(sender, events, **kwargs):
+    """Start, gửi các event rồi stop (stop chờ batch và retry còn dở)"""
+    kwargs.setdefault("batch_window", 5)
+    dispatcher = NotificationDispatcher(**kwargs)
+    dispatcher.register(sender)
+    dispatcher.start()
+    for event in events:
+        dispatcher.notify(event, dict(ALERT))
+    dispatcher.stop()
+    return dispatcher
+
+
+def test_notifications_are_batched_per_recipient(mongo):
+    sender = FakeSender(recipients=("ops", "oncall"))
+
+    dispatcher = run_dispatcher(sender, ["opened", "escalated", "closed"])
+
+    assert sorted(recipient for recipient, _ in sender.sent) == ["oncall", "ops"]
+    for _, notifications in sender.sent:
+        assert [n.event for n in notifications] == ["opened", "escalated", "closed"]
+    stats = dispatcher.get_stats()
+    assert (stats["queued"], stats["sent"], stats["dead"]) == (3, 2, 0)
+
+
+def test_batch_size_splits_batches(mongo):
+    sender = FakeSender()
+
+    run_dispatcher(sender, ["opened"] * 5, batch_size=2)
+
+    assert [len(notifications) for _, notifications in sender.sent] == [2, 2, 1]
+
+
+def test_retry_until_sent(mongo):
+    sender = FakeSender(failures=2)
+
+    dispatcher = run_dispatcher(sender, ["opened"], max_attempts=5)
+
+    assert sender.attempts == 3
+    assert len(sender.sent) == 1
+    stats = dispatcher.get_stats()
+    assert (stats["sent"], stats["retried"], stats["dead"]) == (1, 2, 0)
+    assert mongo.notification_dlq.count_documents({}) == 0
+
+
+def test_dead_letter_after_max_attempts(mongo):
+    sender = FakeSender(failures=10)
+
+    dispatcher = run_dispatcher(sender, ["opened", "closed"], max_attempts=3)
+
+    assert sender.attempts == 3
+    stats = dispatcher.get_stats()
+    assert (stats["sent"], stats["retried"], stats["dead"]) == (0, 2, 1)
+
+    dead = list(mongo.notification_dlq.find())
+    assert len(dead) == 1
+    assert dead[0]["channel"] == "fake"
+    assert dead[0]["recipient"] == "ops"
+    assert dead[0]["attempts"] == 3
+    assert dead[0]["error"] == "attempt 3 refused"
+    assert [n["event"] for n in dead[0]["notifications"]] == ["opened", "closed"]
+    assert dead[0]["notifications"][0]["alert"]["deviceId"] == "ESP001"
+
+
+def test_backoff_is_exponential_and_capped(monkeypatch):
+    monkeypatch.setattr(settings, "NOTIFY_RETRY_BASE", 1)
+    monkeypatch.setattr(settings, "NOTIFY_RETRY_MAX", 4)
+
+    assert 0.5 <= NotificationDispatcher._backoff(1) <= 1
+    assert 2 <= NotificationDispatcher._backoff(3) <= 4
+    assert 2 <= NotificationDispatcher._backoff(10) <= 4
+
+
+def test_full_channel_queue_counts_dropped():
+    dispatcher = NotificationDispatcher(queue_size=2)
+    dispatcher.register(FakeSender())
+    dispatcher._queues = {"fake": asyncio.Queue(maxsize=dispatcher.queue_size)}
+
+    for _ in range(5):
+        dispatcher._inbox.append(Notification("opened", dict(ALERT), datetime.utcnow()))
+    dispatcher._drain_inbox()
+
+    stats = dispatcher.get_stats()
+    assert (stats["queued"], stats["dropped"]) == (2, 3)
+    assert stats["pending"] == {"fake": 2}
+
+
+def test_full_inbox_counts_dropped():
+    dispatcher = NotificationDispatcher(inbox_size=2)
+    # Event loop chưa chạy: thông báo nằm lại trong inbox
+    loop = asyncio.new_event_loop()
+    dispatcher._loop = loop
+    try:
+        for _ in range(5):
+            dispatcher.notify("opened", dict(ALERT))
+    finally:
+        loop.close()
+
+    assert len(dispatcher._inbox) == 2
+    assert dispatcher.get_stats()["dropped"] == 3
+
+
+def test_rate_limiter_allows_burst_then_throttles():
+    async def acquire(limiter, count):
+        start = time.monotonic()
+        for _ in range(count):
+            await limiter.acquire()
+        return time.monotonic() - start
+
+    # 2 lần đầu trong burst, 2 lần sau chờ 1/20 giây mỗi lần
+    assert asyncio.run(acquire(_RateLimiter(20, 2), 2)) < 0.05
+    assert asyncio.run(acquire(_RateLimiter(20, 2), 4)) >= 0.09
+    assert asyncio.run(acquire(_RateLimiter(0, 1), 100)) < 0.05
@@ -0,0 +1,70 @@
+"""
+Keyset pagination: cursor, giới hạn limit và duyệt hết các trang không trùng/sót record
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from config.settings import settings
+from services.pagination import (SORT, apply_cursor, decode_cursor, encode_cursor,
+                                 next_cursor, page_size)
+
+
+def test_cursor_round_trip():
+    document = {"timestamp": datetime(2025, 1, 1, 12, 30, 15, 250000), "_id": ObjectId()}
+
+    assert decode_cursor(encode_cursor(document)) == (document["timestamp"], document["_id"])
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", "2025-01-01T00:00:00,xyz",
+                                    f"yesterday,{ObjectId()}"])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_page_size_bounds():
+    assert page_size(None) == 1
+    assert page_size(0) == 1
+    assert page_size(-5) == 1
+    assert page_size(50) == 50
+    assert page_size(settings.MAX_PAGE_SIZE + 1) == settings.MAX_PAGE_SIZE
+
+
+def test_apply_cursor_without_cursor_keeps_query():
+    query = {"deviceId": "ESP001"}
+    assert apply_cursor(query, None) is query
+
+
+def test_next_cursor_only_for_full_page():
+    documents = [{"timestamp": datetime(2025, 1, 1), "_id": ObjectId()} for _ in range(3)]
+
+    assert next_cursor([], 3) is None
+    assert next_cursor(documents[:2], 3) is None
+    assert next_cursor(documents, 3) == encode_cursor(documents[-1])
+
+
+def test_pages_cover_all_records_once(mongo):
+    collection = mongo["sensor_data"]
+    start = datetime(2025, 1, 1)
+    # Nhiều record trùng timestamp: _id phải phân định thứ tự giữa các trang
+    collection.insert_many([
+        {"deviceId": "ESP001", "timestamp": start + timedelta(seconds=index // 3)}
+        for index in range(20)
+    ])
+    collection.insert_one({"deviceId": "ESP002", "timestamp": start})
+
+    query = {"deviceId": "ESP001"}
+    seen, cursor = [], None
+    while True:
+        page = list(collection.find(apply_cursor(query, cursor)).sort(SORT).limit(6))
+        seen.extend(document["_id"] for document in page)
+        cursor = next_cursor(page, 6)
+        if cursor is None:
+            break
+
+    expected = [document["_id"] for document in collection.find(query).sort(SORT)]
+    assert seen == expected
+    assert len(seen) == 20
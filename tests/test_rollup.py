@@ -0,0 +1,52 @@
+"""
+Chọn nguồn dữ liệu history (record thô hoặc bucket rollup)
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from config.settings import settings
+from services.rollup import select_resolution
+
+START = datetime(2025, 1, 1)
+
+
+@pytest.mark.parametrize("resolution, hours, expected", [
+    (None, 1, "raw"),
+    ("raw", 1, "raw"),
+    ("1m", 1, "1m"),
+    ("1h", 1, "1h"),
+    ("auto", 1, "raw"),
+    ("auto", 24, "1m"),
+    ("auto", 24 * 365, "1h"),
+    ("30", 1, "raw"),
+    ("3600", 1, "1h"),
+])
+def test_select_resolution(monkeypatch, resolution, hours, expected):
+    monkeypatch.setattr(settings, "ROLLUP_ENABLED", True)
+    end = START + timedelta(hours=hours)
+
+    assert select_resolution(resolution, START, end, 100) == expected
+
+
+@pytest.mark.parametrize("resolution", ["1m", "1h"])
+def test_explicit_rollup_rejected_when_disabled(monkeypatch, resolution):
+    monkeypatch.setattr(settings, "ROLLUP_ENABLED", False)
+
+    with pytest.raises(ValueError, match="disabled"):
+        select_resolution(resolution, START, START + timedelta(days=30), 100)
+
+
+@pytest.mark.parametrize("resolution", ["auto", "3600", "raw", None])
+def test_other_resolutions_fall_back_to_raw_when_disabled(monkeypatch, resolution):
+    monkeypatch.setattr(settings, "ROLLUP_ENABLED", False)
+
+    assert select_resolution(resolution, START, START + timedelta(days=30), 100) == "raw"
+
+
+def test_invalid_resolution(monkeypatch):
+    monkeypatch.setattr(settings, "ROLLUP_ENABLED", True)
+
+    with pytest.raises(ValueError, match="Invalid resolution"):
+        select_resolution("weekly", START, None, 100)
@@ -0,0 +1,77 @@
+"""
+Severity vectorized (calculate_severity_batch) phải cho cùng kết quả với classify()
+"""
+
+import copy
+import math
+
+import numpy as np
+import pytest
+
+from services.config_manager import ThresholdSnapshot
+from services.severity_analyzer import SEVERITY_LEVELS, analyzer
+
+SNAPSHOT = ThresholdSnapshot(version=1, tilt_warning=10.0, tilt_danger=20.0, tilt_critical=30.0,
+                             accel_warning=10.5, accel_danger=12.0, accel_critical=15.0)
+
+
+def scalar(tilt: float, ax: float, ay: float, az: float, snapshot=SNAPSHOT) -> str:
+    return analyzer.classify(abs(tilt), math.sqrt(ax * ax + ay * ay + az * az), snapshot)
+
+
+def batch(tilt, ax, ay, az, snapshot=SNAPSHOT):
+    codes, _ = analyzer.calculate_severity_batch(tilt, ax, ay, az, snapshot=snapshot)
+    return analyzer.severity_names(codes).tolist()
+
+
+def test_random_readings_match_scalar():
+    rng = np.random.default_rng(7)
+    count = 5000
+    tilt = rng.uniform(-40, 40, count)
+    ax, ay = rng.normal(0, 4, count), rng.normal(0, 4, count)
+    az = rng.normal(9.8, 3, count)
+
+    expected = [scalar(*values) for values in zip(tilt, ax, ay, az)]
+
+    assert batch(tilt, ax, ay, az) == expected
+
+
+@pytest.mark.parametrize("tilt", [10.0, 20.0, 30.0, -20.0, 10.000001, 29.999999])
+def test_tilt_on_threshold_matches_scalar(tilt):
+    # Đúng bằng ngưỡng không vượt ngưỡng (so sánh ">")
+    assert batch([tilt], [0.0], [0.0], [9.8]) == [scalar(tilt, 0.0, 0.0, 9.8)]
+
+
+@pytest.mark.parametrize("magnitude", [10.5, 12.0, 15.0, 15.000001])
+def test_accel_on_threshold_matches_scalar(magnitude):
+    assert batch([0.0], [0.0], [0.0], [magnitude]) == [scalar(0.0, 0.0, 0.0, magnitude)]
+
+
+def test_nan_is_normal():
+    assert batch([np.nan, 25.0], [0.0, np.nan], [0.0, 0.0], [9.8, 0.0]) == ["normal", "danger"]
+
+
+def test_uses_given_snapshot():
+    strict = SNAPSHOT._replace(version=2, tilt_warning=1.0, tilt_danger=2.0, tilt_critical=3.0)
+
+    assert batch([2.5], [0.0], [0.0], [9.8], snapshot=strict) == ["danger"]
+    assert scalar(2.5, 0.0, 0.0, 9.8, snapshot=strict) == "danger"
+
+
+def test_analyze_documents_matches_analyze_document():
+    rng = np.random.default_rng(11)
+    documents = [
+        {"deviceId": "ESP001", "data": {"tilt_angle": float(t), "accel_x": float(x),
+                                        "accel_y": 0.0, "accel_z": 9.8}}
+        for t, x in zip(rng.uniform(-40, 40, 500), rng.normal(0, 6, 500))
+    ]
+    singles = copy.deepcopy(documents)
+
+    worst = analyzer.analyze_documents(documents)
+    for document in singles:
+        analyzer.analyze_document(document)
+
+    assert [d["severity"] for d in documents] == [d["severity"] for d in singles]
+    assert [d["thresholdVersion"] for d in documents] == [d["thresholdVersion"] for d in singles]
+    assert worst == max((d["severity"] for d in singles), key=SEVERITY_LEVELS.index)
+    assert analyzer.analyze_documents([]) == "normal"
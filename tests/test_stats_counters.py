@@ -0,0 +1,122 @@
+"""
+StatsCounters: cộng deltas khi ingest, flush bằng $inc, rebuild từ sensor_data; giới hạn hours của timeline
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+from api.api import APIController
+from config.settings import settings
+from services.response_cache import response_cache
+from services.stats_counters import GLOBAL_ID, StatsCounters
+
+NOW = datetime(2025, 1, 1, 10, 30, 15)
+
+
+def reading(device_id: str, severity: str, timestamp: datetime):
+    return {"deviceId": device_id, "severity": severity, "timestamp": timestamp,
+            "data": {"tilt_angle": 1.0}}
+
+
+@pytest.fixture
+def readings():
+    return [
+        reading("ESP001", "normal", NOW),
+        reading("ESP001", "warning", NOW + timedelta(seconds=20)),
+        reading("ESP002", "critical", NOW + timedelta(minutes=1)),
+        reading("ESP002", "normal", NOW + timedelta(hours=1)),
+    ]
+
+
+def assert_counters(mongo):
+    assert mongo.stats_counters.find_one({"_id": GLOBAL_ID}) == {
+        "_id": GLOBAL_ID, "total": 4,
+        "severity": {"normal": 2, "warning": 1, "critical": 1}
+    }
+
+    devices = {d["_id"]: d for d in mongo.device_counters.find()}
+    assert devices["ESP001"]["total"] == 2
+    assert devices["ESP001"]["lastSeen"] == NOW + timedelta(seconds=20)
+    assert devices["ESP002"]["severity"] == {"critical": 1, "normal": 1}
+    assert devices["ESP002"]["lastSeen"] == NOW + timedelta(hours=1)
+
+    minutes = {b["_id"]: b["total"] for b in mongo.stats_minute.find()}
+    assert minutes == {
+        datetime(2025, 1, 1, 10, 30): 2,
+        datetime(2025, 1, 1, 10, 31): 1,
+        datetime(2025, 1, 1, 11, 30): 1
+    }
+    hours = {b["_id"]: b["total"] for b in mongo.stats_hour.find()}
+    assert hours == {datetime(2025, 1, 1, 10): 3, datetime(2025, 1, 1, 11): 1}
+
+
+def test_add_is_written_only_on_flush(mongo, readings):
+    counters = StatsCounters(flush_interval=3600)
+
+    counters.add(readings)
+    assert mongo.stats_counters.count_documents({}) == 0
+
+    assert counters.flush()
+    assert_counters(mongo)
+
+    # Không còn deltas: flush lần nữa không $inc thêm
+    assert counters.flush()
+    assert_counters(mongo)
+
+
+def test_flush_accumulates_across_batches(mongo, readings):
+    counters = StatsCounters(flush_interval=3600)
+
+    counters.add(readings[:2])
+    counters.flush()
+    counters.add(readings[2:])
+    counters.flush()
+
+    assert_counters(mongo)
+
+
+def test_rebuild_replaces_drifted_counters(mongo, readings):
+    mongo.sensor_data.insert_many(readings)
+    mongo.stats_counters.insert_one({"_id": GLOBAL_ID, "total": 999, "severity": {"normal": 999}})
+    mongo.device_counters.insert_one({"_id": "ESP999", "total": 1})
+
+    assert StatsCounters().rebuild() == 4
+
+    assert_counters(mongo)
+    assert mongo.device_counters.find_one({"_id": "ESP999"}) is None
+
+
+def test_timeline_returns_buckets_since(mongo, readings):
+    counters = StatsCounters(flush_interval=3600)
+    counters.add(readings)
+    counters.flush()
+
+    timeline = counters.get_timeline(NOW + timedelta(seconds=40))
+
+    assert [b["start"] for b in timeline] == [datetime(2025, 1, 1, 10, 30),
+                                              datetime(2025, 1, 1, 10, 31),
+                                              datetime(2025, 1, 1, 11, 30)]
+    assert [b["total"] for b in counters.get_timeline(NOW, "hour")] == [3, 1]
+
+
+@pytest.mark.parametrize("resolution, hours, status", [
+    ("minute", 1, 200),
+    ("minute", 7 * 24, 200),
+    ("minute", 7 * 24 + 1, 400),
+    ("minute", 0, 400),
+    ("minute", -5, 400),
+    ("hour", 24 * 365, 200),
+    ("hour", 10 ** 9, 400),
+])
+def test_timeline_hours_bounds(mongo, monkeypatch, resolution, hours, status):
+    monkeypatch.setattr(settings, "STATS_MINUTE_RETENTION_DAYS", 7)
+    monkeypatch.setattr(settings, "STATS_TIMELINE_MAX_HOURS", 24 * 365)
+    response_cache.invalidate()
+
+    with Flask(__name__).test_request_context():
+        response = APIController().get_statistics_timeline(resolution=resolution, hours=hours)
+
+    # Lỗi: (response, status); thành công: response
+    assert (response[1] if isinstance(response, tuple) else response.status_code) == status
@@ -0,0 +1,149 @@
+"""
+Danh sách token thu hồi: chặn ngay trong process, đồng bộ sang process khác qua MongoDB, fail closed
+"""
+
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import PyMongoError
+
+import services.token_revocation as token_revocation
+from services.auth import auth_service
+from services.token_revocation import TokenRevocationList
+
+
+def new_jti() -> str:
+    return uuid.uuid4().hex
+
+
+def in_one_hour() -> datetime:
+    return datetime.utcnow() + timedelta(hours=1)
+
+
+def test_revoked_in_same_process(mongo):
+    revocations = TokenRevocationList(refresh_interval=3600)
+    jti = new_jti()
+
+    assert not revocations.is_revoked(jti)
+    revocations.revoke(jti, in_one_hour())
+
+    assert revocations.is_revoked(jti)
+    assert mongo.revoked_tokens.find_one({"_id": jti}) is not None
+
+
+def test_revoke_twice_is_harmless(mongo):
+    revocations = TokenRevocationList(refresh_interval=3600)
+    jti = new_jti()
+
+    revocations.revoke(jti, in_one_hour())
+    revocations.revoke(jti, in_one_hour())
+
+    assert mongo.revoked_tokens.count_documents({}) == 1
+
+
+def test_other_process_sees_revocation_after_refresh(mongo):
+    worker_a = TokenRevocationList(refresh_interval=3600)
+    worker_b = TokenRevocationList(refresh_interval=3600)
+    jti = new_jti()
+    # Lần gọi đầu dựng filter, lần refresh kế tiếp sau refresh_interval
+    assert not worker_b.is_revoked(jti)
+
+    worker_a.revoke(jti, in_one_hour())
+    # Chưa tới lần refresh: bloom filter của worker B chưa có jti
+    assert not worker_b.is_revoked(jti)
+
+    assert worker_b.refresh() == 1
+    assert worker_b.is_revoked(jti)
+
+
+def test_expired_revocations_are_not_loaded(mongo):
+    mongo.revoked_tokens.insert_one({"_id": "expired",
+                                     "expiresAt": datetime.utcnow() - timedelta(minutes=1)})
+    revocations = TokenRevocationList(refresh_interval=0)
+
+    assert revocations.refresh() == 0
+    assert not revocations.is_revoked("expired")
+
+
+def test_fail_closed_when_mongodb_unavailable(mongo, monkeypatch):
+    jti = new_jti()
+    mongo.revoked_tokens.insert_one({"_id": jti, "expiresAt": in_one_hour()})
+    revocations = TokenRevocationList(refresh_interval=3600)
+    assert revocations.is_revoked(jti)
+
+    class Unavailable:
+        def find_one(self, *args, **kwargs):
+            raise PyMongoError("connection refused")
+
+    monkeypatch.setattr(token_revocation, "get_revoked_tokens_collection", lambda: Unavailable())
+
+    # Bloom filter báo "có thể có" nhưng không xác nhận được: từ chối
+    assert revocations.is_revoked(jti)
+    # jti không có trong filter không cần hỏi MongoDB
+    assert not revocations.is_revoked(new_jti())
+
+
+def test_logout_revokes_token(mongo):
+    token = auth_service.login("user", "user123")
+    assert auth_service.verify_token(token) is not None
+
+    assert auth_service.logout(token)
+
+    assert auth_service.verify_token(token) is None
+    assert not auth_service.logout(token)
+
+
+@pytest.mark.parametrize("role, allowed", [(None, True), ("admin", False)])
+def test_require_auth_checks_role(mongo, role, allowed):
+    token = auth_service.login("user", "user123")
+    assert auth_service.require_auth(token, role) is allowed
+
+
+def test_claim_succeeds_only_once_across_processes(mongo):
+    worker_a = TokenRevocationList(refresh_interval=3600)
+    worker_b = TokenRevocationList(refresh_interval=3600)
+    jti = new_jti()
+
+    assert worker_a.claim(jti, in_one_hour())
+    assert not worker_b.claim(jti, in_one_hour())
+    assert not worker_a.claim(jti, in_one_hour())
+    assert worker_b.is_revoked(jti)
+
+
+def test_claim_fails_closed_when_mongodb_unavailable(mongo, monkeypatch):
+    class Unavailable:
+        def insert_one(self, *args, **kwargs):
+            raise PyMongoError("connection refused")
+
+    monkeypatch.setattr(token_revocation, "get_revoked_tokens_collection", lambda: Unavailable())
+    revocations = TokenRevocationList(refresh_interval=3600)
+
+    assert not revocations.claim(new_jti(), in_one_hour())
+
+
+def test_stream_ticket_redeemed_once_under_concurrency(mongo):
+    ticket = auth_service.issue_stream_ticket(auth_service.login("user", "user123"))
+    barrier = threading.Barrier(8)
+    results = []
+
+    def redeem():
+        barrier.wait()
+        results.append(auth_service.redeem_stream_ticket(ticket))
+
+    threads = [threading.Thread(target=redeem) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 1
+    assert not auth_service.redeem_stream_ticket(ticket)
+
+
+def test_stream_ticket_with_wrong_role_is_rejected(mongo):
+    ticket = auth_service.issue_stream_ticket(auth_service.login("user", "user123"))
+
+    assert not auth_service.redeem_stream_ticket(ticket, "admin")
+    assert not auth_service.redeem_stream_ticket(auth_service.login("user", "user123"))
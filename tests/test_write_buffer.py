@@ -0,0 +1,144 @@
+"""
+IngestWriteBuffer._insert_batch: lỗi một phần, lỗi tạm thời được gửi lại, hook lỗi không làm mất batch
+"""
+
+from bson import ObjectId
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError, OperationFailure
+
+import services.write_buffer as write_buffer
+from config.settings import settings
+from services.alert_engine import alert_engine
+from services.device_latest import device_latest_store
+from services.stats_counters import stats_counters
+from services.write_buffer import IngestWriteBuffer
+
+
+class FakeCollection:
+    """insert_many lần lượt raise các lỗi trong errors, hết lỗi thì ghi thành công"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def insert_many(self, documents, ordered=True):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return type("InsertManyResult", (), {"inserted_ids": [d["_id"] for d in documents]})()
+
+
+def bulk_error(*write_errors):
+    return BulkWriteError({"writeErrors": [{"index": index, "code": code, "errmsg": "error"}
+                                           for index, code in write_errors]})
+
+
+@pytest.fixture
+def batch():
+    return [{"_id": ObjectId(), "deviceId": f"ESP{index:03d}"} for index in range(5)]
+
+
+@pytest.fixture
+def hooks(monkeypatch):
+    """Ghi lại các document được chuyển cho hook"""
+    saved = []
+    monkeypatch.setattr(write_buffer, "run_saved_hooks", saved.append)
+    return saved
+
+
+def use(monkeypatch, collection: FakeCollection):
+    monkeypatch.setattr(write_buffer, "get_sensor_collection", lambda: collection)
+    monkeypatch.setattr(write_buffer.time, "sleep", lambda seconds: None)
+
+
+def test_success(monkeypatch, batch, hooks):
+    use(monkeypatch, FakeCollection())
+
+    assert IngestWriteBuffer._insert_batch(batch) == (5, 0, 0)
+    assert hooks == [batch]
+
+
+def test_partial_failure_runs_hooks_with_saved_only(monkeypatch, batch, hooks):
+    use(monkeypatch, FakeCollection(bulk_error((1, 121), (3, 121))))
+
+    assert IngestWriteBuffer._insert_batch(batch) == (3, 2, 0)
+    assert hooks == [[batch[0], batch[2], batch[4]]]
+
+
+def test_duplicate_on_first_attempt_counts_as_failed(monkeypatch, batch, hooks):
+    use(monkeypatch, FakeCollection(bulk_error((0, 11000))))
+
+    assert IngestWriteBuffer._insert_batch(batch) == (4, 1, 0)
+
+
+def test_transient_error_is_retried(monkeypatch, batch, hooks):
+    collection = FakeCollection(AutoReconnect("primary stepped down"))
+    use(monkeypatch, collection)
+
+    assert IngestWriteBuffer._insert_batch(batch, attempts=3, backoff=0) == (5, 0, 1)
+    assert collection.calls == 2
+    assert hooks == [batch]
+
+
+def test_retry_after_partial_insert_counts_duplicates_as_saved(monkeypatch, batch, hooks):
+    # Lần 1 mất kết nối sau khi đã ghi 0-2; lần 2 báo duplicate cho các document đó
+    use(monkeypatch, FakeCollection(AutoReconnect("connection reset"),
+                                    bulk_error((0, 11000), (1, 11000), (2, 11000), (4, 121))))
+
+    assert IngestWriteBuffer._insert_batch(batch, attempts=3, backoff=0) == (4, 1, 1)
+    assert hooks == [batch[:4]]
+
+
+def test_gives_up_after_attempts(monkeypatch, batch, hooks):
+    collection = FakeCollection(*[AutoReconnect("down")] * 3)
+    use(monkeypatch, collection)
+
+    assert IngestWriteBuffer._insert_batch(batch, attempts=3, backoff=0) == (0, 5, 2)
+    assert collection.calls == 3
+    assert hooks == []
+
+
+def test_non_transient_error_is_not_retried(monkeypatch, batch, hooks):
+    collection = FakeCollection(OperationFailure("not authorized", code=13))
+    use(monkeypatch, collection)
+
+    assert IngestWriteBuffer._insert_batch(batch, attempts=3, backoff=0) == (0, 5, 0)
+    assert collection.calls == 1
+
+
+def test_failing_hook_does_not_stop_other_hooks(monkeypatch, batch):
+    calls = []
+
+    def broken(documents):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(settings, "LATEST_STATE_BACKEND", "collection")
+    monkeypatch.setattr(settings, "STATS_COUNTERS_ENABLED", True)
+    monkeypatch.setattr(settings, "ALERT_ENGINE_ENABLED", True)
+    monkeypatch.setattr(device_latest_store, "upsert", broken)
+    monkeypatch.setattr(stats_counters, "add", lambda documents: calls.append("stats"))
+    monkeypatch.setattr(alert_engine, "process", lambda documents: calls.append("alerts"))
+    monkeypatch.setattr(write_buffer.latest_cache, "update_many", broken)
+    monkeypatch.setattr(write_buffer.response_cache, "records_changed",
+                        lambda documents: calls.append("cache"))
+    monkeypatch.setattr(write_buffer.event_bus, "publish_documents",
+                        lambda documents: calls.append("sse"))
+    use(monkeypatch, FakeCollection())
+
+    assert IngestWriteBuffer._insert_batch(batch) == (5, 0, 0)
+    assert calls == ["stats", "alerts", "cache", "sse"]
+
+
+def test_unsaved_documents_are_not_published(monkeypatch, batch):
+    published = []
+    monkeypatch.setattr(write_buffer.latest_cache, "update_many", published.extend)
+    monkeypatch.setattr(write_buffer.event_bus, "publish_documents", published.extend)
+    use(monkeypatch, FakeCollection(bulk_error((2, 121)), AutoReconnect("down")))
+
+    IngestWriteBuffer._insert_batch(batch)
+    assert batch[2] not in published
+    assert published.count(batch[0]) == 2
+
+    published.clear()
+    assert IngestWriteBuffer._insert_batch(batch, attempts=1) == (0, 5, 0)
+    assert published == []
@@ -0,0 +1,53 @@
+"""
+Bloom filter nhỏ gọn trong bộ nhớ
+Trả lời "chắc chắn không có" hoặc "có thể có" (false positive theo error_rate)
+"""
+
+import hashlib
+import math
+from typing import Iterable
+
+
+class BloomFilter:
+    """
+    Bloom filter trên bytearray, k hàm hash bằng double hashing từ một digest blake2b
+
+    Kích thước m = -n·ln(p) / ln(2)² bit và k = m/n·ln(2) cho n phần tử với tỉ lệ
+    false positive p. Không hỗ trợ xóa: dựng lại khi tập phần tử thay đổi.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    @classmethod
+    def from_items(cls, items: Iterable[str], capacity: int,
+                   error_rate: float = 0.001) -> "BloomFilter":
+        """Tạo filter chứa sẵn các phần tử"""
+        bloom = cls(capacity, error_rate)
+        for item in items:
+            bloom.add(item)
+        return bloom
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str):
+        """Thêm phần tử"""
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+    def __len__(self) -> int:
+        return self.count
@@ -0,0 +1,78 @@
+"""
+Metrics đơn giản trong process
+Đếm latency (p50/p99) cho ingest và các service khác
+"""
+
+import threading
+from collections import deque
+from typing import Dict, Any
+
+
+class LatencyTracker:
+    """
+    Theo dõi latency theo cửa sổ trượt (giữ N mẫu gần nhất)
+
+    Percentile tính trên cửa sổ nên phản ánh tải hiện tại,
+    còn count/total tích lũy từ lúc khởi động.
+    """
+
+    def __init__(self, name: str, window: int = 10000):
+        self.name = name
+        self._samples = deque(maxlen=window)
+        self._count = 0
+        self._total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        """Ghi nhận một mẫu latency (giây)"""
+        with self._lock:
+            self._samples.append(seconds)
+            self._count += 1
+            self._total += seconds
+
+    def percentile(self, p: float) -> float:
+        """
+        Lấy percentile trên cửa sổ hiện tại
+
+        Args:
+            p: Percentile (0-100)
+
+        Returns:
+            Latency (giây), 0.0 nếu chưa có mẫu
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        return self._pick(samples, p)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Lấy thống kê dạng dict (latency theo ms)"""
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self._count
+            total = self._total
+
+        return {
+            "count": count,
+            "avg_ms": round(total / count * 1000, 3) if count else 0.0,
+            "p50_ms": round(self._pick(samples, 50) * 1000, 3),
+            "p99_ms": round(self._pick(samples, 99) * 1000, 3),
+            "max_ms": round(samples[-1] * 1000, 3) if samples else 0.0
+        }
+
+    @staticmethod
+    def _pick(samples: list, p: float) -> float:
+        """Nearest-rank percentile trên list đã sort"""
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))]
+
+    def reset(self):
+        """Xóa toàn bộ mẫu"""
+        with self._lock:
+            self._samples.clear()
+            self._count = 0
+            self._total = 0.0
+
+
+# Latency end-to-end của CoAP ingest (render_post)
+ingest_latency = LatencyTracker("coap_ingest")
@@ -0,0 +1,68 @@
+"""
+JSON encoder cho response API
+Ghi thẳng document MongoDB (ObjectId, datetime, ...) ra JSON bytes trong một lượt,
+cùng định dạng với bson.json_util (relaxed) mà API đang trả về
+"""
+
+import json
+from datetime import datetime
+from typing import Any
+from bson import ObjectId, json_util
+from flask import Response
+
+# JSON encoder nhanh (optional)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Giống jsonify của Flask: key sắp xếp, không khoảng trắng
+_ORJSON_OPTIONS = (
+    orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    if orjson is not None else 0
+)
+
+
+def _default(obj: Any) -> Any:
+    """
+    Chuyển kiểu BSON sang kiểu JSON (Extended JSON relaxed)
+
+    ObjectId và datetime naive (UTC, kiểu mà pymongo trả về) đi đường nhanh;
+    các kiểu khác dùng json_util.default.
+    """
+    if isinstance(obj, ObjectId):
+        return {"$oid": str(obj)}
+    if isinstance(obj, datetime) and obj.tzinfo is None and obj.year >= 1970:
+        millis = obj.microsecond // 1000
+        fraction = f".{millis:03d}" if millis else ""
+        return {"$date": f"{obj.isoformat(timespec='seconds')}{fraction}Z"}
+    return json_util.default(obj, json_util.DEFAULT_JSON_OPTIONS)
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Serialize object (có thể chứa kiểu BSON) thành JSON bytes
+
+    Args:
+        obj: Document, list document hoặc dict bất kỳ
+
+    Returns:
+        JSON UTF-8 (NaN/Infinity thành null khi dùng orjson)
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, default=_default, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(obj: Any, status: int = 200) -> Response:
+    """
+    Response JSON thay cho jsonify(json.loads(json_util.dumps(obj)))
+
+    Args:
+        obj: Dữ liệu trả về
+        status: HTTP status code
+
+    Returns:
+        Flask Response (application/json)
+    """
+    return Response(dumps(obj), status=status, mimetype="application/json")
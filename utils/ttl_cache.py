@@ -0,0 +1,68 @@
+"""
+LRU cache có TTL (thread-safe)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Giữ tối đa maxsize entry, entry hết hạn sau ttl giây (hoặc ttl riêng khi set)
+
+    Truy cập đưa entry lên cuối (mới dùng nhất); đầy thì bỏ entry lâu không dùng nhất.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Giá trị còn hạn, default nếu không có/đã hết hạn"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self._stats["misses"] += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Lưu giá trị
+
+        Args:
+            key: Khóa
+            value: Giá trị
+            ttl: Thời gian sống riêng (giây), mặc định self.ttl
+        """
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        """Xóa entry"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Xóa toàn bộ"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        """Số entry và hit/miss"""
+        with self._lock:
+            return {"size": len(self._entries), **self._stats}
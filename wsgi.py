@@ -0,0 +1,16 @@
+"""
+wsgi.py - WSGI entry point cho HTTP API (production)
+Chạy HTTP API bằng gunicorn, tách khỏi CoAP ingest:
+
+    python main.py --no-http                 # CoAP ingest + rollup
+    gunicorn -c gunicorn.conf.py wsgi:app    # HTTP API, HTTP_WORKERS x HTTP_THREADS
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from servers.http_server_swagger import app  # noqa: E402
+
+__all__ = ["app"]